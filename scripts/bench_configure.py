@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+
+import asyncio
+import click
+import logzero
+import time
+from expect import Vyos
+from fake_vyos_console import serve
+
+
+def synthetic_configuration(lines):
+    return "\n".join(
+        f"set interfaces dummy dum{n} address '10.{n // 256 % 256}.{n % 256}.1/32'"
+        for n in range(lines)
+    )
+
+
+async def bench_configure_run(commands, delay, bulk, window):
+    # a new fake router for every run, so that every run changes its configuration
+    servers = await serve("127.0.0.1", 0, 1, delay=delay)
+    port = servers[0].sockets[0].getsockname()[1]
+    try:
+        async with Vyos(host="127.0.0.1", port=port) as v:
+            await v.login("vyos", "vyos")
+            start = time.perf_counter()
+            await v.configure(commands, bulk=bulk, window=window)
+            seconds = time.perf_counter() - start
+            configuration = await v.get_configuration(commands=True)
+            await v.logout()
+    finally:
+        for server in servers:
+            server.close()
+
+    missing = set(commands.splitlines()) - set(configuration.splitlines())
+    if missing:
+        raise click.ClickException(f"{len(missing)} commands missing after configure")
+    return seconds
+
+
+@click.command()
+@click.option(
+    "--lines",
+    default="100,500,2000",
+    show_default=True,
+    help="comma separated numbers of configuration lines",
+)
+@click.option(
+    "--delay",
+    default=1.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="milliseconds before each answer of the fake console",
+)
+@click.option(
+    "--window",
+    default=Vyos.BULK_WINDOW,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="commands sent ahead of their prompts in bulk mode",
+)
+def bench_configure(lines, delay, window):
+    """Compares line by line and bulk Vyos.configure against a fake console."""
+    logzero.loglevel(logzero.ERROR)
+    click.echo(f"{'lines':>6} {'line by line':>13} {'bulk':>9} {'speedup':>8}")
+    for size in [int(n) for n in lines.split(",")]:
+        commands = synthetic_configuration(size)
+        line_by_line = asyncio.run(
+            bench_configure_run(commands, delay / 1000, False, window)
+        )
+        bulk = asyncio.run(bench_configure_run(commands, delay / 1000, True, window))
+        click.echo(
+            f"{size:>6} {line_by_line:>13.3f} {bulk:>9.3f} "
+            f"{line_by_line / bulk:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    bench_configure()
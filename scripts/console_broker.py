@@ -0,0 +1,493 @@
+#! /usr/bin/env python
+
+import asyncio
+import click
+import json
+import logzero
+import os
+import signal
+import time
+from logzero import logger
+from expect import DRIVERS, CommandResult, ConfigurationError, Modes
+
+DEFAULT_SOCKET = os.path.join(click.get_app_dir("console-broker"), "broker.sock")
+
+# driver methods which clients may call through the broker
+METHODS = (
+    "run_command",
+    "configure",
+    "push_configuration",
+    "get_configuration",
+    "get_configurations",
+    "get_running_configuration",
+    "get_configuration_commands",
+    "get_configuration_json",
+)
+
+
+class BrokerError(Exception):
+    pass
+
+
+class SessionEvicted(Exception):
+    """The session was evicted while a request waited for it."""
+
+
+class BrokerSession:
+    """Logged in console session kept by the broker, used by one client at a
+    time. There is one session per console, logged in again when a client uses
+    another driver or user."""
+
+    def __init__(self, host, port, driver, login=None, password=None):
+        self.host = host
+        self.port = port
+        self.driver = driver
+        self.login = login
+        self.password = password
+        self.lock = asyncio.Lock()
+        self.v = None
+        self.created = None
+        self.last_used = time.monotonic()
+        self.uses = 0
+        self.logins = 0
+        self.probes = 0
+        self.errors = 0
+        self.last_error = None
+        self.evicted = False
+
+    @property
+    def idle(self):
+        return time.monotonic() - self.last_used
+
+    async def ready(self, probe_after):
+        # opens and logs in the session if needed, a session idle for more than
+        # probe_after seconds is checked with Enter, as the node may have logged it
+        # out or someone else may have used the console
+        if self.v is None or self.v.eof:
+            self.v = await self.driver(host=self.host, port=self.port).open()
+            self.created = time.monotonic()
+            await self.v.login(self.login, self.password)
+            self.logins += 1
+        elif self.idle > probe_after or self.v.mode is not Modes.OPERATIONAL:
+            self.v.write_line()
+            await self.v.expect_prompt("probe", sample=False)
+            self.probes += 1
+            # changes left uncommitted are discarded, without logging in again
+            if self.v.mode is Modes.CONFIGURATION:
+                await self.v.send_command(self.v.DISCARD_COMMAND)
+            if self.v.mode is not Modes.OPERATIONAL:
+                await self.v.login(self.login, self.password)
+                self.logins += 1
+        return self.v
+
+    async def switch(self, driver, login, password):
+        # the console is used with another driver or user, the session is logged
+        # out and logged in again as requested
+        if (driver, login, password) != (self.driver, self.login, self.password):
+            logger.info(f"{self.host}:{self.port}: switching to {driver.NAME} {login}")
+            await self.close()
+            self.driver, self.login, self.password = driver, login, password
+
+    async def call(self, method, args, kwargs, probe_after, credentials=None):
+        # credentials are the (driver, login, password) of the request
+        async with self.lock:
+            if self.evicted:
+                raise SessionEvicted()
+            try:
+                if credentials:
+                    await self.switch(*credentials)
+                v = await self.ready(probe_after)
+                if method is None:
+                    return None
+                return await getattr(v, method)(*args, **kwargs)
+            except ConfigurationError:
+                # the commands failed, not the session
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{e.__class__.__name__}: {e}"
+                # the session is opened again on its next use
+                await self.close()
+                raise
+            finally:
+                self.uses += 1
+                self.last_used = time.monotonic()
+
+    async def close(self):
+        if self.v is None:
+            return
+        try:
+            if not self.v.eof:
+                await self.v.logout()
+        except Exception as e:
+            logger.debug(f"{self.host}:{self.port}: logout failed, {e!r}")
+        self.v.close()
+        self.v = None
+
+    def health(self):
+        open_ = self.v is not None and not self.v.eof
+        if not open_:
+            state = "closed"
+        elif self.lock.locked():
+            state = "busy"
+        else:
+            state = "ready"
+        return {
+            "console": f"{self.host}:{self.port}",
+            "driver": self.driver.NAME,
+            "login": self.login,
+            "state": state,
+            "mode": self.v.mode.name if open_ else None,
+            "age": round(time.monotonic() - self.created, 1) if open_ else None,
+            "idle": round(self.idle, 1),
+            "uses": self.uses,
+            "logins": self.logins,
+            "probes": self.probes,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "srtt": self.v.latency.srtt if open_ else None,
+        }
+
+
+def encode_result(result):
+    if isinstance(result, CommandResult):
+        return {
+            "command": result.command,
+            "output": result.output,
+            "mode": result.mode.name,
+            "seconds": result.seconds,
+        }
+    return result
+
+
+class ConsoleBroker:
+    """Keeps logged in console sessions, shared by the clients of a local socket.
+
+    A client sends one JSON request per line and gets one JSON response per line.
+    Requests to a console are served one at a time, and a session idle for more
+    than idle_timeout seconds is logged out and closed.
+    """
+
+    def __init__(self, idle_timeout=300.0, probe_after=30.0):
+        self.idle_timeout = idle_timeout
+        self.probe_after = probe_after
+        self.sessions = dict()
+        self.started = time.monotonic()
+        self.requests = 0
+        self.evictions = 0
+
+    def session(self, request):
+        # the session of a console, whatever the driver and user of the request,
+        # so that its requests are served one at a time
+        host, port = request["console"].rsplit(":", 1)
+        driver = DRIVERS[request.get("driver") or "vyos"]
+        key = (host, int(port))
+        if key not in self.sessions:
+            self.sessions[key] = BrokerSession(
+                host, int(port), driver, request.get("login"), request.get("password")
+            )
+        return self.sessions[key]
+
+    async def call(self, request, method, args=(), kwargs=None):
+        credentials = (
+            DRIVERS[request.get("driver") or "vyos"],
+            request.get("login"),
+            request.get("password"),
+        )
+        while True:
+            s = self.session(request)
+            try:
+                result = await s.call(
+                    method, args, kwargs or {}, self.probe_after, credentials
+                )
+            except SessionEvicted:
+                # evicted while the request waited, the console gets a new session
+                continue
+            return s, result
+
+    def status(self):
+        return {
+            "uptime": round(time.monotonic() - self.started, 1),
+            "requests": self.requests,
+            "evictions": self.evictions,
+            "idle_timeout": self.idle_timeout,
+            "sessions": [s.health() for s in self.sessions.values()],
+        }
+
+    async def handle_request(self, request):
+        self.requests += 1
+        op = request.get("op")
+        if op == "status":
+            return self.status()
+        if op == "open":
+            s, _ = await self.call(request, None)
+            return s.health()
+        if op == "call":
+            method = request.get("method")
+            if method not in METHODS:
+                raise BrokerError(f"unknown method {method}")
+            _, result = await self.call(
+                request, method, request.get("args", ()), request.get("kwargs", {})
+            )
+            return encode_result(result)
+        raise BrokerError(f"unknown op {op}")
+
+    async def handle_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    response = {"result": await self.handle_request(json.loads(line))}
+                except ConfigurationError as e:
+                    response = {"error": str(e), "errors": e.errors}
+                except Exception as e:
+                    logger.debug(f"request failed: {e!r}")
+                    response = {"error": f"{e.__class__.__name__}: {e}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def evict_idle(self):
+        # sessions in use are never evicted
+        while True:
+            await asyncio.sleep(min(self.idle_timeout / 4, 30))
+            await self.evict(self.idle_timeout)
+
+    async def evict(self, idle_timeout):
+        # a session is logged out under its lock, so that the requests to its
+        # console wait for the logout, then get a new session
+        for key, s in list(self.sessions.items()):
+            if s.lock.locked() or s.idle <= idle_timeout:
+                continue
+            async with s.lock:
+                logger.info(f"evicting {s.host}:{s.port}, idle for {s.idle:.0f}s")
+                await s.close()
+                s.evicted = True
+                del self.sessions[key]
+                self.evictions += 1
+
+    async def close(self):
+        for s in list(self.sessions.values()):
+            await s.close()
+        self.sessions.clear()
+
+    async def serve(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle_client, path)
+        # sessions are logged in, only the user may use them
+        os.chmod(path, 0o600)
+        evictor = asyncio.ensure_future(self.evict_idle())
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+        logger.info(f"console broker on {path}")
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            logger.info("console broker stopped")
+        finally:
+            evictor.cancel()
+            await self.close()
+            os.unlink(path)
+
+
+async def broker_request(path, request):
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        writer.write(json.dumps(request).encode() + b"\n")
+        response = json.loads(await reader.readline())
+    finally:
+        writer.close()
+    if "error" in response:
+        raise BrokerError(response["error"])
+    return response["result"]
+
+
+class BrokeredConsole:
+    """Console session of the broker, with the driver methods of METHODS.
+
+    login and logout do nothing, as the broker keeps the session logged in.
+    """
+
+    def __init__(self, path, host, port, driver="vyos", login=None, password=None):
+        self.path = path
+        self.request = {
+            "console": f"{host}:{port}",
+            "driver": driver,
+            "login": login,
+            "password": password,
+        }
+        self.NAME = driver
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        return self
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def login(self, login=None, password=None):
+        pass
+
+    async def logout(self):
+        pass
+
+    async def _call(self, method, *args, **kwargs):
+        request = dict(self.request, op="call", method=method, args=args, kwargs=kwargs)
+        self.writer.write(json.dumps(request).encode() + b"\n")
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise BrokerError("connection to the broker closed")
+        response = json.loads(line)
+        if "errors" in response:
+            raise ConfigurationError([tuple(e) for e in response["errors"]])
+        if "error" in response:
+            raise BrokerError(response["error"])
+        return response["result"]
+
+    async def run_command(self, command, configuration=False):
+        r = await self._call("run_command", command, configuration=configuration)
+        return CommandResult(r["command"], r["output"], Modes[r["mode"]], r["seconds"])
+
+    def __getattr__(self, name):
+        # the other methods return JSON values, called as they are
+        if name not in METHODS:
+            raise AttributeError(name)
+
+        async def method(*args, **kwargs):
+            return await self._call(name, *args, **kwargs)
+
+        return method
+
+
+@click.group()
+@click.option("-v", "--verbose", count=True)
+def console_broker(verbose):
+    """Keeps logged in console sessions for the console scripts."""
+    logzero.loglevel(logzero.DEBUG if verbose else logzero.INFO)
+
+
+@console_broker.command(name="serve")
+@click.option(
+    "--socket",
+    "path",
+    envvar="CONSOLE_BROKER",
+    default=DEFAULT_SOCKET,
+    show_default=True,
+    help="local socket of the broker",
+)
+@click.option(
+    "--idle-timeout",
+    default=300.0,
+    show_default=True,
+    type=click.FloatRange(min=1),
+    help="seconds after which an unused session is closed",
+)
+@click.option(
+    "--probe-after",
+    default=30.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="seconds after which an unused session is checked before its next use",
+)
+def serve_command(path, idle_timeout, probe_after):
+    """Serves the console sessions on a local socket."""
+    broker = ConsoleBroker(idle_timeout, probe_after)
+    try:
+        asyncio.run(broker.serve(path))
+    except KeyboardInterrupt:
+        pass
+
+
+@console_broker.command()
+@click.option(
+    "--socket",
+    "path",
+    envvar="CONSOLE_BROKER",
+    default=DEFAULT_SOCKET,
+    show_default=True,
+    help="local socket of the broker",
+)
+@click.option("--json", "as_json", is_flag=True, help="print the status as JSON")
+def status(path, as_json):
+    """Prints the sessions of the broker and their health."""
+    try:
+        result = asyncio.run(broker_request(path, {"op": "status"}))
+    except OSError as e:
+        raise click.ClickException(f"no broker on {path}: {e}")
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+    click.echo(
+        f"up {result['uptime']}s, {result['requests']} requests, "
+        f"{result['evictions']} sessions evicted after {result['idle_timeout']}s idle"
+    )
+    for s in result["sessions"]:
+        click.echo(
+            f"{s['console']:<22} {s['driver']:<6} {s['state']:<7} "
+            f"{s['mode'] or '-':<14} idle={s['idle']}s uses={s['uses']} "
+            f"logins={s['logins']} probes={s['probes']} errors={s['errors']}"
+            + (f" last error: {s['last_error']}" if s["last_error"] else "")
+        )
+
+
+@console_broker.command(name="open")
+@click.option(
+    "--socket",
+    "path",
+    envvar="CONSOLE_BROKER",
+    default=DEFAULT_SOCKET,
+    show_default=True,
+    help="local socket of the broker",
+)
+@click.option(
+    "--driver",
+    default="vyos",
+    show_default=True,
+    type=click.Choice(list(DRIVERS)),
+    help="console driver of the nodes",
+)
+@click.option("--login", help="user, the default user of the driver by default")
+@click.option("--password", help="password, the default one of the driver by default")
+@click.argument("consoles", nargs=-1, required=True)
+def open_command(path, driver, login, password, consoles):
+    """Opens and logs in sessions to CONSOLES (host:port) ahead of their use."""
+
+    async def main():
+        requests = [
+            {
+                "op": "open",
+                "console": console,
+                "driver": driver,
+                "login": login,
+                "password": password,
+            }
+            for console in consoles
+        ]
+        return await asyncio.gather(
+            *[broker_request(path, r) for r in requests], return_exceptions=True
+        )
+
+    failed = 0
+    for console, result in zip(consoles, asyncio.run(main())):
+        if isinstance(result, Exception):
+            failed += 1
+            click.echo(f"{console}: {result}")
+        else:
+            click.echo(f"{console}: {result['state']}, {result['mode']}")
+    if failed:
+        raise click.ClickException(f"{failed} sessions failed")
+
+
+if __name__ == "__main__":
+    console_broker()
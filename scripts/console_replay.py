@@ -0,0 +1,252 @@
+#! /usr/bin/env python
+
+import asyncio
+import click
+import logzero
+import re
+import statistics
+import time
+from logzero import logger
+from expect import DRIVERS, Recorder, load_recording
+
+
+class ReplayConsole(asyncio.Protocol):
+    """Telnet console replaying a recording to each connection.
+
+    The data received by the recorded client is sent again with the recorded
+    delays divided by speed, all at once with a speed of 0. The replay waits for
+    the data the recorded client sent before going on, so that it stays in step
+    with a client running the same session.
+    """
+
+    # telnet option negotiation, whose order with the data depends on timing
+    NEGOTIATION_RE = re.compile(b"\xff[\xfb-\xfe].", re.DOTALL)
+
+    def __init__(self, events, speed=1.0, strict=False):
+        self.events = events
+        self.speed = speed
+        self.strict = strict
+        self.transport = None
+        self.received = b""
+        self._pending = b""
+        self._data = asyncio.Event()
+        self._task = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._task = asyncio.ensure_future(self.replay())
+
+    def connection_lost(self, exc):
+        if self._task:
+            self._task.cancel()
+
+    def data_received(self, data):
+        data = self.NEGOTIATION_RE.sub(b"", self._pending + data)
+        # an option negotiation may be split between two packets
+        split = data.rfind(b"\xff", max(len(data) - 2, 0))
+        if split >= 0 and data[split:] != b"\xff\xff":
+            data, self._pending = data[:split], data[split:]
+        else:
+            self._pending = b""
+        self.received += data
+        self._data.set()
+
+    async def _receive(self, expected):
+        # waits for as many bytes as the recorded client sent, returns False if
+        # they differ and the replay is strict
+        expected = self.NEGOTIATION_RE.sub(b"", expected)
+        while len(self.received) < len(expected):
+            self._data.clear()
+            await self._data.wait()
+        data = self.received[: len(expected)]
+        self.received = self.received[len(expected) :]
+        if data != expected:
+            logger.warning(f"expected {expected!r}, received {data!r}")
+            return not self.strict
+        return True
+
+    async def replay(self):
+        last = 0.0
+        for t, direction, data in self.events:
+            if direction == "out":
+                if not await self._receive(data):
+                    self.transport.close()
+                    return
+            else:
+                if self.speed:
+                    await asyncio.sleep(max(t - last, 0) / self.speed)
+                if self.transport.is_closing():
+                    return
+                self.transport.write(data)
+            last = t
+        logger.debug("end of the recording")
+
+
+async def serve(host, base_port, recordings, speed=1.0, strict=False):
+    # one recording per port, from base_port to base_port + len(recordings) - 1
+    loop = asyncio.get_running_loop()
+    servers = list()
+    for n, path in enumerate(recordings):
+        _, events, _ = load_recording(path)
+        server = await loop.create_server(
+            lambda events=events: ReplayConsole(events, speed, strict),
+            host,
+            base_port + n if base_port else 0,
+        )
+        servers.append(server)
+    return servers
+
+
+async def run_session(driver, host, port, session, recorder=None):
+    # the session of a recording: login, commands, configuration and logout
+    async with driver(host=host, port=port, recorder=recorder) as v:
+        await v.login(session.get("login"), session.get("password"))
+        for command in session.get("commands", ()):
+            await v.run_command(command)
+        if session.get("configuration"):
+            await v.configure(session["configuration"], bulk=session.get("bulk"))
+        await v.logout()
+    return v
+
+
+def configure_logging(verbose):
+    logzero.loglevel(logzero.DEBUG if verbose else logzero.WARNING)
+
+
+@click.group()
+def console_replay():
+    """Records console sessions, and replays them over telnet without the nodes."""
+
+
+@console_replay.command()
+@click.option("-v", "--verbose", count=True)
+@click.option(
+    "--driver",
+    default="vyos",
+    show_default=True,
+    type=click.Choice(list(DRIVERS)),
+    help="console driver of the node",
+)
+@click.option("--login", help="user, the default user of the driver by default")
+@click.option("--password", help="password, the default one of the driver by default")
+@click.option(
+    "-c", "--command", "commands", multiple=True, help="command run in the session"
+)
+@click.option(
+    "--configure",
+    "configuration",
+    type=click.File(),
+    help="file of configuration commands applied in the session",
+)
+@click.option(
+    "--line-by-line", is_flag=True, help="configure line by line instead of in bulk"
+)
+@click.argument("console")
+@click.argument("recording", type=click.Path(dir_okay=False, writable=True))
+def record(
+    verbose,
+    driver,
+    login,
+    password,
+    commands,
+    configuration,
+    line_by_line,
+    console,
+    recording,
+):
+    """Records a session on CONSOLE (host:port) to RECORDING, with the password
+    typed in clear text."""
+    configure_logging(verbose)
+    host, port = console.rsplit(":", 1)
+    session = {
+        "driver": driver,
+        "login": login,
+        "password": password,
+        "commands": list(commands),
+        "configuration": configuration.read() if configuration else None,
+        "bulk": not line_by_line,
+    }
+    recorder = Recorder(recording, session=session)
+    start = time.perf_counter()
+    v = asyncio.run(run_session(DRIVERS[driver], host, int(port), session, recorder))
+    click.echo(
+        f"{len(v.loglines)} lines recorded in {time.perf_counter() - start:.3f}s",
+        err=True,
+    )
+
+
+@console_replay.command(name="serve")
+@click.option("-v", "--verbose", count=True)
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=5000, show_default=True, help="first console port")
+@click.option(
+    "--speed",
+    default=1.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="replay speed, 1 for the recorded delays, 0 for no delay",
+)
+@click.option("--strict", is_flag=True, help="disconnect clients which differ")
+@click.argument(
+    "recordings", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+def serve_command(verbose, host, port, speed, strict, recordings):
+    """Serves RECORDINGS on telnet consoles, one port per recording."""
+    configure_logging(verbose)
+
+    async def main():
+        servers = await serve(host, port, recordings, speed, strict)
+        for server, path in zip(servers, recordings):
+            console = "{}:{}".format(*server.sockets[0].getsockname()[:2])
+            click.echo(f"{path} on {console}", err=True)
+        await asyncio.gather(*[s.serve_forever() for s in servers])
+
+    asyncio.run(main())
+
+
+async def bench_run(path, session, speed):
+    servers = await serve("127.0.0.1", 0, [path], speed, strict=True)
+    port = servers[0].sockets[0].getsockname()[1]
+    try:
+        start = time.perf_counter()
+        v = await run_session(DRIVERS[session["driver"]], "127.0.0.1", port, session)
+        return time.perf_counter() - start, v
+    finally:
+        servers[0].close()
+
+
+@console_replay.command()
+@click.option("-v", "--verbose", count=True)
+@click.option(
+    "--speed",
+    default=0.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="replay speed, 1 for the recorded delays, 0 for no delay",
+)
+@click.option("--repeat", default=5, show_default=True, type=click.IntRange(min=1))
+@click.argument("recording", type=click.Path(exists=True, dir_okay=False))
+def bench(verbose, speed, repeat, recording):
+    """Runs the session of RECORDING against its replay, and prints its timing.
+
+    Each run must get the recorded transcript back, so that the numbers of two
+    versions of expect.py are comparable.
+    """
+    configure_logging(verbose)
+    header, events, transcript = load_recording(recording)
+    session = header["session"]
+    seconds = list()
+    for _ in range(repeat):
+        s, v = asyncio.run(bench_run(recording, session, speed))
+        if transcript is not None and v.loglines.text() != transcript:
+            raise click.ClickException("the replayed transcript differs")
+        seconds.append(s)
+    click.echo(
+        f"{recording}: {len(events)} events, {repeat} runs, "
+        f"mean={statistics.mean(seconds):.4f}s min={min(seconds):.4f}s "
+        f"max={max(seconds):.4f}s"
+    )
+
+
+if __name__ == "__main__":
+    console_replay()
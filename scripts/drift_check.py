@@ -0,0 +1,255 @@
+#! /usr/bin/env python
+
+import asyncio
+import click
+import difflib
+import glob
+import hashlib
+import json
+import logzero
+import os
+import re
+import time
+from logzero import logger
+from lab_consoles import node_driver, parse_drivers, project_consoles, run_on_consoles
+
+
+def intended_configurations(lab_dir):
+    """Returns the path of the intended configuration of each node of a lab, from
+    its config/<node>.conf files."""
+    paths = glob.glob(os.path.join(lab_dir, "config", "*.conf"))
+    return {os.path.splitext(os.path.basename(p))[0]: p for p in sorted(paths)}
+
+
+def normalize(text):
+    # line ends, trailing spaces, blank lines and comments do not count, and set
+    # commands are compared sorted as their order does not matter
+    lines = list()
+    for line in text.splitlines():
+        line = line.rstrip()
+        if line and not line.lstrip().startswith(("!", "#")):
+            lines.append(line)
+    if lines and all(line.startswith("set ") for line in lines):
+        lines.sort()
+    return lines
+
+
+def without_defaults(lines, regex):
+    # drops the sections set by the device, whose top-level line and indented lines
+    # are matched whole by regex
+    sections = list()
+    for line in lines:
+        if line[0].isspace() and sections:
+            sections[-1].append(line)
+        else:
+            sections.append([line])
+    return [
+        line
+        for section in sections
+        if not re.fullmatch(regex, "\n".join(section))
+        for line in section
+    ]
+
+
+def digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+async def running_configuration(v):
+    return await v.get_running_configuration()
+
+
+class DriftCache:
+    """Hashes of the intended and running configurations of the nodes found in sync
+    at the last check, kept between runs."""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = dict()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def in_sync(self, node, intended, running):
+        return self.data.get(node) == {"intended": intended, "running": running}
+
+    def set(self, node, intended, running):
+        self.data[node] = {"intended": intended, "running": running}
+
+    def discard(self, node):
+        self.data.pop(node, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def check_drift(intended, results, cache, drivers=()):
+    # returns the status of each node: in sync, drifted with the normalized lines
+    # to diff, or failed. Configurations with the hashes of the last check in sync
+    # are not normalized nor compared again. The sections set by the device, as
+    # declared by its driver, are left out of the comparison.
+    report = dict()
+    for r in results:
+        node = r["node"]
+        if "error" in r:
+            report[node] = {"status": "failed", "error": r["error"]}
+            continue
+        with open(intended[node]) as f:
+            intended_text = f.read()
+        intended_hash, running_hash = digest(intended_text), digest(r["output"])
+        if cache.in_sync(node, intended_hash, running_hash):
+            report[node] = {"status": "in sync", "cached": True}
+            continue
+        intended_lines, running_lines = normalize(intended_text), normalize(r["output"])
+        regex = node_driver(node, drivers).RUNNING_CONFIGURATION_DEFAULTS_RE
+        if regex:
+            intended_lines = without_defaults(intended_lines, regex)
+            running_lines = without_defaults(running_lines, regex)
+        if intended_lines == running_lines:
+            cache.set(node, intended_hash, running_hash)
+            report[node] = {"status": "in sync", "cached": False}
+            continue
+        cache.discard(node)
+        report[node] = {
+            "status": "drifted",
+            "intended": intended_lines,
+            "running": running_lines,
+        }
+    return report
+
+
+def unified_diff(intended_path, node, r):
+    # diff of a drifted node, only computed to be printed
+    return "\n".join(
+        difflib.unified_diff(
+            r["intended"],
+            r["running"],
+            fromfile=intended_path,
+            tofile=f"{node} (running)",
+            lineterm="",
+        )
+    )
+
+
+@click.command()
+@click.option("-v", "--verbose", count=True)
+@click.option(
+    "--gns3-server-url",
+    envvar="GNS3_SERVER_URL",
+    default="http://gns3.example.com:3080/v2",
+    show_default=True,
+    help="GNS3 server URL",
+)
+@click.option(
+    "--gns3-project-name",
+    envvar="GNS3_PROJECT_NAME",
+    help="GNS3 project name, the name of the lab directory by default",
+)
+@click.option(
+    "--concurrency",
+    default=10,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="number of consoles open at once",
+)
+@click.option(
+    "--driver",
+    "drivers",
+    multiple=True,
+    callback=parse_drivers,
+    help="console driver of the nodes matching a pattern, e.g. 'SW*=nxos', "
+    "vyos by default",
+)
+@click.option("--login", help="user, the default user of the driver by default")
+@click.option("--password", help="password, the default one of the driver by default")
+@click.option(
+    "--broker",
+    envvar="CONSOLE_BROKER",
+    help="local socket of console_broker.py, to use its logged in sessions",
+)
+@click.option(
+    "--cache-file",
+    envvar="DRIFT_CHECK_CACHE_FILE",
+    default=os.path.join(click.get_app_dir("drift-check"), "cache.json"),
+    show_default=True,
+    type=click.Path(dir_okay=False),
+    help="hashes of the configurations in sync at the last check",
+)
+@click.argument("lab_dir", type=click.Path(exists=True, file_okay=False))
+def drift_check(
+    verbose,
+    gns3_server_url,
+    gns3_project_name,
+    concurrency,
+    drivers,
+    login,
+    password,
+    broker,
+    cache_file,
+    lab_dir,
+):
+    """Compares the running configuration of the nodes of a lab with the intended
+    configurations in LAB_DIR/config/<node>.conf, and prints the diffs."""
+    logzero.loglevel(logzero.DEBUG if verbose else logzero.WARNING)
+    project_name = gns3_project_name or os.path.basename(os.path.abspath(lab_dir))
+
+    intended = intended_configurations(lab_dir)
+    if not intended:
+        raise click.ClickException(f"no intended configuration in {lab_dir}/config")
+    try:
+        consoles = project_consoles(gns3_server_url, project_name, list(intended))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    missing = sorted(set(intended) - set(name for name, _, _ in consoles))
+
+    start = time.perf_counter()
+    results = asyncio.run(
+        run_on_consoles(
+            consoles,
+            running_configuration,
+            login,
+            password,
+            concurrency,
+            drivers,
+            broker,
+        )
+    )
+    cache = DriftCache(cache_file)
+    report = check_drift(intended, results, cache, drivers)
+    cache.save()
+    seconds = time.perf_counter() - start
+    logger.debug(f"drift checked in {seconds:.3f}s")
+
+    for node, r in report.items():
+        if r["status"] == "failed":
+            click.echo(f"{node}: failed, {r['error']}")
+        elif r["status"] == "drifted":
+            click.echo(f"{node}: drifted")
+            click.echo(unified_diff(intended[node], node, r))
+        elif r["cached"]:
+            if verbose > 1:
+                click.echo(f"{node}: in sync, unchanged since the last check")
+        elif verbose:
+            click.echo(f"{node}: in sync")
+    for node in missing:
+        click.echo(f"{node}: no telnet console in project {project_name}")
+
+    counts = {
+        s: sum(1 for r in report.values() if r["status"] == s)
+        for s in ("in sync", "drifted", "failed")
+    }
+    click.echo(
+        f"{counts['in sync']} in sync, {counts['drifted']} drifted, "
+        f"{counts['failed']} failed, {len(missing)} missing, {seconds:.3f}s",
+        err=True,
+    )
+    if counts["drifted"] or counts["failed"] or missing:
+        click.get_current_context().exit(1)
+
+
+if __name__ == "__main__":
+    drift_check()
@@ -1,47 +1,358 @@
-import telnetlib
+import asyncio
+import click
+import codecs
+import ipaddress
+import json
+import re
 import logzero
+import time
 from logzero import logger
+from collections import deque
+from collections.abc import Sequence
 from enum import Enum, auto, unique
 
+# telnet commands, see RFC 854
+IAC = bytes([255])
+DONT = bytes([254])
+DO = bytes([253])
+WONT = bytes([252])
+WILL = bytes([251])
+SB = bytes([250])
+SE = bytes([240])
+
+
+class Transcript(Sequence):
+    """Console transcript, processed as data is received.
+
+    This is the sequence of lines of the session, indexed from its start as
+    logbytes.decode().splitlines() would be. Only the last max_lines lines are kept
+    in memory, the older ones are appended to spill_path if set and cannot be read
+    back from the transcript.
+    """
+
+    CR_RUN_RE = re.compile(b"\r\r+")
+
+    def __init__(self, max_lines=None, spill_path=None):
+        self.max_lines = max_lines
+        self.spill_path = spill_path
+        # complete lines with their line ends, then the line being received
+        self.lines = deque()
+        self.partial = ""
+        # index of the first line kept in memory
+        self.first = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._cr = False
+        self._spill = None
+
+    def append(self, data):
+        # consoles send \r\r\n at times, runs of \r are read as a single one
+        if self._cr:
+            data = data.lstrip(b"\r")
+        if b"\r\r" in data:
+            data = self.CR_RUN_RE.sub(b"\r", data)
+        if not data:
+            return
+        self._cr = data.endswith(b"\r")
+
+        pieces = (self.partial + self._decoder.decode(data)).splitlines(keepends=True)
+        self.partial = ""
+        # the last line is not complete without a line end, or with \r which may be
+        # the start of \r\n
+        if pieces and (pieces[-1].endswith("\r") or not self._line_end(pieces[-1])):
+            self.partial = pieces.pop()
+        self.lines.extend(pieces)
+
+        if self.max_lines is not None and len(self.lines) > self.max_lines:
+            count = len(self.lines) - self.max_lines
+            dropped = [self.lines.popleft() for _ in range(count)]
+            self.first += len(dropped)
+            if self.spill_path:
+                if self._spill is None:
+                    self._spill = open(self.spill_path, "a", encoding="utf-8")
+                self._spill.writelines(dropped)
+
+    @staticmethod
+    def _line_end(line):
+        return line[len(line.splitlines()[0]) :]
+
+    def close(self):
+        if self._spill:
+            self._spill.close()
+            self._spill = None
+
+    def __len__(self):
+        return self.first + len(self.lines) + (1 if self.partial else 0)
+
+    def __getitem__(self, key):
+        count = len(self)
+        if isinstance(key, slice):
+            indices = range(*key.indices(count))
+            if indices and min(indices) < self.first:
+                raise IndexError(f"line {min(indices)} is no longer in the transcript")
+            return [self._line(n - self.first) for n in indices]
+        if key < 0:
+            key += count
+        if not 0 <= key < count:
+            raise IndexError("transcript index out of range")
+        if key < self.first:
+            raise IndexError(f"line {key} is no longer in the transcript")
+        return self._line(key - self.first)
+
+    def _line(self, n):
+        # line n of those kept in memory, the partial one last, without line end
+        line = self.lines[n] if n < len(self.lines) else self.partial
+        return line.splitlines()[0]
+
+    def __iter__(self):
+        # lines kept in memory, without their line ends
+        for line in self.lines:
+            yield line[: len(line) - len(self._line_end(line))]
+        if self.partial:
+            yield self.partial.splitlines()[0]
+
+    def text(self):
+        return "".join(self.lines) + self.partial
+
+
+class Recorder:
+    """Timed byte stream of a console session, saved as JSON lines.
+
+    The first line is the header: the console, the start time and the fields set
+    by the caller. Then each line is the data received ("in") or sent ("out") with
+    its time in seconds since the connection, bytes being stored as latin-1 text,
+    and the last line is the transcript of the session.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, **header):
+        self.path = path
+        self.header = header
+        self.start = None
+        self._file = None
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+
+    def open(self, host, port):
+        self._file = open(self.path, "w", encoding="utf-8")
+        self.start = time.perf_counter()
+        self._write(
+            {
+                "version": self.VERSION,
+                "console": f"{host}:{port}",
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                **self.header,
+            }
+        )
+
+    def record(self, direction, data):
+        if self._file:
+            t = round(time.perf_counter() - self.start, 6)
+            self._write({"t": t, direction: data.decode("latin-1")})
+
+    def close(self, transcript):
+        if self._file:
+            t = round(time.perf_counter() - self.start, 6)
+            self._write({"t": t, "transcript": transcript})
+            self._file.close()
+            self._file = None
+
+
+def load_recording(path):
+    """Returns the header, the (time, direction, bytes) events and the transcript
+    of a recording."""
+    with open(path, encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        events = list()
+        transcript = None
+        for line in f:
+            record = json.loads(line)
+            if "transcript" in record:
+                transcript = record["transcript"]
+                continue
+            direction = "in" if "in" in record else "out"
+            events.append((record["t"], direction, record[direction].encode("latin-1")))
+    if header.get("version") != Recorder.VERSION:
+        raise ValueError(f"{path} is not a console recording")
+    return header, events, transcript
+
+
+class LoggedTelnet(asyncio.Protocol):
+    """Telnet client on asyncio, with the telnetlib API used by Vyos.
+
+    Telnet options are all refused, as telnetlib does by default. Received data is
+    kept until consumed by expect or one of the read methods, which log it to the
+    transcript.
+    """
+
+    # lines of transcript kept in memory
+    MAX_LOGLINES = 100000
+
+    def __init__(
+        self,
+        host=None,
+        port=23,
+        timeout=10,
+        max_loglines=MAX_LOGLINES,
+        spill_path=None,
+        recorder=None,
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.transport = None
+        self.cookedq = b""
+        self.eof = False
+        self.loglines = Transcript(max_loglines, spill_path)
+        # records the session for console_replay.py if set
+        self.recorder = recorder
+        self._iacseq = b""
+        self._sb = False
+        self._data = asyncio.Event()
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.wait_for(
+            loop.create_connection(lambda: self, self.host, self.port), self.timeout
+        )
+        return self
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+        if self.recorder:
+            self.recorder.close(self.loglines.text())
+        self.loglines.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.recorder:
+            self.recorder.open(self.host, self.port)
+
+    def connection_lost(self, exc):
+        self.eof = True
+        self._data.set()
+
+    def data_received(self, data):
+        if self.recorder:
+            self.recorder.record("in", data)
+        if not self._iacseq and not self._sb and IAC not in data:
+            buf = data.replace(b"\x00", b"").replace(b"\x11", b"")
+            if buf:
+                self.cookedq += buf
+                self._data.set()
+            return
 
-class LoggedTelnet(telnetlib.Telnet):
-    def __init__(self, **kwargs):
-        super(LoggedTelnet, self).__init__(**kwargs)
-        self.logbytes = b""
-        self.loglines = []
+        buf = b""
+        for c in (data[n : n + 1] for n in range(len(data))):
+            if not self._iacseq:
+                if c == IAC:
+                    self._iacseq = c
+                elif not self._sb and c not in (b"\x00", b"\x11"):
+                    buf += c
+            elif len(self._iacseq) == 1:
+                self._iacseq = b""
+                if c in (DO, DONT, WILL, WONT):
+                    self._iacseq = IAC + c
+                elif c == IAC and not self._sb:
+                    buf += c
+                elif c == SB:
+                    self._sb = True
+                elif c == SE:
+                    self._sb = False
+            else:
+                command, self._iacseq = self._iacseq[1:2], b""
+                if command == DO:
+                    self._send(IAC + WONT + c)
+                elif command == WILL:
+                    self._send(IAC + DONT + c)
+        if buf:
+            self.cookedq += buf
+            self._data.set()
+
+    async def _wait_data(self, timeout):
+        # returns False if no data was received before the timeout
+        self._data.clear()
+        try:
+            await asyncio.wait_for(self._data.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    @property
+    def logbytes(self):
+        # the part of the transcript kept in memory
+        return self.loglines.text().encode()
 
     def _log(self, s):
-        self.logbytes += s
-        self.logbytes = self.logbytes.replace(b"\r\r", b"\r")
-        self.loglines = self.logbytes.decode().splitlines()
+        self.loglines.append(s)
 
-    def expect(self, regex_list, timeout=None):
-        r = super(LoggedTelnet, self).expect(regex_list, timeout)
-        self._log(r[2])
-        return r
-
-    def read_very_lazy(self):
-        s = super(LoggedTelnet, self).read_very_lazy()
+    def _consume(self, end=None):
+        end = len(self.cookedq) if end is None else end
+        s, self.cookedq = self.cookedq[:end], self.cookedq[end:]
         self._log(s)
         return s
 
-    def read_all(self) -> bytes:
-        s = super(LoggedTelnet, self).read_all()
-        self._log(s)
-        return s
+    async def expect(self, regex_list, timeout=None, tail=None):
+        # same result as telnetlib: (index, match, text) for the first regex of the
+        # list which matches, (-1, None, text) on timeout with the text received.
+        # With tail, only the last tail bytes are searched, which is enough for
+        # regexes anchored at the end of the output such as prompts.
+        regex_list = [re.compile(r) if isinstance(r, bytes) else r for r in regex_list]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        while True:
+            start = max(len(self.cookedq) - tail, 0) if tail else 0
+            for n, regex in enumerate(regex_list):
+                m = regex.search(self.cookedq, start)
+                if m:
+                    return n, m, self._consume(m.end())
+            if self.eof:
+                break
+            remaining = deadline - loop.time() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                break
+            if not await self._wait_data(remaining):
+                break
+        if self.eof and not self.cookedq:
+            raise EOFError("telnet connection closed")
+        return -1, None, self._consume()
 
-    def read_some(self) -> bytes:
-        s = super(LoggedTelnet, self).read_some()
-        self._log(s)
-        return s
+    def read_very_lazy(self):
+        return self._consume()
+
+    def read_very_eager(self):
+        return self._consume()
+
+    async def read_some(self):
+        while not self.cookedq and not self.eof:
+            await self._wait_data(None)
+        return self._consume()
+
+    async def read_all(self):
+        while not self.eof:
+            await self._wait_data(None)
+        return self._consume()
 
     def read(self):
         return self.read_very_eager()
 
+    def _send(self, data):
+        if self.recorder:
+            self.recorder.record("out", data)
+        self.transport.write(data)
+
     def write(self, s):
         if isinstance(s, str):
             s = s.encode(encoding="ascii")
-        return super(LoggedTelnet, self).write(s)
+        self._send(s.replace(IAC, IAC + IAC))
 
     def write_line(self, s=""):
         if isinstance(s, str):
@@ -49,175 +360,628 @@ class LoggedTelnet(telnetlib.Telnet):
         return self.write(s + b"\n")
 
 
+class Latency:
+    """Console latency, smoothed as TCP smoothes round-trip times (RFC 6298), with
+    statistics by command."""
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        # count, total, min and max seconds by first word of the commands
+        self.commands = dict()
+
+    def observe(self, command, seconds, sample=True):
+        if sample:
+            if self.srtt is None:
+                self.srtt, self.rttvar = seconds, seconds / 2
+            else:
+                self.rttvar += self.BETA * (abs(self.srtt - seconds) - self.rttvar)
+                self.srtt += self.ALPHA * (seconds - self.srtt)
+
+        key = command.split()[0] if command.strip() else "(enter)"
+        count, total, low, high = self.commands.get(key, (0, 0.0, seconds, seconds))
+        self.commands[key] = (
+            count + 1,
+            total + seconds,
+            min(low, seconds),
+            max(high, seconds),
+        )
+
+    def timeout(self, default, minimum, maximum):
+        if self.srtt is None:
+            return default
+        return min(max(self.srtt + 4 * self.rttvar, minimum), maximum)
+
+    def stats(self):
+        return {
+            key: {
+                "count": count,
+                "mean": round(total / count, 4),
+                "min": round(low, 4),
+                "max": round(high, 4),
+            }
+            for key, (count, total, low, high) in self.commands.items()
+        }
+
+
+class ConfigurationError(Exception):
+    """Commands of a bulk configuration which failed, as (line number, command,
+    output) tuples, the line number of a failed commit is None."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(ConfigurationError, self).__init__(
+            "\n".join(
+                f"line {n}: {command}: {output.strip()}"
+                if n
+                else f"{command}: {output.strip()}"
+                for n, command, output in errors
+            )
+        )
+
+
+class CommandResult:
+    """Output of a command, between its echo and the next prompt."""
+
+    def __init__(self, command, output, mode, seconds):
+        self.command = command
+        self.output = output
+        # mode of the prompt after the command
+        self.mode = mode
+        self.seconds = seconds
+
+    def json(self):
+        # output of show | json
+        return json.loads(self.output)
+
+    def commands(self):
+        # set commands of the output of show | commands
+        return [line for line in self.output.splitlines() if line.startswith("set ")]
+
+    def __repr__(self):
+        return f"CommandResult({self.command!r}, {self.output!r}, {self.mode})"
+
+
 @unique
-class VyOSModes(Enum):
+class Modes(Enum):
     UNKNWOWN = auto()
     OPERATIONAL = auto()
     CONFIGURATION = auto()
     LOGGEDOUT = auto()
 
 
-class Vyos(LoggedTelnet):
+# the modes were first those of VyOS consoles
+VyOSModes = Modes
+
+
+class ConsoleDriver(LoggedTelnet):
+    """Console engine shared by the vendor drivers.
+
+    A driver declares its prompt regex by mode, each anchored at the end of the
+    output, and the commands to disable paging, to enter, commit, save and leave
+    the configuration. Its prompts are compiled once, when the driver class is
+    defined, into a single regex whose groups are named after the modes.
+    """
+
+    # seconds to wait for a prompt until the console latency is known, then bounds
+    # of the timeouts computed from the latency
     TIMEOUT = 3
-    MAX_TIMEOUTS = 10
-    OPER_PROMPT_RE = r"\w+@\w+:.+\$ $".encode("ascii")
-    CONFIG_PROMPT_RE = r"\w+@\w+\# $".encode("ascii")
-    LOGIN_PROMPT_RE = r"\w+ login: $".encode("ascii")
-    BAD_USER_PASS_RE = b"Login incorrect"
-    EXIT_DISCARD_RE = b"exit discard"
+    MIN_TIMEOUT = 1
+    MAX_TIMEOUT = 30
+    # characters sent after each wait for a prompt with no output at all
+    RECOVERY = (b"\x03", b"\n", b"\n", b"\n", b"\n")
+    # prompts are at the end of the output, only its tail is searched
+    PROMPT_TAIL = 512
+    # commands of a bulk configuration sent ahead of their prompts
+    BULK_WINDOW = 32
+
+    # vendor table, see the drivers below
+    NAME = None
+    DEFAULT_LOGIN = ("", "")
+    PROMPTS = dict()
+    PASSWORD_PROMPT_RE = b"Password:"
+    PAGING_COMMAND = None
+    CONFIGURE_COMMAND = None
+    # without commit command, configuration commands are applied at once
+    COMMIT_COMMAND = None
+    SAVE_COMMAND = None
+    SAVE_IN_CONFIGURATION = True
+    EXIT_COMMAND = None
+    DISCARD_COMMAND = None
+    LOGOUT_COMMAND = None
+    LOGOUT_CHARACTER = None
+    # command showing the configuration, and if it runs in configuration mode
+    SHOW_CONFIGURATION = None
+    SHOW_CONFIGURATION_IN_CONFIGURATION = False
+    # sections of the running configuration set by the device, e.g. its version
+    # and defaults, which the configurations of the labs leave out: a section, its
+    # top-level line and indented lines, is left out if the regex matches it whole
+    RUNNING_CONFIGURATION_DEFAULTS_RE = None
+    # lines printed between the output of a command and the prompt
+    PROMPT_HEADERS = ()
+    COMMAND_ERROR_RE = None
+    COMMIT_ERROR_RE = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "PROMPTS" in cls.__dict__:
+            cls.PROMPT_RE = re.compile(
+                b"|".join(
+                    b"(?P<%s>%s)" % (mode.name.encode(), regex)
+                    for mode, regex in cls.PROMPTS.items()
+                )
+            )
+            # configuration prompt followed by more output, when commands are
+            # pipelined
+            regex = cls.PROMPTS.get(Modes.CONFIGURATION)
+            cls.NEXT_CONFIG_PROMPT_RE = (
+                re.compile(regex[:-1] if regex.endswith(b"$") else regex)
+                if regex
+                else None
+            )
 
-    def __init__(self, **kwargs):
-        super(Vyos, self).__init__(**kwargs)
-        self.mode = VyOSModes.UNKNWOWN
+    def __init__(self, recovery=None, **kwargs):
+        super(ConsoleDriver, self).__init__(**kwargs)
+        self.mode = Modes.UNKNWOWN
         self.logged_in = None
+        self.recovery = self.RECOVERY if recovery is None else tuple(recovery)
+        self.latency = Latency()
 
-    def login(self, login="", password=""):
+    async def login(self, login=None, password=None):
         command = "login"
+        if login is None:
+            login, password = self.DEFAULT_LOGIN
 
-        if self.mode is VyOSModes.UNKNWOWN:
-            self.expect_prompt(command=command)
+        if self.mode is Modes.UNKNWOWN:
+            # a console waiting at a prompt is silent, Enter gets a new prompt
+            self.write_line()
+            await self.expect_prompt(command=command)
 
-        if self.mode is VyOSModes.CONFIGURATION:
-            self.configure(commit=False)  # exit configuration mode
+        if self.mode is Modes.CONFIGURATION:
+            await self.configure(commit=False)  # exit configuration mode
 
-        if self.mode is VyOSModes.OPERATIONAL:
-            self.logout()  # exit operational mode
+        # consoles without login prompt, e.g. shells, are always logged in
+        if self.mode is Modes.OPERATIONAL and Modes.LOGGEDOUT in self.PROMPTS:
+            await self.logout()  # exit operational mode
 
-        if self.mode is VyOSModes.LOGGEDOUT:
+        if self.mode is Modes.LOGGEDOUT:
             self.write_line(login)
-            self.expect([b"Password:"])
+            await self.expect([self.PASSWORD_PROMPT_RE], timeout=self.TIMEOUT)
             self.write_line(password)
-            self.expect_prompt(command=command)
-            self.send_command("set terminal length 0")
+            await self.expect_prompt(command=command)
+            if self.PAGING_COMMAND and self.mode is Modes.OPERATIONAL:
+                await self.send_command(self.PAGING_COMMAND)
 
-        if self.mode is not VyOSModes.OPERATIONAL:
+        if self.mode is not Modes.OPERATIONAL:
             raise Exception("Impossible to log in!")
 
-    def logout(self):
+    async def logout(self):
         command = "logout"
+        if Modes.LOGGEDOUT not in self.PROMPTS:
+            return
 
-        if self.mode is VyOSModes.CONFIGURATION:
-            self.send_command("exit discard")
+        if self.mode is Modes.CONFIGURATION:
+            await self.send_command(self.DISCARD_COMMAND)
 
-        if self.mode is VyOSModes.OPERATIONAL:
-            logger.debug(f"command={command}, sending Ctrl+D")
-            v.send_character(b"\x04")
+        if self.mode is Modes.OPERATIONAL:
+            if self.LOGOUT_CHARACTER:
+                logger.debug(f"command={command}, sending {self.LOGOUT_CHARACTER!r}")
+                await self.send_character(self.LOGOUT_CHARACTER)
+            else:
+                await self.send_command(self.LOGOUT_COMMAND)
 
-        if self.mode is VyOSModes.LOGGEDOUT:
+        if self.mode is Modes.LOGGEDOUT:
             return
         else:
             raise Exception("Impossible to log out!")
 
-    def send_character(self, character, expect_prompt=True):
+    async def send_character(self, character, expect_prompt=True):
         self.write(character)
         if expect_prompt:
-            self.expect_prompt("send_character")
+            return await self.expect_prompt("send_character")
 
-    def send_command(self, command, expect_prompt=True):
-        if self.mode not in (VyOSModes.OPERATIONAL, VyOSModes.CONFIGURATION):
+    async def send_command(self, command, expect_prompt=True):
+        if self.mode not in (Modes.OPERATIONAL, Modes.CONFIGURATION):
             raise Exception("Not logged in!")
 
         self.write_line(command)
         if expect_prompt:
-            self.expect_prompt(command)
-
-    def expect_prompt(self, command):
-        timeout = self.TIMEOUT
+            return await self.expect_prompt(command)
+
+    async def send_commands(self, commands, window=None):
+        # commands are pipelined, up to window of them are sent ahead of their
+        # prompts, and the output of each command is returned
+        if self.mode is not Modes.CONFIGURATION:
+            raise Exception("Commands can only be pipelined in configuration mode!")
+        window = window or self.BULK_WINDOW
+        base = self.latency.timeout(self.TIMEOUT, self.MIN_TIMEOUT, self.MAX_TIMEOUT)
+        outputs = list()
+        sent = 0
+        while len(outputs) < len(commands):
+            while sent < len(commands) and sent - len(outputs) < window:
+                self.write_line(commands[sent])
+                sent += 1
+
+            # the prompt is followed by the echo of the next commands, so the
+            # prompt regex is not anchored at the end of the output
+            text = b""
+            while True:
+                r = await self.expect([self.NEXT_CONFIG_PROMPT_RE], timeout=base)
+                text += r[2]
+                if r[0] == 0:
+                    break
+                if not r[2]:
+                    command = commands[len(outputs)]
+                    logger.debug(f"command={command}, no prompt, aborting!")
+                    raise Exception("Impossible to get any prompt!")
+            outputs.append(self.command_output(text))
+        return outputs
+
+    def command_output(self, text):
+        # output of a command between its echo, which ends with the first \n even
+        # when the console wraps it, and the prompt, which is the last line
+        output = text.partition(b"\n")[2].rpartition(b"\n")[0]
+        lines = output.decode(errors="replace").splitlines()
+        if lines and lines[-1] in self.PROMPT_HEADERS:
+            lines.pop()
+        return "\n".join(lines)
+
+    async def run_command(self, command, configuration=False):
+        # the configuration mode is left after the command only if it was entered
+        # for it, without committing anything
+        entered = False
+        if configuration and self.mode is not Modes.CONFIGURATION:
+            await self.enter_configuration()
+            entered = True
+        elif self.mode not in (Modes.OPERATIONAL, Modes.CONFIGURATION):
+            await self.expect_prompt(command)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        output = await self.send_command(command)
+        result = CommandResult(
+            command, self.command_output(output), self.mode, loop.time() - start
+        )
+
+        if entered:
+            await self.send_command(self.DISCARD_COMMAND)
+        return result
+
+    async def expect_prompt(self, command, sample=True):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        base = self.latency.timeout(self.TIMEOUT, self.MIN_TIMEOUT, self.MAX_TIMEOUT)
+        timeout = base
         timeouts = 0
+        recovered = False
         count = 0
+        # returns the output received up to the prompt included
+        output = b""
         while True:
-            r = self.expect(
-                [
-                    self.OPER_PROMPT_RE,
-                    self.CONFIG_PROMPT_RE,
-                    self.LOGIN_PROMPT_RE,
-                ],
-                timeout=timeout,
+            r = await self.expect(
+                [self.PROMPT_RE], timeout=timeout, tail=self.PROMPT_TAIL
             )
             count += 1
+            output += r[2]
             logger.debug(f"command={command}, count={count}, expect result={str(r)}")
 
-            if r[0] == 0:  # operational prompt
-                logger.debug(f"command={command}, count={count}, prompt is OPERATIONAL")
-                self.mode = VyOSModes.OPERATIONAL
-            elif r[0] == 1:  # configuration prompt
-                logger.debug(f"command={command}, count={count}, prompt is CONFIGURATION")
-                self.mode = VyOSModes.CONFIGURATION
-            elif r[0] == 2:  # login prompt
-                logger.debug(f"command={command}, count={count}, prompt is LOGGEDOUT")
-                self.mode = VyOSModes.LOGGEDOUT
-            elif r[0] == -1:  # Timeout
-                self.mode = VyOSModes.UNKNWOWN
-                logger.debug(f"command={command}, count={count}, prompt is UNKNOWN")
-                if len(r[2]) > 0:  # Data is flowing on the console, just loop and wait...
-                    timeouts = 0
-                    timeout = self.TIMEOUT
-                else:  # Console does not seem to be responding, start sending control charaters
-                    timeouts += 1
-                    timeout = timeouts * self.TIMEOUT
-                logger.debug(f"command={command}, count={count}, timeouts={timeouts}, timeout={timeout}")
-
-                if timeouts == 1:
-                    v.write(b"\x03")  # send ctrl+C for the first control character
-                    logger.debug(f"command={command}, count={count}, sending Ctrl+C")
-                elif timeouts <= self.MAX_TIMEOUTS:
-                    v.write_line()  # then try with enter because sometimes sending ctrl+C is not enough
-                    logger.debug(f"command={command}, count={count}, sending Enter")
-                else:
-                    logger.debug(f"command={command}, count={count}, aborting!")
-                    raise Exception("Impossible to get any prompt!")
-
-            if self.mode is not VyOSModes.UNKNWOWN:  # we do have a prompt
-                return
-
-    def configure(self, commands="", commit=True, save=True):
-        if self.mode is VyOSModes.UNKNWOWN:
-            self.expect_prompt("configure")
-
-        if self.mode is VyOSModes.LOGGEDOUT:
+            if r[0] == 0:
+                self.mode = Modes[r[1].lastgroup]
+                seconds = loop.time() - start
+                # waits with recovery characters sent do not measure the latency
+                self.latency.observe(command, seconds, sample and not recovered)
+                logger.debug(
+                    f"command={command}, count={count}, prompt is {self.mode.name}, "
+                    f"latency={seconds:.3f}s"
+                )
+                return output
+
+            self.mode = Modes.UNKNWOWN
+            logger.debug(f"command={command}, count={count}, prompt is UNKNOWN")
+            if len(r[2]) > 0:  # data is flowing on the console, just wait again
+                timeouts = 0
+                timeout = base
+                continue
+
+            # the console does not seem to be responding, send the next character
+            # of the recovery sequence
+            timeouts += 1
+            if timeouts > len(self.recovery):
+                logger.debug(f"command={command}, count={count}, aborting!")
+                raise Exception("Impossible to get any prompt!")
+            timeout = min(base * (timeouts + 1), self.MAX_TIMEOUT)
+            logger.debug(
+                f"command={command}, count={count}, timeouts={timeouts}, "
+                f"timeout={timeout:.3f}, sending {self.recovery[timeouts - 1]!r}"
+            )
+            self.write(self.recovery[timeouts - 1])
+            recovered = True
+
+    async def wait_ready(self, timeout):
+        # waits for the first prompt of a node which is booting, through boot
+        # messages and silent periods, and returns its mode
+        async def prompt():
+            # a node which already booted is silent at its prompt
+            self.write_line()
+            while True:
+                try:
+                    # boot time is not the latency of the console
+                    return await self.expect_prompt("boot", sample=False)
+                except EOFError:
+                    raise
+                except Exception as e:
+                    logger.debug(f"command=boot, {e}, waiting again")
+
+        await asyncio.wait_for(prompt(), timeout)
+        return self.mode
+
+    async def enter_configuration(self):
+        if self.mode is Modes.UNKNWOWN:
+            await self.expect_prompt("configure")
+
+        if self.mode is Modes.LOGGEDOUT:
             raise Exception("You must first be logged in!")
 
-        if self.mode is VyOSModes.OPERATIONAL:
-            self.send_command("configure")
+        if self.mode is Modes.OPERATIONAL and self.CONFIGURE_COMMAND:
+            await self.send_command(self.CONFIGURE_COMMAND)
 
-        if self.mode is not VyOSModes.CONFIGURATION:
+        if self.mode is not Modes.CONFIGURATION:
             raise Exception("Impossible to get configuration prompt!")
 
-        for command in commands.splitlines():
-            self.send_command(command)
-
-        if commit:
-            self.send_command("commit")
-            if save:
-                self.send_command("save")
-            self.send_command("exit")
+    async def configure(
+        self, commands="", commit=True, save=True, bulk=False, window=None
+    ):
+        await self.enter_configuration()
+
+        if bulk:
+            # one pipelined stream of commands, their outputs are checked at the end
+            lines = commands.splitlines()
+            outputs = await self.send_commands(lines, window)
+            errors = [
+                (n, command, output)
+                for n, (command, output) in enumerate(zip(lines, outputs), 1)
+                if self.COMMAND_ERROR_RE
+                and re.search(self.COMMAND_ERROR_RE, output.encode())
+            ]
+            if errors:
+                await self.send_command(self.DISCARD_COMMAND)
+                raise ConfigurationError(errors)
         else:
-            self.send_command("exit discard")
+            for command in commands.splitlines():
+                await self.send_command(command)
 
-    def get_configuration(self, commands=False, json=False):
-        logline_index = len(self.loglines)
+        if not commit:
+            await self.send_command(self.DISCARD_COMMAND)
+            return
+        if self.COMMIT_COMMAND:
+            output = await self.send_command(self.COMMIT_COMMAND)
+            if bulk and re.search(self.COMMIT_ERROR_RE, output):
+                await self.send_command(self.DISCARD_COMMAND)
+                output = self.command_output(output)
+                raise ConfigurationError([(None, self.COMMIT_COMMAND, output)])
+        if save and self.SAVE_IN_CONFIGURATION:
+            await self.send_command(self.SAVE_COMMAND)
+        await self.send_command(self.EXIT_COMMAND)
+        if save and not self.SAVE_IN_CONFIGURATION:
+            await self.send_command(self.SAVE_COMMAND)
+
+    async def get_configuration(self):
+        result = await self.run_command(
+            self.SHOW_CONFIGURATION,
+            configuration=self.SHOW_CONFIGURATION_IN_CONFIGURATION,
+        )
+        return result.output
+
+    async def get_configurations(self):
+        # configurations shown by the expect command
+        return [await self.get_configuration()]
+
+    async def get_running_configuration(self):
+        # configuration in the format of the config files of the labs
+        return await self.get_configuration()
+
+    async def push_configuration(self, configuration, save=True):
+        # configuration in the format of the config files of the labs
+        await self.configure(configuration, save=save, bulk=True)
+
+
+class Vyos(ConsoleDriver):
+    NAME = "vyos"
+    DEFAULT_LOGIN = ("vyos", "vyos")
+    OPER_PROMPT_RE = r"\w+@\w+:.+\$ $".encode("ascii")
+    CONFIG_PROMPT_RE = r"\w+@\w+\# $".encode("ascii")
+    LOGIN_PROMPT_RE = r"\w+ login: $".encode("ascii")
+    PROMPTS = {
+        Modes.OPERATIONAL: OPER_PROMPT_RE,
+        Modes.CONFIGURATION: CONFIG_PROMPT_RE,
+        Modes.LOGGEDOUT: LOGIN_PROMPT_RE,
+    }
+    BAD_USER_PASS_RE = b"Login incorrect"
+    EXIT_DISCARD_RE = b"exit discard"
+    PAGING_COMMAND = "set terminal length 0"
+    CONFIGURE_COMMAND = "configure"
+    COMMIT_COMMAND = "commit"
+    SAVE_COMMAND = "save"
+    EXIT_COMMAND = "exit"
+    DISCARD_COMMAND = "exit discard"
+    LOGOUT_CHARACTER = b"\x04"
+    SHOW_CONFIGURATION = "show"
+    SHOW_CONFIGURATION_IN_CONFIGURATION = True
+    PROMPT_HEADERS = ("[edit]",)
+    COMMAND_ERROR_RE = (
+        b"Invalid command|is not valid|Set failed|Delete failed|Nothing to delete"
+    )
+    COMMIT_ERROR_RE = b"Commit failed"
+
+    async def get_configuration(self, commands=False, json=False):
         if commands:
-            self.configure(commands="show | commands", commit=False)
+            command = "show | commands"
         elif json:
-            self.configure(commands="show | json", commit=False)
+            command = "show | json"
         else:
-            self.configure(commands="show", commit=False)
-        config_lines = self.loglines[logline_index + 3 : -4]
-        return "\n".join(config_lines)
-
-
-fmt = "%(color)s[%(levelname)1.1s %(asctime)s.%(msecs)03d %(module)s:%(lineno)d]%(end_color)s %(message)s"
-formatter = logzero.LogFormatter(fmt=fmt)
-logzero.formatter(formatter)
-
-v = Vyos(host="172.25.41.101", port=5105)
-v.login("vyos", "vyos")
-v.login("vyos", "vyos")
-v.configure(commit=False)
-v.login("vyos", "vyos")
-print(v.get_configuration())
-print(v.get_configuration(commands=True))
-print(v.get_configuration(json=True))
-v.logout()
-v.login("vyos", "vyos")
-v.logout()
+            command = "show"
+        result = await self.run_command(command, configuration=True)
+        return result.output
+
+    async def get_configuration_commands(self):
+        result = await self.run_command("show | commands", configuration=True)
+        return result.commands()
+
+    async def get_configuration_json(self):
+        result = await self.run_command("show | json", configuration=True)
+        return result.json()
+
+    async def get_configurations(self):
+        return [
+            await self.get_configuration(),
+            await self.get_configuration(commands=True),
+            await self.get_configuration(json=True),
+        ]
+
+    async def get_running_configuration(self):
+        return await self.get_configuration(commands=True)
+
+
+class Nxos(ConsoleDriver):
+    NAME = "nxos"
+    DEFAULT_LOGIN = ("admin", "admin")
+    PROMPTS = {
+        Modes.OPERATIONAL: rb"[\w.-]+# $",
+        Modes.CONFIGURATION: rb"[\w.-]+\(config[\w-]*\)# $",
+        Modes.LOGGEDOUT: rb"login: $",
+    }
+    PASSWORD_PROMPT_RE = b"Password: ?$"
+    PAGING_COMMAND = "terminal length 0"
+    CONFIGURE_COMMAND = "configure terminal"
+    SAVE_COMMAND = "copy running-config startup-config"
+    SAVE_IN_CONFIGURATION = False
+    EXIT_COMMAND = "end"
+    # commands are applied at once, they cannot be discarded
+    DISCARD_COMMAND = "end"
+    LOGOUT_COMMAND = "exit"
+    SHOW_CONFIGURATION = "show running-config"
+    COMMAND_ERROR_RE = b"% Invalid|% Incomplete|% Ambiguous|ERROR:"
+    RUNNING_CONFIGURATION_DEFAULTS_RE = (
+        r"version .*|boot nxos .*|copp profile \S+|rmon event .*"
+        r"|vdc \S+ id \d+(\n .*)*|interface mgmt0(\n .*)*|line (console|vty)(\n .*)*"
+        # interfaces left at their defaults are listed without any line
+        r"|interface Ethernet\d+(/\d+)+"
+    )
+
+    async def get_running_configuration(self):
+        # without the !Command and !Time header, which changes at each command
+        configuration = await self.get_configuration()
+        return "\n".join(
+            line for line in configuration.splitlines() if not line.startswith("!")
+        ).strip("\n")
+
+
+class Shell(ConsoleDriver):
+    """Shell of a container or host, e.g. the docker nodes of the labs, whose
+    configuration is the ifconfig commands of its IPv4 addresses."""
+
+    NAME = "shell"
+    PROMPTS = {Modes.OPERATIONAL: rb"[\w.@:~/-]*[#$] $"}
+    ADDRESS_RE = re.compile(r"^\d+:\s+(\S+)\s+inet\s+([\d.]+/\d+)", re.MULTILINE)
+
+    async def get_configuration(self):
+        result = await self.run_command("ip -o -4 addr show")
+        lines = list()
+        for interface, address in self.ADDRESS_RE.findall(result.output):
+            if interface != "lo":
+                i = ipaddress.IPv4Interface(address)
+                lines.append(f"ifconfig {interface} {i.ip} netmask {i.netmask} up")
+        return "\n".join(lines)
+
+    async def push_configuration(self, configuration, save=True):
+        # commands run one by one, a shell has no configuration to save
+        for command in configuration.splitlines():
+            if command.strip():
+                await self.send_command(command)
+
+
+DRIVERS = {driver.NAME: driver for driver in (Vyos, Nxos, Shell)}
+
+
+async def show_configurations(host, port, login, password, driver=Vyos, **options):
+    # returns the configurations and the latency statistics of the console
+    async with driver(host=host, port=port, **options) as v:
+        await v.login(login, password)
+        outputs = await v.get_configurations()
+        await v.logout()
+    return outputs, v.latency.stats()
+
+
+async def show_all_configurations(consoles, login, password, **options):
+    # all the consoles are driven concurrently from a single event loop
+    return await asyncio.gather(
+        *[
+            show_configurations(host, int(port), login, password, **options)
+            for host, port in (c.rsplit(":", 1) for c in consoles)
+        ]
+    )
+
+
+def parse_recovery(ctx, param, value):
+    # "^C,enter" is the sequence (b"\x03", b"\n")
+    if value is None:
+        return None
+    keys = {"^c": b"\x03", "^d": b"\x04", "enter": b"\n"}
+    try:
+        return tuple(keys[k.strip().lower()] for k in value.split(","))
+    except KeyError as e:
+        raise click.BadParameter(f"unknown key {e}, use ^C, ^D or enter")
+
+
+@click.command()
+@click.option("-v", "--verbose", count=True)
+@click.option(
+    "--driver",
+    default="vyos",
+    show_default=True,
+    type=click.Choice(list(DRIVERS)),
+    help="console driver of the nodes",
+)
+@click.option("--login", help="user, the default user of the driver by default")
+@click.option("--password", help="password, the default one of the driver by default")
+@click.option(
+    "--recovery",
+    callback=parse_recovery,
+    help="keys sent when a console is silent, default: ^C,enter,enter,enter,enter",
+)
+@click.option(
+    "--latency",
+    is_flag=True,
+    help="print the latency statistics by command of each console on stderr",
+)
+@click.argument("consoles", nargs=-1, required=True)
+def expect(verbose, driver, login, password, recovery, latency, consoles):
+    """Prints the configuration of the nodes on CONSOLES (host:port)."""
+    fmt = "%(color)s[%(levelname)1.1s %(asctime)s.%(msecs)03d %(module)s:%(lineno)d]%(end_color)s %(message)s"
+    formatter = logzero.LogFormatter(fmt=fmt)
+    logzero.formatter(formatter)
+    logzero.loglevel(logzero.DEBUG if verbose else logzero.INFO)
+
+    results = asyncio.run(
+        show_all_configurations(
+            consoles, login, password, driver=DRIVERS[driver], recovery=recovery
+        )
+    )
+    for console, (outputs, stats) in zip(consoles, results):
+        for output in outputs:
+            click.echo(f"# {console}")
+            click.echo(output)
+        if latency:
+            for command, s in stats.items():
+                click.echo(
+                    f"{console} {command:<14} count={s['count']} mean={s['mean']:.3f}s "
+                    f"min={s['min']:.3f}s max={s['max']:.3f}s",
+                    err=True,
+                )
+
+
+if __name__ == "__main__":
+    expect()
@@ -0,0 +1,553 @@
+import asyncio
+import click
+import ipaddress
+import json
+import logzero
+import shlex
+import time
+from logzero import logger
+
+# telnet commands, see RFC 854
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+ECHO, SUPPRESS_GO_AHEAD = 1, 3
+
+LIVE_ISO_WARNING = (
+    "WARNING: You are currently configuring a live-ISO environment, "
+    "changes will not persist until installed"
+)
+
+DEFAULT_CONFIGURATION = [
+    "set interfaces ethernet eth0 address 'dhcp'",
+    "set interfaces loopback lo",
+    "set service ssh port '22'",
+    "set system host-name 'vyos'",
+    "set system login user vyos authentication plaintext-password 'vyos'",
+]
+
+
+class FakeHypervisor:
+    """Host of the fake routers, whose CPUs are shared by the routers booting."""
+
+    def __init__(self, cpus=4):
+        self.cpus = cpus
+        self.booting = 0
+
+
+class FakeVyos:
+    """State of a fake VyOS router, kept across console connections as on GNS3."""
+
+    # state once booted, and message printed at the end of the boot and the login
+    READY_STATE = "login"
+    BANNER = "Welcome to VyOS - {hostname} ttyS0"
+    WELCOME = "Welcome to VyOS"
+
+    def __init__(
+        self,
+        hostname="vyos",
+        login="vyos",
+        password="vyos",
+        delay=0.0,
+        boot_time=0.0,
+        hypervisor=None,
+    ):
+        self.hostname = hostname
+        self.login = login
+        self.password = password
+        # seconds before each answer, as a slow router would
+        self.delay = delay
+        # seconds to boot with a CPU of its own, the router boots when its console
+        # is first connected
+        self.boot_time = boot_time
+        self.hypervisor = hypervisor or FakeHypervisor()
+        self.state = "off" if boot_time else self.READY_STATE
+        self.user = None
+        self.committed = list(DEFAULT_CONFIGURATION)
+        self.saved = list(DEFAULT_CONFIGURATION)
+        self.candidate = None
+
+    async def boot(self, write):
+        hypervisor = self.hypervisor
+        self.state = "booting"
+        hypervisor.booting += 1
+        progress = 0.0
+        try:
+            while progress < self.boot_time:
+                await asyncio.sleep(0.1)
+                progress += 0.1 * min(1.0, hypervisor.cpus / hypervisor.booting)
+                write(f"[{progress:10.6f}] booting\r\n")
+        finally:
+            hypervisor.booting -= 1
+        self.state = self.READY_STATE
+        banner = self.BANNER.format(hostname=self.hostname)
+        write(f"\r\n{banner}\r\n\r\n{self.prompt}")
+
+    @property
+    def prompt(self):
+        if self.state in ("off", "booting"):
+            return ""
+        if self.state == "login":
+            return f"{self.hostname} login: "
+        if self.state == "password":
+            return "Password: "
+        if self.state == "configuration":
+            return f"[edit]\r\n{self.user}@{self.hostname}# "
+        return f"{self.user}@{self.hostname}:~$ "
+
+    def interrupt(self):
+        return "^C\r\n" + self.prompt
+
+    def end_of_file(self):
+        if self.state == "operational":
+            self.state, self.user = "login", None
+            return "logout\r\n\r\n" + self.prompt
+        return ""
+
+    def handle_line(self, line):
+        # returns the output of a line of input, prompt included
+        line = line.strip()
+        if self.state in ("off", "booting"):
+            return ""
+        if self.state == "login":
+            if not line:
+                return self.prompt
+            self.user, self.state = line, "password"
+            return self.prompt
+        if self.state == "password":
+            if self.user == self.login and line == self.password:
+                self.state = "operational"
+                return f"\r\n{self.WELCOME}\r\n{self.prompt}"
+            self.state, self.user = "login", None
+            return "\r\nLogin incorrect\r\n" + self.prompt
+        if self.state == "configuration":
+            return self.configuration_command(line) + self.prompt
+        return self.operational_command(line) + self.prompt
+
+    def operational_command(self, line):
+        words = line.split()
+        if not words:
+            return ""
+        if line == "configure":
+            self.state = "configuration"
+            self.candidate = list(self.committed)
+            return LIVE_ISO_WARNING + "\r\n"
+        if line in ("exit", "logout"):
+            self.state, self.user = "login", None
+            return "logout\r\n\r\n"
+        if line == "set terminal length 0":
+            return ""
+        if line == "show configuration":
+            return self.render(self.committed)
+        if line == "show configuration commands":
+            return "".join(f"{c}\r\n" for c in self.committed)
+        if line == "show version":
+            return "Version:          VyOS 1.4-rolling-fake\r\n"
+        return f"\r\n  Invalid command: [{words[0]}]\r\n\r\n"
+
+    def configuration_command(self, line):
+        words = line.split()
+        if not words:
+            return ""
+        if words[0] == "set" and len(words) > 1:
+            if line not in self.candidate:
+                self.candidate.append(line)
+            return ""
+        if words[0] == "delete" and len(words) > 1:
+            path = "set" + line[len("delete") :]
+            before = len(self.candidate)
+            self.candidate = [c for c in self.candidate if not c.startswith(path)]
+            if len(self.candidate) == before:
+                return "\r\n  Nothing to delete\r\n\r\n"
+            return ""
+        if line == "show":
+            return self.render(self.candidate)
+        if line == "show | commands":
+            return "".join(f"{c}\r\n" for c in self.candidate)
+        if line == "show | json":
+            output = json.dumps(self.tree(self.candidate), indent=4)
+            return output.replace("\n", "\r\n") + "\r\n"
+        if line == "commit":
+            if self.candidate == self.committed:
+                return "No configuration changes to commit\r\n"
+            self.committed = list(self.candidate)
+            return ""
+        if line == "save":
+            self.saved = list(self.committed)
+            return "Saving configuration to '/config/config.boot'...\r\nDone\r\n"
+        if line == "exit":
+            if self.candidate != self.committed:
+                return (
+                    "Cannot exit: configuration modified.\r\n"
+                    "Use 'exit discard' to discard the changes and exit.\r\n"
+                )
+            self.state = "operational"
+            return "exit\r\n"
+        if line == "exit discard":
+            self.state = "operational"
+            return "exit\r\n"
+        return f"\r\n  Invalid command: [{words[0]}]\r\n\r\n"
+
+    @staticmethod
+    def tree(commands):
+        # "set a b c 'value'" is rendered as {"a": {"b": {"c": "value"}}}
+        root = dict()
+        for command in commands:
+            words = shlex.split(command)[1:]
+            node = root
+            for word in words[:-2]:
+                node = node.setdefault(word, dict())
+            if len(words) >= 2:
+                node[words[-2]] = words[-1]
+            else:
+                node.setdefault(words[-1], dict())
+        return root
+
+    def render(self, commands):
+        def lines(node, indent):
+            for key, value in node.items():
+                if isinstance(value, dict):
+                    yield f"{indent}{key} {{"
+                    yield from lines(value, indent + "    ")
+                    yield f"{indent}}}"
+                else:
+                    yield f"{indent}{key} {value}"
+
+        return "".join(f"{line}\r\n" for line in lines(self.tree(commands), " "))
+
+
+class FakeNxos(FakeVyos):
+    """State of a fake NX-OS switch, whose configuration commands are applied at
+    once. Indented lines belong to the last section, as in the lab configurations."""
+
+    BANNER = "User Access Verification"
+    WELCOME = "Cisco NX-OS Software"
+    SECTIONS = {"interface": "-if", "vlan": "-vlan", "vrf": "-vrf", "username": ""}
+    INVALID = "% Invalid command at '^' marker.\r\n"
+    VERSION = "9.3(8)"
+    # sections of the running configuration set by the switch, before and after
+    # the configured ones
+    SYSTEM_SECTIONS = [
+        [
+            "vdc {hostname} id 1",
+            [
+                "  limit-resource vlan minimum 16 maximum 4094",
+                "  limit-resource vrf minimum 2 maximum 4096",
+            ],
+        ],
+        ["copp profile strict", []],
+        ["rmon event 1 description FATAL(1) owner PMON@FATAL", []],
+    ]
+    TRAILING_SECTIONS = [
+        ["interface mgmt0", ["  vrf member management"]],
+        ["line console", []],
+        ["line vty", []],
+        ["boot nxos bootflash:/nxos.9.3.8.bin", []],
+    ]
+
+    def __init__(self, hostname="switch", login="admin", password="admin", **options):
+        super().__init__(hostname, login, password, **options)
+        # sections of the running configuration, a line and its indented lines
+        self.running = [[f"hostname {hostname}", []]]
+        self.saved = None
+        self.section = None
+        self.submode = ""
+
+    @property
+    def prompt(self):
+        if self.state == "configuration":
+            return f"{self.hostname}(config{self.submode})# "
+        if self.state == "operational":
+            return f"{self.hostname}# "
+        return super().prompt
+
+    def end_of_file(self):
+        return ""
+
+    def handle_line(self, line):
+        if self.state == "configuration":
+            return self.configuration_command(line) + self.prompt
+        return super().handle_line(line)
+
+    def operational_command(self, line):
+        if not line:
+            return ""
+        if line in ("configure terminal", "conf t"):
+            self.state, self.section, self.submode = "configuration", None, ""
+            return "Enter configuration commands, one per line. End with CNTL/Z.\r\n"
+        if line == "exit":
+            self.state, self.user = "login", None
+            return "\r\n"
+        if line == "terminal length 0":
+            return ""
+        if line == "show running-config":
+            now = time.strftime("%a %b %d %H:%M:%S %Y")
+            return (
+                "\r\n!Command: show running-config\r\n"
+                f"!Running configuration last done at: {now}\r\n"
+                f"!Time: {now}\r\n\r\n" + self.render()
+            )
+        if line == "copy running-config startup-config":
+            self.saved = [[section, list(lines)] for section, lines in self.running]
+            return f"[{'#' * 40}] 100%\r\nCopy complete.\r\n"
+        if line == "show version":
+            return "Cisco Nexus Operating System (NX-OS) Software\r\n"
+        return "                ^\r\n" + self.INVALID
+
+    def configuration_command(self, line):
+        command = line.strip()
+        if not command:
+            return ""
+        if command == "end":
+            self.state = "operational"
+            return ""
+        if command == "exit":
+            if self.submode or self.section:
+                self.section, self.submode = None, ""
+            else:
+                self.state = "operational"
+            return ""
+        if command.startswith(("#", "!")):
+            return ""
+        if command.startswith("show "):
+            return self.operational_command(command)
+        if line[0].isspace() and self.section is not None:
+            if line.rstrip() not in self.section[1]:
+                self.section[1].append(line.rstrip())
+            return ""
+        if command.startswith("no "):
+            # removes a line, or is kept as such, e.g. no password strength-check
+            before = len(self.running)
+            self.running = [s for s in self.running if s[0] != command[3:]]
+            if len(self.running) == before and [command, []] not in self.running:
+                self.running.append([command, []])
+            self.section, self.submode = None, ""
+            return ""
+        word = command.split()[0]
+        if word == "hostname":
+            self.hostname = command.split()[1]
+            self.running = [s for s in self.running if not s[0].startswith(word)]
+            self.running.insert(0, [command, []])
+            self.section, self.submode = None, ""
+            return ""
+        if word not in self.SECTIONS and word not in ("feature", "ip"):
+            return self.INVALID
+        section = next((s for s in self.running if s[0] == command), None)
+        if section is None:
+            section = [command, []]
+            self.running.append(section)
+        if word in self.SECTIONS:
+            self.section, self.submode = section, self.SECTIONS[word]
+        else:
+            self.section, self.submode = None, ""
+        return ""
+
+    def render(self):
+        # as NX-OS, the version and the hostname come first, and the sections set
+        # by the switch are around the configured ones
+        hostname, *running = self.running
+        system = [
+            [section.format(hostname=self.hostname), children]
+            for section, children in self.SYSTEM_SECTIONS
+        ]
+        sections = [
+            [f"version {self.VERSION} Bios:version", []],
+            hostname,
+            *system,
+            *running,
+            *self.TRAILING_SECTIONS,
+        ]
+        lines = list()
+        for section, children in sections:
+            if children:
+                lines.append("")
+            lines.append(section)
+            lines.extend(children)
+        return "".join(f"{line}\r\n" for line in lines)
+
+
+class FakeShell(FakeVyos):
+    """State of a fake shell of a docker node, with no login."""
+
+    READY_STATE = "operational"
+    BANNER = "Welcome to {hostname}"
+
+    def __init__(self, hostname="host", **options):
+        super().__init__(hostname, **options)
+        # IPv4 interface of each device
+        self.addresses = dict()
+
+    @property
+    def prompt(self):
+        if self.state in ("off", "booting"):
+            return ""
+        return "bash-5.1# "
+
+    def end_of_file(self):
+        return ""
+
+    def operational_command(self, line):
+        words = line.split()
+        if not words:
+            return ""
+        if len(words) == 6 and words[0] == "ifconfig" and words[3] == "netmask":
+            try:
+                self.addresses[words[1]] = ipaddress.IPv4Interface(
+                    f"{words[2]}/{words[4]}"
+                )
+            except ValueError:
+                return f"ifconfig: bad address '{words[2]}'\r\n"
+            return ""
+        if line == "ip -o -4 addr show":
+            addresses = {"lo": ipaddress.IPv4Interface("127.0.0.1/8")}
+            addresses.update(self.addresses)
+            return "".join(
+                f"{n}: {device}    inet {address.with_prefixlen} scope global "
+                f"{device}\\       valid_lft forever preferred_lft forever\r\n"
+                for n, (device, address) in enumerate(addresses.items(), 1)
+            )
+        if line == "hostname":
+            return f"{self.hostname}\r\n"
+        return f"bash: {words[0]}: command not found\r\n"
+
+
+# hostname prefix and class of the fake routers of each vendor
+VENDORS = {
+    "vyos": ("vyos", FakeVyos),
+    "nxos": ("SW", FakeNxos),
+    "shell": ("LAP", FakeShell),
+}
+
+
+class FakeConsole(asyncio.Protocol):
+    """Telnet console of a fake router, with echo as a real console."""
+
+    def __init__(self, router):
+        self.router = router
+        self.transport = None
+        self.line = ""
+        self.last = None
+        self.iac = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # the console echoes, like the GNS3 telnet consoles
+        transport.write(bytes([IAC, WILL, ECHO, IAC, WILL, SUPPRESS_GO_AHEAD]))
+        if self.router.state == "off":
+            asyncio.ensure_future(self.router.boot(self.send))
+
+    def data_received(self, data):
+        output = ""
+        for c in data:
+            if self.iac or c == IAC:
+                # option replies from the client are ignored
+                self.iac += bytes([c])
+                if len(self.iac) == 3 or (
+                    len(self.iac) == 2 and self.iac[1] not in (WILL, WONT, DO, DONT)
+                ):
+                    self.iac = b""
+                continue
+            if c == 0x03:
+                self.line = ""
+                output += self.router.interrupt()
+            elif c == 0x04:
+                if not self.line:
+                    output += self.router.end_of_file()
+            elif c in (0x0A, 0x0D):
+                # \r\n and \r\0 line ends are read as a single one
+                if c == 0x0A and self.last == 0x0D:
+                    self.last = c
+                    continue
+                line, self.line = self.line, ""
+                output += "\r\n" + self.router.handle_line(line)
+            elif c >= 0x20:
+                self.line += chr(c)
+                if self.router.state != "password":
+                    output += chr(c)
+            self.last = c
+        if output:
+            self.send(output)
+
+    def send(self, output):
+        if self.transport.is_closing():
+            return
+        data = output.encode()
+        if self.router.delay:
+            asyncio.get_running_loop().call_later(
+                self.router.delay, self.transport.write, data
+            )
+        else:
+            self.transport.write(data)
+
+
+async def serve(host, base_port, count, vendor="vyos", **router_options):
+    # one router per port, from base_port to base_port + count - 1, or on ephemeral
+    # ports with a base_port of 0
+    loop = asyncio.get_running_loop()
+    servers = list()
+    if "hypervisor" not in router_options:
+        router_options["hypervisor"] = FakeHypervisor(router_options.pop("cpus", 4))
+    prefix, router_class = VENDORS[vendor]
+    for n in range(count):
+        router = router_class(hostname=f"{prefix}{n + 1}", **router_options)
+        server = await loop.create_server(
+            lambda router=router: FakeConsole(router),
+            host,
+            base_port + n if base_port else 0,
+        )
+        servers.append(server)
+    return servers
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=5000, show_default=True, help="first console port")
+@click.option("--count", default=1, show_default=True, help="number of routers")
+@click.option(
+    "--delay",
+    default=0.0,
+    show_default=True,
+    help="seconds before each answer of the routers",
+)
+@click.option(
+    "--boot-time",
+    default=0.0,
+    show_default=True,
+    help="seconds to boot on a free CPU, routers boot on their first connection",
+)
+@click.option(
+    "--cpus",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="CPUs shared by the routers booting at once",
+)
+@click.option(
+    "--vendor",
+    default="vyos",
+    show_default=True,
+    type=click.Choice(list(VENDORS)),
+    help="VyOS routers, NX-OS switches or docker shells",
+)
+def fake_vyos_console(host, port, count, delay, boot_time, cpus, vendor):
+    """Serves telnet consoles of fake VyOS routers, or NX-OS switches or docker
+    shells, to try the console scripts."""
+
+    async def main():
+        servers = await serve(
+            host,
+            port,
+            count,
+            vendor=vendor,
+            delay=delay,
+            boot_time=boot_time,
+            cpus=cpus,
+        )
+        last = port + count - 1
+        logger.info(f"{count} fake {vendor} consoles on {host}:{port}-{last}")
+        await asyncio.gather(*[s.serve_forever() for s in servers])
+
+    logzero.loglevel(logzero.INFO)
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    fake_vyos_console()
@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+
+import asyncio
+import click
+import json
+import logzero
+import time
+from logzero import logger
+from lab_consoles import node_console, node_driver, parse_drivers, project_nodes
+
+
+class BootOrchestrator:
+    """Starts the nodes of a project in waves: at most concurrency nodes boot at
+    once, started at least stagger seconds apart, and a node is booted when its
+    console shows a prompt."""
+
+    def __init__(
+        self, gns3_server_url, concurrency=4, stagger=1.0, timeout=600, drivers=()
+    ):
+        self.gns3_server_url = gns3_server_url
+        self.concurrency = concurrency
+        self.stagger = stagger
+        self.timeout = timeout
+        # (pattern, driver) of the nodes, see node_driver
+        self.drivers = drivers
+        self.started = None
+        self._semaphore = None
+        self._start_lock = None
+        self._last_start = None
+
+    async def _start(self, node):
+        # node starts are spaced by stagger seconds
+        loop = asyncio.get_running_loop()
+        async with self._start_lock:
+            if self._last_start is not None:
+                wait = self._last_start + self.stagger - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            self._last_start = loop.time()
+            logger.info(f"Starting {node.metadata.name} ...")
+            # gns3_client is blocking, the other nodes keep booting meanwhile
+            await asyncio.to_thread(node.start)
+
+    async def _open_console(self, driver, host, port, deadline):
+        # consoles may refuse connections until their node is started
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                return await driver(host=host, port=port).open()
+            except (OSError, asyncio.TimeoutError):
+                if loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.5)
+
+    async def boot_node(self, node):
+        loop = asyncio.get_running_loop()
+        name = node.metadata.name
+        result = {"node": name, "status": None}
+        console = node_console(node, self.gns3_server_url)
+        if console is None:
+            result.update(status="failed", error="no telnet console")
+            return result
+
+        async with self._semaphore:
+            start = loop.time()
+            try:
+                if node.metadata.status == "started":
+                    result["status"] = "already started"
+                else:
+                    await self._start(node)
+                    # time to ready is counted from the node start
+                    start = loop.time()
+                result["start"] = round(start - self.started, 3)
+                deadline = start + self.timeout
+                driver = node_driver(name, self.drivers)
+                v = await self._open_console(driver, *console, deadline)
+                try:
+                    mode = await v.wait_ready(max(deadline - loop.time(), 0))
+                finally:
+                    v.close()
+                result["mode"] = mode.name
+                result["status"] = result["status"] or "ready"
+            except Exception as e:
+                logger.debug(f"{name}: {e!r}")
+                result["status"] = "failed"
+                result["error"] = f"{e.__class__.__name__}: {e}"
+            result["time_to_ready"] = round(loop.time() - start, 3)
+            logger.info(f"{name}: {result['status']} in {result['time_to_ready']}s")
+        return result
+
+    async def boot(self, nodes):
+        self.started = asyncio.get_running_loop().time()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._start_lock = asyncio.Lock()
+        self._last_start = None
+        return await asyncio.gather(*[self.boot_node(node) for node in nodes])
+
+
+@click.command()
+@click.option("-v", "--verbose", count=True)
+@click.option(
+    "--gns3-server-url",
+    envvar="GNS3_SERVER_URL",
+    default="http://gns3.example.com:3080/v2",
+    show_default=True,
+    help="GNS3 server URL",
+)
+@click.option(
+    "--gns3-project-name",
+    envvar="GNS3_PROJECT_NAME",
+    default="lab",
+    show_default=True,
+    help="GNS3 project name",
+)
+@click.option(
+    "--node",
+    "nodes",
+    multiple=True,
+    help="name pattern of the nodes, e.g. 'R*', all the nodes by default",
+)
+@click.option(
+    "--concurrency",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="number of nodes booting at once",
+)
+@click.option(
+    "--stagger",
+    default=1.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="minimum seconds between two node starts",
+)
+@click.option(
+    "--timeout",
+    default=600.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="seconds for a node to get to a prompt after its start",
+)
+@click.option(
+    "--driver",
+    "drivers",
+    multiple=True,
+    callback=parse_drivers,
+    help="console driver of the nodes matching a pattern, e.g. 'SW*=nxos', "
+    "vyos by default",
+)
+@click.option("--json", "as_json", is_flag=True, help="print the report as JSON")
+def lab_boot(
+    verbose,
+    gns3_server_url,
+    gns3_project_name,
+    nodes,
+    concurrency,
+    stagger,
+    timeout,
+    drivers,
+    as_json,
+):
+    """Starts the nodes of a GNS3 project in waves, and waits until their console
+    shows a prompt."""
+    if verbose == 2:
+        logzero.loglevel(logzero.DEBUG)
+    elif verbose == 1:
+        logzero.loglevel(logzero.INFO)
+    else:
+        logzero.loglevel(logzero.WARNING)
+
+    try:
+        project = project_nodes(gns3_server_url, gns3_project_name, nodes)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if not project:
+        raise click.ClickException("no matching node")
+
+    orchestrator = BootOrchestrator(
+        gns3_server_url, concurrency, stagger, timeout, drivers
+    )
+    start = time.perf_counter()
+    report = asyncio.run(orchestrator.boot(project))
+    seconds = time.perf_counter() - start
+
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        click.echo(f"{'node':<20} {'status':<16} {'start':>8} {'ready':>8} mode")
+        for r in report:
+            click.echo(
+                f"{r['node']:<20} {r['status']:<16} {r.get('start', 0):>8.1f} "
+                f"{r.get('time_to_ready', 0):>8.1f} {r.get('mode') or r.get('error')}"
+            )
+
+    failed = [r["node"] for r in report if r["status"] == "failed"]
+    click.echo(
+        f"{len(report)} nodes, {len(failed)} failed, {seconds:.1f}s", err=True
+    )
+    if failed:
+        raise click.ClickException(f"failed to boot {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    lab_boot()
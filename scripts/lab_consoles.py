@@ -0,0 +1,287 @@
+#! /usr/bin/env python
+
+import asyncio
+import click
+import fnmatch
+import json
+import logzero
+import time
+from logzero import logger
+from urllib.parse import urlparse
+from console_broker import BrokeredConsole
+from expect import DRIVERS, Vyos
+
+
+def project_nodes(gns3_server_url, project_name, patterns=None):
+    """Returns the nodes of a GNS3 project sorted by name, only those whose name
+    matches one of patterns if set."""
+    import gns3_client
+    import requests_cache
+
+    server = gns3_client.Server(base_url=gns3_server_url)
+    server.cache = requests_cache.backends.BaseCache()
+    server.projects.pull()
+    project = next(
+        (p for p in server.projects if p.metadata.name == project_name), None
+    )
+    if project is None:
+        raise ValueError(f"project {project_name} not found on {gns3_server_url}")
+    project.nodes.pull()
+    return [
+        node
+        for node in sorted(project.nodes, key=lambda n: n.metadata.name)
+        if not patterns
+        or any(fnmatch.fnmatchcase(node.metadata.name, p) for p in patterns)
+    ]
+
+
+def node_console(node, gns3_server_url):
+    # (host, port) of the telnet console of a node, None if it has none
+    m = node.metadata
+    if m.console_type != "telnet" or not m.console:
+        return None
+    # consoles listening on all addresses are reached through the server
+    host = m.console_host
+    if not host or host in ("0.0.0.0", "::"):
+        host = urlparse(gns3_server_url).hostname
+    return host, m.console
+
+
+def project_consoles(gns3_server_url, project_name, patterns=None):
+    """Returns (name, host, port) of the telnet consoles of the nodes of a GNS3
+    project, for the nodes whose name matches one of patterns if set."""
+    consoles = list()
+    for node in project_nodes(gns3_server_url, project_name, patterns):
+        console = node_console(node, gns3_server_url)
+        if console:
+            consoles.append((node.metadata.name, *console))
+    return consoles
+
+
+def parse_drivers(ctx, param, value):
+    # "SW*=nxos" selects the NX-OS driver for the nodes whose name starts with SW
+    drivers = list()
+    for v in value:
+        pattern, _, name = v.rpartition("=")
+        if name not in DRIVERS:
+            raise click.BadParameter(
+                f"unknown driver {name}, use one of {', '.join(DRIVERS)}"
+            )
+        drivers.append((pattern or "*", DRIVERS[name]))
+    return drivers
+
+
+def node_driver(name, drivers=()):
+    # driver of the first pattern matching the name of the node, VyOS by default
+    return next(
+        (driver for p, driver in drivers if fnmatch.fnmatchcase(name, p)), Vyos
+    )
+
+
+async def run_on_console(
+    name, host, port, function, semaphore, login, password, driver=Vyos, broker=None
+):
+    # returns the result of function(driver) on a node, or the error which stopped
+    # it, through the session of the broker on its local socket if set
+    async with semaphore:
+        result = {"node": name, "console": f"{host}:{port}"}
+        start = time.perf_counter()
+        if broker:
+            console = BrokeredConsole(broker, host, port, driver.NAME, login, password)
+        else:
+            console = driver(host=host, port=port)
+        try:
+            async with console as v:
+                await v.login(login, password)
+                result["output"] = await function(v)
+                await v.logout()
+        except Exception as e:
+            logger.debug(f"{name}: {e!r}")
+            result["error"] = f"{e.__class__.__name__}: {e}"
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
+
+
+async def run_on_consoles(
+    consoles, function, login, password, concurrency=10, drivers=(), broker=None
+):
+    # at most concurrency consoles are open at once
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *[
+            run_on_console(
+                name,
+                host,
+                port,
+                function,
+                semaphore,
+                login,
+                password,
+                node_driver(name, drivers),
+                broker,
+            )
+            for name, host, port in consoles
+        ]
+    )
+
+
+def run_commands(commands, configuration=False):
+    async def function(v):
+        results = list()
+        for command in commands:
+            r = await v.run_command(command, configuration=configuration)
+            results.append(
+                {
+                    "command": r.command,
+                    "output": r.output,
+                    "seconds": round(r.seconds, 3),
+                }
+            )
+        return results
+
+    return function
+
+
+def get_configuration(configuration_format):
+    async def function(v):
+        if configuration_format != "text" and v.NAME != Vyos.NAME:
+            raise Exception(f"no {configuration_format} configuration on {v.NAME}")
+        if configuration_format == "json":
+            return await v.get_configuration_json()
+        if configuration_format == "commands":
+            return await v.get_configuration_commands()
+        return await v.get_configuration()
+
+    return function
+
+
+@click.command()
+@click.option("-v", "--verbose", count=True)
+@click.option(
+    "--gns3-server-url",
+    envvar="GNS3_SERVER_URL",
+    default="http://gns3.example.com:3080/v2",
+    show_default=True,
+    help="GNS3 server URL",
+)
+@click.option(
+    "--gns3-project-name",
+    envvar="GNS3_PROJECT_NAME",
+    default="lab",
+    show_default=True,
+    help="GNS3 project name",
+)
+@click.option(
+    "--node",
+    "nodes",
+    multiple=True,
+    help="name pattern of the nodes, e.g. 'R*', all the nodes by default",
+)
+@click.option(
+    "--concurrency",
+    default=10,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="number of consoles open at once",
+)
+@click.option(
+    "--driver",
+    "drivers",
+    multiple=True,
+    callback=parse_drivers,
+    help="console driver of the nodes matching a pattern, e.g. 'SW*=nxos', "
+    "vyos by default",
+)
+@click.option("--login", help="user, the default user of the driver by default")
+@click.option("--password", help="password, the default one of the driver by default")
+@click.option(
+    "--broker",
+    envvar="CONSOLE_BROKER",
+    help="local socket of console_broker.py, to use its logged in sessions",
+)
+@click.option(
+    "-c",
+    "--command",
+    "commands",
+    multiple=True,
+    help="command to run on every node, the configuration is shown if none",
+)
+@click.option(
+    "--configuration-mode",
+    is_flag=True,
+    help="run the commands in configuration mode, without committing",
+)
+@click.option(
+    "--configuration-format",
+    default="text",
+    show_default=True,
+    type=click.Choice(["text", "commands", "json"]),
+    help="format of the configuration shown",
+)
+@click.option("--json", "as_json", is_flag=True, help="print the results as JSON")
+def lab_consoles(
+    verbose,
+    gns3_server_url,
+    gns3_project_name,
+    nodes,
+    concurrency,
+    drivers,
+    login,
+    password,
+    broker,
+    commands,
+    configuration_mode,
+    configuration_format,
+    as_json,
+):
+    """Runs commands, or shows the configuration, on the nodes of a GNS3 project
+    through their consoles, concurrently."""
+    logzero.loglevel(logzero.DEBUG if verbose else logzero.WARNING)
+
+    try:
+        consoles = project_consoles(gns3_server_url, gns3_project_name, nodes)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if not consoles:
+        raise click.ClickException("no telnet console on the matching nodes")
+
+    if commands:
+        function = run_commands(commands, configuration_mode)
+    else:
+        function = get_configuration(configuration_format)
+    start = time.perf_counter()
+    results = asyncio.run(
+        run_on_consoles(
+            consoles, function, login, password, concurrency, drivers, broker
+        )
+    )
+    seconds = time.perf_counter() - start
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+    else:
+        for r in results:
+            click.echo(f"# {r['node']} ({r['console']}) {r['seconds']:.3f}s")
+            if "error" in r:
+                click.echo(f"FAILED: {r['error']}")
+            elif commands:
+                for c in r["output"]:
+                    click.echo(f"## {c['command']}")
+                    click.echo(c["output"])
+            elif configuration_format == "json":
+                click.echo(json.dumps(r["output"], indent=4))
+            elif configuration_format == "commands":
+                click.echo("\n".join(r["output"]))
+            else:
+                click.echo(r["output"])
+
+    failed = [r["node"] for r in results if "error" in r]
+    click.echo(
+        f"{len(results)} nodes, {len(failed)} failed, {seconds:.3f}s", err=True
+    )
+    if failed:
+        raise click.ClickException(f"failed on {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    lab_consoles()
@@ -0,0 +1,131 @@
+#! /usr/bin/env python
+
+import click
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from bench_sync import git_commit
+
+# modules which must not be loaded before a phase needs them
+HEAVY_MODULES = ("gns3_client", "requests_cache", "requests", "urllib3")
+
+
+def run_times(args, repeat):
+    # wall time of each run of the command, in milliseconds
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, capture_output=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def import_times(args):
+    # (self, cumulative) microseconds per module imported by the command, from
+    # python -X importtime; nested modules are indented below their parent
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", *args], capture_output=True, text=True
+    )
+    modules = dict()
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        name = name[1:].rstrip()
+        modules[name.strip()] = (int(own), int(cumulative), name)
+    return modules
+
+
+@click.command()
+@click.option(
+    "--script",
+    "scripts",
+    multiple=True,
+    default=(
+        "nb2gns3.py",
+        "reverse_sync.py",
+        "../lab_consoles.py",
+        "../drift_check.py",
+        "../lab_boot.py",
+    ),
+    show_default=True,
+    help="script to time, relative to this directory, repeated for several scripts",
+)
+@click.option("--repeat", default=10, show_default=True, type=click.IntRange(min=1))
+@click.option(
+    "--top",
+    default=10,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="number of top-level imports listed, slowest first",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="write the results to this JSON file",
+)
+def bench_startup(scripts, repeat, top, output):
+    """Times --help and an argument error of the scripts, which should not load
+    the GNS3 client nor requests, and lists their slowest imports."""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    baseline = statistics.median(run_times([sys.executable, "-c", "pass"], repeat))
+    click.echo(f"python startup: {baseline:.1f}ms")
+
+    results, heavy = list(), list()
+    for script in scripts:
+        path = os.path.join(cwd, script)
+        for name, args in (("help", ["--help"]), ("usage error", ["--no-such-option"])):
+            times = run_times([sys.executable, path, *args], repeat)
+            modules = import_times([path, *args])
+            loaded = [m for m in HEAVY_MODULES if m in modules]
+            heavy += [f"{script} {args[0]}: {m}" for m in loaded]
+            results.append(
+                {
+                    "script": script,
+                    "command": name,
+                    "median_ms": round(statistics.median(times), 1),
+                    "min_ms": round(min(times), 1),
+                    "import_us": sum(own for own, _, _ in modules.values()),
+                    "heavy_modules": loaded,
+                }
+            )
+            r = results[-1]
+            click.echo(
+                f"{script} {name:<12} median={r['median_ms']:>7.1f}ms "
+                f"min={r['min_ms']:>7.1f}ms imports={r['import_us'] / 1000:>6.1f}ms "
+                f"heavy={','.join(loaded) or '-'}"
+            )
+
+        # top-level imports of the script, site and encodings being the interpreter's
+        modules = import_times([path, "--help"])
+        top_level = [
+            (cumulative, name)
+            for _, cumulative, name in modules.values()
+            if not name.startswith(" ") and name not in ("site", "encodings")
+        ]
+        for cumulative, name in sorted(top_level, reverse=True)[:top]:
+            click.echo(f"  {cumulative / 1000:>7.1f}ms  {name}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "repeat": repeat,
+                    "python_startup_ms": round(baseline, 1),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if heavy:
+        raise click.ClickException(f"modules loaded at startup: {', '.join(heavy)}")
+
+
+if __name__ == "__main__":
+    bench_startup()
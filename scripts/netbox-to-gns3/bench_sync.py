@@ -0,0 +1,231 @@
+#! /usr/bin/env python
+
+import click
+import json
+import logzero
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from fake_servers import (
+    FakeGNS3Server,
+    FakeNetBoxServer,
+    FakeServerProcess,
+    synthetic_netbox,
+)
+from nb2gns3 import DEVICE_QUERY, Converter
+from netbox_session import NetBoxSession
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(netbox, gns3, function, memory=True):
+    netbox_before, gns3_before = netbox.stats(), gns3.stats()
+    # peak memory is measured above the memory in use when the phase starts
+    if memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+
+    peak_memory = None
+    if memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    netbox_after, gns3_after = netbox.stats(), gns3.stats()
+    return {
+        "seconds": round(seconds, 4),
+        "netbox_requests": netbox_after["requests"] - netbox_before["requests"],
+        "netbox_bytes": netbox_after["bytes"] - netbox_before["bytes"],
+        "gns3_requests": gns3_after["requests"] - gns3_before["requests"],
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def bench_sync_run(
+    data, netbox_latency, gns3_latency, netbox_concurrency, gns3_concurrency, memory
+):
+    netbox = FakeServerProcess(FakeNetBoxServer, data, latency=netbox_latency)
+    gns3 = FakeServerProcess(FakeGNS3Server, latency=gns3_latency)
+    phases = dict()
+    try:
+
+        def converter():
+            session = NetBoxSession(netbox.url, concurrency=netbox_concurrency)
+            return Converter(session, gns3.url, "bench")
+
+        c = converter()
+        phases["compute_target"] = measure(
+            netbox, gns3, lambda: c.compute_target(DEVICE_QUERY), memory
+        )
+        phases["compute_plan"] = measure(netbox, gns3, c.compute_plan, memory)
+
+        def apply_plan():
+            if not c.apply_plan(concurrency=gns3_concurrency):
+                raise click.ClickException(f"plan not fully applied:\n{c.report}")
+
+        phases["apply_plan"] = measure(netbox, gns3, apply_plan, memory)
+
+        # a second run against the synced project, which should plan nothing
+        c = converter()
+
+        def resync():
+            c.compute_target(DEVICE_QUERY)
+            c.compute_plan()
+            if any(c.plan.values()):
+                raise click.ClickException("resync planned changes on a synced project")
+
+        phases["resync"] = measure(netbox, gns3, resync, memory)
+    finally:
+        netbox.stop()
+        gns3.stop()
+    return phases
+
+
+@click.command()
+@click.option(
+    "--devices",
+    default="50,100,200",
+    show_default=True,
+    help="comma separated numbers of devices, the default takes about a minute with "
+    "--memory, 1000 devices take about ten minutes",
+)
+@click.option(
+    "--links-per-device",
+    default=1.5,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="number of links per device",
+)
+@click.option("--platforms", default=3, show_default=True, type=click.IntRange(min=1))
+@click.option("--sites", default=2, show_default=True, type=click.IntRange(min=1))
+@click.option(
+    "--interfaces",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="number of interfaces per device",
+)
+@click.option(
+    "--netbox-latency",
+    default=0.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="milliseconds added to every NetBox request",
+)
+@click.option(
+    "--gns3-latency",
+    default=0.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="milliseconds added to every GNS3 request",
+)
+@click.option(
+    "--netbox-concurrency", default=1, show_default=True, type=click.IntRange(min=1)
+)
+@click.option(
+    "--gns3-concurrency", default=1, show_default=True, type=click.IntRange(min=1)
+)
+@click.option(
+    "--memory/--no-memory",
+    default=True,
+    show_default=True,
+    help="trace peak memory per phase, which slows the phases down",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="write the results to this JSON file",
+)
+def bench_sync(
+    devices,
+    links_per_device,
+    platforms,
+    sites,
+    interfaces,
+    netbox_latency,
+    gns3_latency,
+    netbox_concurrency,
+    gns3_concurrency,
+    memory,
+    output,
+):
+    logzero.loglevel(logzero.ERROR)
+    parameters = {
+        "links_per_device": links_per_device,
+        "platforms": platforms,
+        "sites": sites,
+        "interfaces": interfaces,
+        "netbox_latency_ms": netbox_latency,
+        "gns3_latency_ms": gns3_latency,
+        "netbox_concurrency": netbox_concurrency,
+        "gns3_concurrency": gns3_concurrency,
+        "memory": memory,
+    }
+    results = list()
+
+    click.echo(
+        f"{'devices':>8} {'links':>6} {'phase':<15} {'seconds':>9} "
+        f"{'netbox':>7} {'gns3':>7} {'peak MB':>8}"
+    )
+    cwd = os.getcwd()
+    # gns3_client leaves an HTTP cache file in the working directory
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for size in [int(d) for d in devices.split(",")]:
+                links = int(size * links_per_device)
+                try:
+                    data = synthetic_netbox(size, links, platforms, sites, interfaces)
+                except ValueError as e:
+                    raise click.BadParameter(str(e))
+                phases = bench_sync_run(
+                    data,
+                    netbox_latency / 1000,
+                    gns3_latency / 1000,
+                    netbox_concurrency,
+                    gns3_concurrency,
+                    memory,
+                )
+                results.append({"devices": size, "links": links, "phases": phases})
+                for name, p in phases.items():
+                    peak = p["peak_memory_bytes"]
+                    peak = f"{peak / 1e6:.1f}" if peak is not None else "-"
+                    click.echo(
+                        f"{size:>8} {links:>6} {name:<15} {p['seconds']:>9.3f} "
+                        f"{p['netbox_requests']:>7} {p['gns3_requests']:>7} "
+                        f"{peak:>8}"
+                    )
+        finally:
+            os.chdir(cwd)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "parameters": parameters,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    bench_sync()
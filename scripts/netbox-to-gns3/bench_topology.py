@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+
+import click
+import time
+import logzero
+from nb2gns3 import Converter
+
+
+def synthetic_topology(devices_count, interfaces_count=8, platforms_count=4):
+    platforms = {
+        p: {
+            "id": p,
+            "name": f"platform-{p}",
+            "custom_fields": {"gns3_template_type": "qemu"},
+        }
+        for p in range(1, platforms_count + 1)
+    }
+    sites = {
+        1: {
+            "id": 1,
+            "name": "site-1",
+            "custom_fields": {
+                "gns3_x": 0,
+                "gns3_y": 0,
+                "gns3_z": 0,
+                "gns3_width": 1000,
+                "gns3_height": 1000,
+            },
+        }
+    }
+
+    devices = list()
+    for d in range(1, devices_count + 1):
+        device = {
+            "id": d,
+            "name": f"device-{d}",
+            "platform": platforms[d % platforms_count + 1],
+            "site": {"id": 1},
+            "custom_fields": {"gns3_x": d, "gns3_y": d, "gns3_z": 1},
+            "interfaces": list(),
+        }
+        for n in range(interfaces_count):
+            device["interfaces"].append(
+                {
+                    "id": d * 1000 + n,
+                    "name": f"eth{n}",
+                    "device": {"id": d, "name": device["name"]},
+                    "type": {"value": "1000base-t"},
+                    "mgmt_only": n == 0,
+                    "connected_endpoint_type": None,
+                    "connected_endpoint": None,
+                }
+            )
+        devices.append(device)
+
+    # a ring plus a chord per device, so that every device has 4 links
+    def connect(a, port_a, b, port_b):
+        int_a = devices[a]["interfaces"][port_a]
+        int_b = devices[b]["interfaces"][port_b]
+        for i, j in ((int_a, int_b), (int_b, int_a)):
+            i["connected_endpoint_type"] = "dcim.interface"
+            i["connected_endpoint"] = {"id": j["id"], "device": j["device"]}
+
+    for d in range(devices_count):
+        connect(d, 1, (d + 1) % devices_count, 2)
+        connect(d, 3, (d + devices_count // 2) % devices_count, 4)
+
+    return platforms, sites, devices
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default="500,1000,2000,4000",
+    show_default=True,
+    help="comma separated numbers of devices",
+)
+def bench_topology(sizes):
+    logzero.loglevel(logzero.ERROR)
+    previous = None
+    click.echo(f"{'devices':>8} {'links':>8} {'seconds':>9} {'us/device':>10} {'ratio':>6}")
+    for size in [int(s) for s in sizes.split(",")]:
+        platforms, sites, devices = synthetic_topology(size)
+        c = Converter(None, "http://gns3.example.com:3080/v2", "bench")
+        c.platforms, c.sites = platforms, sites
+
+        start = time.perf_counter()
+        c.build_target(devices)
+        elapsed = time.perf_counter() - start
+
+        per_device = elapsed / size
+        ratio = f"{per_device / previous:.2f}" if previous else "-"
+        previous = per_device
+        links = len(c.server.projects[0].links)
+        click.echo(
+            f"{size:>8} {links:>8} {elapsed:>9.3f} {per_device * 1e6:>10.1f} {ratio:>6}"
+        )
+
+
+if __name__ == "__main__":
+    bench_topology()
@@ -0,0 +1,398 @@
+#! /usr/bin/env python
+
+import json
+import multiprocessing
+import requests
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+def synthetic_netbox(
+    devices_count, links_count, platforms_count=3, sites_count=2, interfaces_count=8
+):
+    """Returns NetBox API objects by endpoint name for a synthetic topology."""
+    # links are laid out in rounds, each round uses 2 more ports on every device
+    rounds = -(-links_count // devices_count) if devices_count else 0
+    if 2 * rounds >= interfaces_count or rounds >= devices_count:
+        raise ValueError(
+            f"{links_count} links do not fit on {devices_count} devices "
+            f"with {interfaces_count} interfaces"
+        )
+
+    updated = "2021-12-01T00:00:00Z"
+    platforms = [
+        {
+            "id": p,
+            "name": f"platform-{p}",
+            "last_updated": updated,
+            "custom_fields": {
+                "gns3_template_type": "qemu",
+                "gns3_adapters": interfaces_count,
+                "gns3_ram": 256,
+            },
+        }
+        for p in range(1, platforms_count + 1)
+    ]
+    sites = [
+        {
+            "id": s,
+            "name": f"site-{s}",
+            "last_updated": updated,
+            "custom_fields": {
+                "gns3_x": (s - 1) * 1000,
+                "gns3_y": 0,
+                "gns3_z": 0,
+                "gns3_width": 900,
+                "gns3_height": 900,
+            },
+        }
+        for s in range(1, sites_count + 1)
+    ]
+
+    devices, interfaces = list(), list()
+    for d in range(1, devices_count + 1):
+        name = f"device-{d}"
+        devices.append(
+            {
+                "id": d,
+                "name": name,
+                "last_updated": updated,
+                "platform": {"id": platforms[d % platforms_count]["id"]},
+                "site": {"id": sites[d % sites_count]["id"]},
+                "tags": [{"name": "gns3", "slug": "gns3"}],
+                "custom_fields": {"gns3_x": 10 * d, "gns3_y": 20, "gns3_z": 1},
+            }
+        )
+        for n in range(interfaces_count):
+            interfaces.append(
+                {
+                    "id": d * 1000 + n,
+                    "name": f"eth{n}",
+                    "last_updated": updated,
+                    "device": {"id": d, "name": name},
+                    "type": {"value": "1000base-t"},
+                    "mgmt_only": n == 0,
+                    "mode": None,
+                    "untagged_vlan": None,
+                    "cable": None,
+                    "connected_endpoint_type": None,
+                    "connected_endpoint": None,
+                }
+            )
+
+    interface_by_id = {i["id"]: i for i in interfaces}
+    for n in range(links_count):
+        r = n // devices_count
+        a = n % devices_count + 1
+        b = (a + r) % devices_count + 1
+        int_a = interface_by_id[a * 1000 + 1 + 2 * r]
+        int_b = interface_by_id[b * 1000 + 2 + 2 * r]
+        for i, j in ((int_a, int_b), (int_b, int_a)):
+            i["cable"] = {"id": n + 1}
+            i["connected_endpoint_type"] = "dcim.interface"
+            i["connected_endpoint"] = {"id": j["id"], "device": dict(j["device"])}
+
+    return {
+        "devices": devices,
+        "interfaces": interfaces,
+        "platforms": platforms,
+        "sites": sites,
+        "object-changes": list(),
+    }
+
+
+class FakeServer(ThreadingHTTPServer):
+    """Local HTTP server with a fixed latency added to every request."""
+
+    daemon_threads = True
+
+    def __init__(self, handler, latency=0.0):
+        super(FakeServer, self).__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.request_count = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+def _serve(pipe, server_class, args, kwargs):
+    server = server_class(*args, **kwargs)
+    pipe.send(server.url)
+    server.serve_forever()
+
+
+class FakeServerProcess:
+    """Runs a fake server in a child process, so that its CPU time and memory are
+    not measured with the client's."""
+
+    def __init__(self, server_class, *args, **kwargs):
+        parent, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(child, server_class, args, kwargs), daemon=True
+        )
+        self.process.start()
+        self.url = parent.recv()
+
+    def stats(self):
+        # requests to /_stats are not counted
+        return requests.get(self.url + "/_stats").json()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, Nagle would delay every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, obj, code=200):
+        body = json.dumps(obj).encode() if code != 204 else b""
+        with self.server.lock:
+            self.server.request_count += 1
+            self.server.bytes_sent += len(body)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stats(self):
+        # counters of the server, for clients running in another process
+        if not urlparse(self.path).path.endswith("/_stats"):
+            return False
+        with self.server.lock:
+            stats = {
+                "requests": self.server.request_count,
+                "bytes": self.server.bytes_sent,
+            }
+        body = json.dumps(stats).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+
+class FakeNetBoxServer(FakeServer):
+    """Subset of the NetBox API used by nb2gns3 and reverse_sync, under /api."""
+
+    def __init__(self, data, latency=0.0):
+        super(FakeNetBoxServer, self).__init__(FakeNetBoxHandler, latency)
+        self.data = data
+
+    @property
+    def url(self):
+        return super(FakeNetBoxServer, self).url + "/api"
+
+
+class FakeNetBoxHandler(FakeHandler):
+    BRIEF_FIELDS = ("id", "name", "cable", "device")
+
+    def do_GET(self):
+        if self.send_stats():
+            return
+        o = urlparse(self.path)
+        query = parse_qs(o.query)
+        # /api/<app>/<endpoint>/[<id>/]
+        parts = [p for p in o.path.split("/") if p][2:]
+        objects = self.server.data.get(parts[0]) if parts else None
+        if objects is None:
+            return self.send_json({"detail": "Not found."}, 404)
+        if len(parts) > 1:
+            found = [x for x in objects if x["id"] == int(parts[1])]
+            if not found:
+                return self.send_json({"detail": "Not found."}, 404)
+            return self.send_json(found[0])
+
+        if "id" in query:
+            ids = set(int(i) for i in query["id"])
+            objects = [x for x in objects if x["id"] in ids]
+        if "id__gt" in query:
+            objects = [x for x in objects if x["id"] > int(query["id__gt"][0])]
+        if "device_id" in query:
+            ids = set(int(i) for i in query["device_id"])
+            objects = [x for x in objects if x["device"]["id"] in ids]
+        if "tag" in query:
+            slugs = set(query["tag"])
+            objects = [
+                x for x in objects if slugs & set(t["slug"] for t in x.get("tags", []))
+            ]
+        if "last_updated__gte" in query:
+            since = query["last_updated__gte"][0].replace("+00:00", "Z")[:19]
+            objects = [x for x in objects if x["last_updated"] >= since]
+        if query.get("brief"):
+            objects = [
+                {k: v for k, v in x.items() if k in self.BRIEF_FIELDS} for x in objects
+            ]
+
+        limit = int(query.get("limit", ["50"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+        page = objects[offset:] if limit == 0 else objects[offset : offset + limit]
+        next_url = None
+        if limit and offset + limit < len(objects):
+            next_query = urlencode(
+                {**query, "limit": [limit], "offset": [offset + limit]}, doseq=True
+            )
+            next_url = f"http://{self.headers['Host']}{o.path}?{next_query}"
+        self.send_json(
+            {"count": len(objects), "next": next_url, "previous": None, "results": page}
+        )
+
+    def do_PATCH(self):
+        # bulk update, custom fields are merged as NetBox does
+        body = self.read_json()
+        parts = [p for p in urlparse(self.path).path.split("/") if p][2:]
+        objects = self.server.data.get(parts[0]) if len(parts) == 1 else None
+        if objects is None or not isinstance(body, list):
+            return self.send_json({"detail": "Not found."}, 404)
+        by_id = {x["id"]: x for x in objects}
+        if any(o.get("id") not in by_id for o in body):
+            return self.send_json({"detail": "Object not found."}, 400)
+        updated = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        with self.server.lock:
+            for o in body:
+                x = by_id[o["id"]]
+                for k, v in o.items():
+                    if k == "custom_fields":
+                        x["custom_fields"].update(v)
+                    elif k != "id":
+                        x[k] = v
+                x["last_updated"] = updated
+        self.send_json([by_id[o["id"]] for o in body])
+
+
+class FakeGNS3Server(FakeServer):
+    """In-memory subset of the GNS3 v2 API used by gns3_client, under /v2."""
+
+    def __init__(self, latency=0.0):
+        super(FakeGNS3Server, self).__init__(FakeGNS3Handler, latency)
+        self.templates = dict()
+        self.projects = dict()
+        # drawings, nodes and links of each project, by project id
+        self.project_objects = dict()
+        self.state_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return super(FakeGNS3Server, self).url + "/v2"
+
+
+class FakeGNS3Handler(FakeHandler):
+    PROJECT_COLLECTIONS = ("drawings", "nodes", "links")
+
+    def do_GET(self):
+        if not self.send_stats():
+            self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_PUT(self):
+        self.route("PUT")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+    def route(self, method):
+        body = self.read_json() if method in ("POST", "PUT") else None
+        parts = [p for p in urlparse(self.path).path.split("/") if p][1:]
+        with self.server.state_lock:
+            response = self.dispatch(method, parts, body)
+        if response is None:
+            return self.send_json({"message": "Not found"}, 404)
+        self.send_json(*response)
+
+    def dispatch(self, method, parts, body):
+        server = self.server
+        if parts == ["version"]:
+            return {"version": "2.2.0", "local": True}, 200
+        if parts[:1] == ["templates"]:
+            return self.collection(
+                method, server.templates, parts[1:], body, "template"
+            )
+        if parts[:1] != ["projects"]:
+            return None
+        if len(parts) <= 2:
+            return self.collection(method, server.projects, parts[1:], body, "project")
+
+        project = server.project_objects.get(parts[1])
+        if project is None:
+            return None
+        if parts[2] == "templates" and method == "POST":
+            # node created from a template
+            template = server.templates.get(parts[3])
+            if template is None:
+                return None
+            node = {
+                "node_id": str(uuid.uuid4()),
+                "project_id": parts[1],
+                "template_id": parts[3],
+                "node_type": template.get("template_type"),
+                "compute_id": "local",
+                "console": 5000 + len(project["nodes"]),
+                "console_host": "127.0.0.1",
+                "console_type": template.get("console_type", "telnet"),
+                "status": "stopped",
+            }
+            node.update(body)
+            project["nodes"][node["node_id"]] = node
+            return node, 201
+        if parts[2] == "nodes" and len(parts) == 5:
+            node = project["nodes"].get(parts[3])
+            if node is None:
+                return None
+            node["status"] = "started" if parts[4] == "start" else "stopped"
+            return node, 200
+        if parts[2] in self.PROJECT_COLLECTIONS:
+            collection = project[parts[2]]
+            kind = parts[2][:-1]
+            return self.collection(
+                method, collection, parts[3:], body, kind, project_id=parts[1]
+            )
+        return None
+
+    def collection(self, method, objects, rest, body, kind, project_id=None):
+        id_field = kind + "_id"
+        if method == "GET":
+            if not rest:
+                return list(objects.values()), 200
+            return (objects[rest[0]], 200) if rest[0] in objects else None
+        if method == "POST" and not rest:
+            o = dict(body, **{id_field: str(uuid.uuid4())})
+            if project_id:
+                o["project_id"] = project_id
+            if kind == "project":
+                o["status"] = "opened"
+                self.server.project_objects[o[id_field]] = {
+                    c: dict() for c in self.PROJECT_COLLECTIONS
+                }
+            objects[o[id_field]] = o
+            return o, 201
+        if not rest or rest[0] not in objects:
+            return None
+        if method == "PUT":
+            objects[rest[0]].update(body)
+            return objects[rest[0]], 200
+        if method == "DELETE":
+            del objects[rest[0]]
+            self.server.project_objects.pop(rest[0], None)
+            return dict(), 204
+        return None
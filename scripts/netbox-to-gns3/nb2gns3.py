@@ -3,73 +3,964 @@
 import click
 import os
 import logzero
-import gns3_client
 from logzero import logger
-import requests_cache
+import copy
+import functools
+import gzip
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from threading import Lock, local
 from xml.etree import ElementTree
-from pprint import pprint
-from urllib.parse import urlparse
-from urllib3 import disable_warnings
+from pprint import pformat
+from urllib.parse import parse_qs, urlparse
 
-disable_warnings()
 
+# devices to sync to GNS3
+DEVICE_TAG = "gns3"
+DEVICE_QUERY = f"/dcim/devices/?limit=0&q=&tag={DEVICE_TAG}"
 
-class NetBoxSession(requests_cache.CachedSession):
-    def __init__(
-        self, base_url=None, netbox_token=None, netbox_private_key=None, *args, **kwargs
-    ):
-        super(NetBoxSession, self).__init__(*args, **kwargs)  # noqa
-        self.headers.update({"Authorization": "Token " + str(netbox_token)})
-        self.verify = False
-        self.base_url = base_url
-        self.cache.clear()
-        if netbox_private_key:
-            r = self.post(
-                "/secrets/get-session-key/", data={"private_key": netbox_private_key}
+
+class NetBoxObjectCache:
+    """Persistent store of NetBox objects, revalidated on every run.
+
+    Each object is stored with its brief representation and the NetBox server
+    time at which it was fetched. A cached object is reused only if its brief
+    representation is unchanged (this catches cable changes on interfaces) and
+    NetBox reports no update since it was fetched.
+    """
+
+    FILENAME = "netbox-objects.sqlite"
+    # margin applied to fetch times to catch changes committed while fetching
+    MARGIN = timedelta(seconds=60)
+
+    def __init__(self, cache_dir, max_age=7 * 24 * 3600, max_entries=100000):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._db = sqlite3.connect(
+            os.path.join(cache_dir, self.FILENAME), check_same_thread=False
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "endpoint TEXT, id INTEGER, fetched TEXT, brief TEXT, data TEXT, "
+            "stored REAL, accessed REAL, PRIMARY KEY (endpoint, id))"
+        )
+
+    def lookup(self, endpoint, briefs):
+        # returns {id: (fetch time, object)} for objects whose brief is unchanged
+        now = time.time()
+        result = dict()
+        with self._lock:
+            for brief in briefs:
+                row = self._db.execute(
+                    "SELECT fetched, brief, data, stored FROM objects "
+                    "WHERE endpoint = ? AND id = ?",
+                    (endpoint, brief["id"]),
+                ).fetchone()
+                if row and row[1] == self._dump(brief) and now - row[3] < self.max_age:
+                    result[brief["id"]] = datetime.fromisoformat(row[0]), row[2]
+        return result
+
+    def get(self, endpoint, cached, changed_ids):
+        now = time.time()
+        result = {i: json.loads(o) for i, (_, o) in cached.items() if i not in changed_ids}
+        with self._lock:
+            self._db.executemany(
+                "UPDATE objects SET accessed = ? WHERE endpoint = ? AND id = ?",
+                [(now, endpoint, i) for i in result],
             )
-            j = r.json()
-            self.headers.update({"X-Session-Key": j["session_key"]})
-
-    def _get_url(self, url):
-        o = urlparse(self.base_url)
-        path = o.path + "/" + url
-        while "//" in path:
-            path = path.replace("//", "/")
-        o = o._replace(path=path)  # noqa
-        return o.geturl()
-
-    def request(self, method, url, prepend_base_url=True, *args, **kwargs):
-        if prepend_base_url:
-            url = self._get_url(url)
-        logger.debug(f"Request sent: {method} {url}")
-        r = super(NetBoxSession, self).request(method, url, *args, **kwargs)
-        logger.debug(f"Request status: {r.status_code} {r.reason}")
-        return r
+        return result
+
+    def put(self, endpoint, objects, briefs, fetched):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        endpoint,
+                        o["id"],
+                        fetched.isoformat(),
+                        self._dump(briefs[o["id"]]),
+                        json.dumps(o),
+                        now,
+                        now,
+                    )
+                    for o in objects
+                    if o["id"] in briefs
+                ],
+            )
+
+    def count(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def close(self):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM objects WHERE stored < ?", (time.time() - self.max_age,)
+            )
+            self._db.execute(
+                "DELETE FROM objects WHERE rowid NOT IN "
+                "(SELECT rowid FROM objects ORDER BY accessed DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+            self._db.close()
+
+    @staticmethod
+    def _dump(o):
+        return json.dumps(o, sort_keys=True)
+
+
+class NetBoxDump:
+    """Read-only NetBox source backed by a pg_dump of the NetBox database.
+
+    The COPY blocks of the dump are streamed and only the tables and columns needed
+    to build the target are kept. Objects are returned in the shape of the NetBox
+    API, so that the dump can be used in place of a NetBoxSession.
+    """
+
+    # table: columns kept from the dump
+    TABLES = {
+        "django_content_type": ("id", "app_label", "model"),
+        "extras_customfield": ("id", "name"),
+        "extras_customfield_content_types": ("customfield_id", "contenttype_id"),
+        "extras_tag": ("id", "name", "slug"),
+        "extras_taggeditem": ("object_id", "content_type_id", "tag_id"),
+        "dcim_platform": ("id", "name", "slug", "custom_field_data"),
+        "dcim_site": ("id", "name", "_name", "slug", "custom_field_data"),
+        "dcim_device": (
+            "id",
+            "name",
+            "_name",
+            "platform_id",
+            "site_id",
+            "custom_field_data",
+        ),
+        "dcim_interface": (
+            "id",
+            "name",
+            "_name",
+            "device_id",
+            "type",
+            "mgmt_only",
+            "mode",
+            "untagged_vlan_id",
+            "cable_id",
+            "_path_id",
+        ),
+        "dcim_cablepath": ("id", "destination_type_id", "destination_id"),
+        "ipam_vlan": ("id", "vid", "name"),
+    }
+    COPY_RE = re.compile(r'^COPY (?:"?\w+"?\.)?"?(\w+)"? \((.*)\) FROM stdin;$')
+    ESCAPE_RE = re.compile(r"\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))")
+    ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+
+    def __init__(self, path):
+        self.path = path
+        self.object_cache = None
+        self.request_count = 0
+
+        logger.info(f"Read NetBox dump {path} ...")
+        rows = self.read_tables(path, self.TABLES)
+        content_types = {
+            r["id"]: f'{r["app_label"]}.{r["model"]}'
+            for r in rows["django_content_type"]
+        }
+        # custom fields are returned for every object of their content types, set
+        # or not, as the API does
+        field_names = {r["id"]: r["name"] for r in rows["extras_customfield"]}
+        fields = defaultdict(list)
+        for r in rows["extras_customfield_content_types"]:
+            fields[content_types[r["contenttype_id"]]].append(
+                field_names[r["customfield_id"]]
+            )
+        tag_by_id = {r["id"]: r for r in rows["extras_tag"]}
+        tags = defaultdict(list)
+        for r in rows["extras_taggeditem"]:
+            if content_types[r["content_type_id"]] == "dcim.device":
+                tag = tag_by_id[r["tag_id"]]
+                tags[r["object_id"]].append({"name": tag["name"], "slug": tag["slug"]})
+
+        def custom_fields(content_type, r):
+            data = json.loads(r["custom_field_data"] or "{}")
+            return {name: data.get(name) for name in sorted(fields[content_type])}
+
+        # NetBox orders platforms by name, sites and devices by natural name and
+        # interfaces by device then natural name
+        platforms = sorted(rows["dcim_platform"], key=lambda r: r["name"])
+        self.platforms = [
+            {
+                "id": r["id"],
+                "name": r["name"],
+                "slug": r["slug"],
+                "custom_fields": custom_fields("dcim.platform", r),
+            }
+            for r in platforms
+        ]
+        sites = sorted(rows["dcim_site"], key=lambda r: (r["_name"], r["id"]))
+        self.sites = [
+            {
+                "id": r["id"],
+                "name": r["name"],
+                "slug": r["slug"],
+                "custom_fields": custom_fields("dcim.site", r),
+            }
+            for r in sites
+        ]
+        nested_platforms = {p["id"]: p for p in self.platforms}
+        nested_sites = {s["id"]: s for s in self.sites}
+
+        def nested(objects, oid):
+            if oid is None:
+                return None
+            o = objects[oid]
+            return {"id": o["id"], "name": o["name"], "slug": o["slug"]}
+
+        devices = sorted(rows["dcim_device"], key=lambda r: (r["_name"], r["id"]))
+        self.devices = [
+            {
+                "id": r["id"],
+                "name": r["name"],
+                "platform": nested(nested_platforms, r["platform_id"]),
+                "site": nested(nested_sites, r["site_id"]),
+                "tags": tags[r["id"]],
+                "custom_fields": custom_fields("dcim.device", r),
+            }
+            for r in devices
+        ]
+
+        # the connected endpoint is the far end of the cable path, as in the API
+        device_names = {d["id"]: d["name"] for d in self.devices}
+        paths = {r["id"]: r for r in rows["dcim_cablepath"]}
+        vlans = {r["id"]: r for r in rows["ipam_vlan"]}
+        interfaces = sorted(
+            rows["dcim_interface"], key=lambda r: (r["device_id"], r["_name"], r["id"])
+        )
+        interface_by_id = {r["id"]: r for r in interfaces}
+        self.interfaces = list()
+        for r in interfaces:
+            device = {"id": r["device_id"], "name": device_names.get(r["device_id"])}
+            endpoint_type, endpoint = None, None
+            path = paths.get(r["_path_id"])
+            if path and path["destination_id"] is not None:
+                endpoint_type = content_types[path["destination_type_id"]]
+                endpoint = {"id": path["destination_id"]}
+                peer = interface_by_id.get(path["destination_id"])
+                if endpoint_type == "dcim.interface" and peer:
+                    endpoint["name"] = peer["name"]
+                    endpoint["device"] = {
+                        "id": peer["device_id"],
+                        "name": device_names.get(peer["device_id"]),
+                    }
+            vlan = vlans.get(r["untagged_vlan_id"])
+            self.interfaces.append(
+                {
+                    "id": r["id"],
+                    "name": r["name"],
+                    "device": device,
+                    "type": {"value": r["type"]},
+                    "mgmt_only": r["mgmt_only"] == "t",
+                    "mode": {"value": r["mode"]} if r["mode"] else None,
+                    "untagged_vlan": (
+                        {"id": vlan["id"], "vid": vlan["vid"], "name": vlan["name"]}
+                        if vlan
+                        else None
+                    ),
+                    "cable": {"id": r["cable_id"]} if r["cable_id"] else None,
+                    "connected_endpoint_type": endpoint_type,
+                    "connected_endpoint": endpoint,
+                }
+            )
+        logger.info(
+            f"{len(self.devices)} devices, {len(self.interfaces)} interfaces, "
+            f"{len(self.platforms)} platforms and {len(self.sites)} sites in dump"
+        )
+
+    @classmethod
+    def read_tables(cls, path, tables):
+        # streams the dump and returns {table: [row]} for the given tables, each row
+        # being a dict of the wanted columns
+        rows = {table: list() for table in tables}
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            columns = None
+            for line in f:
+                if columns is not None:
+                    if line == "\\.\n":
+                        columns = None
+                        continue
+                    values = line.rstrip("\n").split("\t")
+                    row = {c: cls.decode(values[n]) for c, n in columns}
+                    # ids are compared to API ids, so they are converted
+                    for c in integers:
+                        if row[c] is not None:
+                            row[c] = int(row[c])
+                    rows[table].append(row)
+                    continue
+                m = cls.COPY_RE.match(line.rstrip("\n"))
+                if m and m.group(1) in tables:
+                    table = m.group(1)
+                    names = [c.strip().strip('"') for c in m.group(2).split(",")]
+                    columns = [(c, names.index(c)) for c in tables[table]]
+                    integers = [
+                        c
+                        for c in tables[table]
+                        if c in ("id", "vid") or c.endswith("_id")
+                    ]
+        return rows
+
+    @classmethod
+    def decode(cls, value):
+        # PostgreSQL COPY text format
+        if value == "\\N":
+            return None
+        if "\\" in value:
+            return cls.ESCAPE_RE.sub(cls._unescape, value)
+        return value
+
+    @classmethod
+    def _unescape(cls, m):
+        if m.group(1):
+            return chr(int(m.group(1), 8))
+        if m.group(2):
+            return chr(int(m.group(2), 16))
+        return cls.ESCAPES.get(m.group(3), m.group(3))
+
+    def get_results(self, url, cached=True, fields=None):
+        from netbox_session import NetBoxSession
+
+        o = urlparse(url)
+        endpoint = "/" + o.path.strip("/") + "/"
+        query = parse_qs(o.query)
+        if endpoint == "/dcim/devices/":
+            devices = self.devices
+            if "tag" in query:
+                slugs = set(query["tag"])
+                devices = [
+                    d for d in devices if slugs & set(t["slug"] for t in d["tags"])
+                ]
+            if "id" in query:
+                ids = set(int(i) for i in query["id"])
+                devices = [d for d in devices if d["id"] in ids]
+            return [NetBoxSession.trim(d, fields) for d in copy.deepcopy(devices)]
+        # the change log is not read from dumps, incremental syncs fall back to
+        # full ones
+        if endpoint == "/extras/object-changes/":
+            return list()
+        raise ValueError(f"{endpoint} not available from a NetBox dump")
+
+    def get_objects(self, *queries, fields=None):
+        from netbox_session import NetBoxSession
+
+        fields = fields or dict()
+        objects = {
+            "/dcim/platforms/": self.platforms,
+            "/dcim/sites/": self.sites,
+            "/dcim/interfaces/": self.interfaces,
+        }
+        results = list()
+        for endpoint, ids, key in queries:
+            ids = set(ids)
+            if key == "device_id":
+                found = [o for o in objects[endpoint] if o["device"]["id"] in ids]
+            else:
+                found = [o for o in objects[endpoint] if o[key] in ids]
+            found = copy.deepcopy(found)
+            results.append([NetBoxSession.trim(o, fields.get(endpoint)) for o in found])
+        return results
+
+
+class SyncState:
+    """Per-target state kept between runs, e.g. the NetBox change log watermark."""
+
+    def __init__(self, state_dir, *key):
+        name = hashlib.sha1("|".join(key).encode()).hexdigest()[:12]
+        self.path = os.path.join(state_dir, f"state-{name}.json")
+        self.data = dict()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.data = json.load(f)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def save(self, **kwargs):
+        self.data.update(kwargs)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+class Metrics:
+    """Phase durations and per-endpoint request metrics of a run."""
+
+    # request latency histogram buckets, in seconds
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    # numeric NetBox ids and GNS3 uuids
+    ID_RE = re.compile(r"^(\d+|[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12})$")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = dict()
+        self.requests = dict()
+        self._lock = Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                phase = self.phases.setdefault(name, {"count": 0, "seconds": 0.0})
+                phase["count"] += 1
+                phase["seconds"] += elapsed
+
+    def observe(self, service, response):
+        # object ids are replaced in paths, so that requests are grouped by endpoint
+        path = "/".join(
+            "{id}" if self.ID_RE.match(p) else p
+            for p in urlparse(response.url).path.split("/")
+        )
+        body = response.request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        seconds = response.elapsed.total_seconds()
+
+        key = (service, response.request.method, path)
+        with self._lock:
+            r = self.requests.get(key)
+            if r is None:
+                r = self.requests[key] = {
+                    "count": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "buckets": [0] * len(self.BUCKETS),
+                }
+            r["count"] += 1
+            r["errors"] += response.status_code >= 400
+            r["seconds"] += seconds
+            r["bytes_sent"] += len(body)
+            r["bytes_received"] += len(response.content)
+            for n, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    r["buckets"][n] += 1
+                    break
+
+    def response_hook(self, service):
+        def hook(response, *args, **kwargs):
+            # requests_cache dispatches the response hooks a second time
+            if getattr(response, "from_cache", False) or hasattr(response, "observed"):
+                return response
+            response.observed = True
+            self.observe(service, response)
+            return response
+
+        return hook
+
+    def to_dict(self):
+        with self._lock:
+            requests = list()
+            for (service, method, endpoint), r in sorted(self.requests.items()):
+                # cumulative buckets, as in Prometheus histograms
+                buckets, total = dict(), 0
+                for bound, count in zip(self.BUCKETS, r["buckets"]):
+                    total += count
+                    buckets[str(bound)] = total
+                buckets["+Inf"] = r["count"]
+                requests.append(
+                    {
+                        "service": service,
+                        "method": method,
+                        "endpoint": endpoint,
+                        **{k: v for k, v in r.items() if k != "buckets"},
+                        "buckets": buckets,
+                    }
+                )
+            return {
+                "duration_seconds": time.perf_counter() - self.started,
+                "phases": copy.deepcopy(self.phases),
+                "requests": requests,
+            }
+
+    def to_prometheus(self):
+        data = self.to_dict()
+        lines = [
+            "# HELP nb2gns3_duration_seconds Duration of the run.",
+            "# TYPE nb2gns3_duration_seconds gauge",
+            f"nb2gns3_duration_seconds {data['duration_seconds']}",
+            "# HELP nb2gns3_phase_duration_seconds Duration of each phase of the run.",
+            "# TYPE nb2gns3_phase_duration_seconds gauge",
+        ]
+        for name, phase in sorted(data["phases"].items()):
+            lines.append(
+                f'nb2gns3_phase_duration_seconds{{phase="{name}"}} {phase["seconds"]}'
+            )
+
+        def labels(r, **extra):
+            items = [(k, r[k]) for k in ("service", "method", "endpoint")]
+            items += list(extra.items())
+            return ",".join(f'{k}="{v}"' for k, v in items)
+
+        counters = (
+            ("errors", "nb2gns3_request_errors_total", "Requests with errors."),
+            ("bytes_sent", "nb2gns3_request_bytes_total", "Bytes sent in requests."),
+            ("bytes_received", "nb2gns3_response_bytes_total", "Bytes received."),
+        )
+        for key, metric, description in counters:
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+            lines += [f"{metric}{{{labels(r)}}} {r[key]}" for r in data["requests"]]
+
+        metric = "nb2gns3_request_duration_seconds"
+        lines += [
+            f"# HELP {metric} Latency of the requests to NetBox and GNS3.",
+            f"# TYPE {metric} histogram",
+        ]
+        for r in data["requests"]:
+            for bound, count in r["buckets"].items():
+                lines.append(f"{metric}_bucket{{{labels(r, le=bound)}}} {count}")
+            lines.append(f"{metric}_sum{{{labels(r)}}} {r['seconds']}")
+            lines.append(f"{metric}_count{{{labels(r)}}} {r['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, metrics_format="json"):
+        with open(path, "w") as f:
+            if metrics_format == "prometheus":
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+
+
+def phase(name):
+    # records the duration of a Converter method in the converter metrics
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.phase(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class ServerCache:
+    """HTTP cache of a GNS3 server shared by parallel plan operations.
+
+    gns3_client clears the cache after every write. While deferred, these clears
+    only mark the cache stale and the plan executor flushes it when needed. Clears
+    are serialized with lookups, and a response read before a clear is not saved
+    after it, so that a worker does not cache a listing made stale meanwhile.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._lock = Lock()
+        self._generation = 0
+        # generation of the last lookup of each worker
+        self._local = local()
+        self._stale = False
+        self.deferred = False
+
+    def get_response(self, key, default=None):
+        with self._lock:
+            self._local.generation = self._generation
+            return self._cache.get_response(key, default)
+
+    def save_response(self, response, cache_key=None, expires=None):
+        with self._lock:
+            if getattr(self._local, "generation", None) == self._generation:
+                self._cache.save_response(response, cache_key, expires)
+
+    def clear(self):
+        with self._lock:
+            self._stale = True
+            if not self.deferred:
+                self._clear()
+
+    def flush(self):
+        with self._lock:
+            if self._stale:
+                self._clear()
+
+    def _clear(self):
+        self._stale = False
+        self._generation += 1
+        self._cache.clear()
+
+    def __getattr__(self, name):
+        return getattr(self._cache, name)
+
+
+def gns3_server(url, metrics):
+    # GNS3 client whose requests are counted in metrics
+    import gns3_client
+    import requests_cache
+
+    server = gns3_client.Server(base_url=url)
+    # the default SQLite cache file is shared by all the servers of the process,
+    # whose clears drop its tables under the others, e.g. in sharded syncs
+    server.cache = ServerCache(requests_cache.backends.BaseCache())
+    server.hooks["response"].append(metrics.response_hook("gns3"))
+    return server
+
+
+class PlanOperation:
+    def __init__(self, action, obj):
+        import gns3_client
+
+        self.action = action
+        self.obj = obj
+        self.dependencies = set()
+        self.status = "pending"
+        self.started = None
+        self.duration = None
+        self.error = None
+        self.object_type = obj.__class__.__name__
+        # named before running, gns3_client rewrites link ends when sending them
+        if isinstance(obj, gns3_client.Link):
+            ends = obj.metadata.nodes or []
+            self.name = " - ".join(str(e["node"].metadata.name) for e in ends)
+        else:
+            self.name = str(obj.metadata.name)
+
+    def run(self):
+        self.started = time.perf_counter()
+        try:
+            getattr(self.obj, self.action)()
+            self.status = "done"
+        except Exception as e:
+            self.status = "failed"
+            self.error = e
+        self.duration = time.perf_counter() - self.started
+        return self
+
+
+class PlanExecutor:
+    """Applies plan operations in dependency order, independent operations are
+    run in parallel. No new operation is started after a failure.
+
+    The HTTP cache of the server is only cleared before starting an operation
+    once a write other than a link one finished: links are the only operations
+    reading the server (the nodes of their project), and their own writes do
+    not change it. Operations of a wave of links thus share one node listing.
+    """
+
+    def __init__(self, operations, concurrency=1, cache=None):
+        self.operations = operations
+        self.concurrency = max(1, concurrency)
+        self.cache = cache
+        self.started = None
+
+    def run(self):
+        import gns3_client
+
+        self.started = time.perf_counter()
+        pending = list(self.operations)
+        running = set()
+        failed = False
+        stale = False
+        if self.cache:
+            self.cache.deferred = True
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while pending or running:
+                if not failed:
+                    for op in [o for o in pending if self._ready(o)]:
+                        if len(running) >= self.concurrency:
+                            break
+                        if stale and self.cache:
+                            self.cache.flush()
+                            stale = False
+                        pending.remove(op)
+                        op.status = "running"
+                        running.add(executor.submit(op.run))
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    op = future.result()
+                    stale = stale or not isinstance(op.obj, gns3_client.Link)
+                    if op.status == "failed":
+                        logger.error(
+                            f"{op.action} {op.object_type} {op.name} failed: {op.error}"
+                        )
+                        failed = True
+        for op in pending:
+            op.status = "skipped"
+        if self.cache:
+            self.cache.deferred = False
+            self.cache.flush()
+        return not failed
+
+    @staticmethod
+    def _ready(op):
+        return all(d.status == "done" for d in op.dependencies)
+
+    def report(self):
+        # operations in the order they finished, with their start offset, then the
+        # ones which did not run
+        ran = sorted(
+            (op for op in self.operations if op.duration is not None),
+            key=lambda op: op.started + op.duration,
+        )
+        lines = list()
+        for op in ran + [op for op in self.operations if op.duration is None]:
+            start, duration = "-", "-"
+            if op.duration is not None:
+                start = f"+{op.started - self.started:.3f}s"
+                duration = f"{op.duration:.3f}s"
+            lines.append(
+                f"{op.status:<8} {op.action:<7} {op.object_type:<9} {start:>9} "
+                f"{duration:>8}  {op.name}"
+            )
+        return "\n".join(lines)
+
+
+class TopologyIndex:
+    """Lookup tables over the target topology, built once per run."""
+
+    def __init__(self, devices):
+        self.interfaces = {i["id"]: i for d in devices for i in d["interfaces"]}
+        self.physical_interfaces = {
+            d["id"]: Converter.device_get_physical_interfaces(d) for d in devices
+        }
+        # physical port number of each interface on its device
+        self.port_numbers = {
+            i["id"]: n
+            for interfaces in self.physical_interfaces.values()
+            for n, i in enumerate(interfaces)
+        }
+        # GNS3 nodes by device name, filled in as nodes are built
+        self.nodes = dict()
 
 
 class Converter:
+    # beyond this share of changed devices, a full sync is cheaper than a partial one
+    MAX_INCREMENTAL_RATIO = 0.5
+    PLAN_VERSION = 1
+    # NetBox fields used to build the target, the other ones are dropped as objects
+    # are read
+    NETBOX_FIELDS = {
+        "/dcim/devices/": ("id", "name", "platform", "site", "tags", "custom_fields"),
+        "/dcim/interfaces/": (
+            "id",
+            "name",
+            "device",
+            "type",
+            "mgmt_only",
+            "mode",
+            "untagged_vlan",
+            "connected_endpoint_type",
+            "connected_endpoint",
+        ),
+    }
+
     def __init__(
-        self, netbox_session: NetBoxSession, gns3_server_url: str, project_name: str
+        self,
+        netbox_session: "NetBoxSession",
+        gns3_server_url: str,
+        project_name: str,
+        metrics: Metrics = None,
     ) -> None:
         self.nb = netbox_session
         self.gns3_server_url = gns3_server_url
         self.name = project_name
         self.server = None
         self.plan = None
+        self.report = None
+        self.platforms = dict()
+        self.sites = dict()
+        self.interfaces = dict()
+        # names of the devices to diff in an incremental sync, None for a full sync
+        self.scope = None
+        # projects of the other shards on the same server, not deleted by the plan
+        self.kept_projects = set()
+        self.metrics = metrics or Metrics()
 
-    def compute_target(self, query):
-        devices = self.nb.request("GET", query).json()["results"]
+    def new_server(self):
+        return gns3_server(self.gns3_server_url, self.metrics)
+
+    def load(self, devices, interface_devices=None):
+        # platforms and sites are loaded for all devices, interfaces only for
+        # interface_devices (all devices if not specified)
+        if interface_devices is None:
+            interface_devices = devices
+
+        logger.info(f"Load platforms, sites and interfaces ...")
+        pids = set(d["platform"]["id"] for d in devices if d["platform"])
+        sids = set(d["site"]["id"] for d in devices if d["site"])
+        dids = set(d["id"] for d in interface_devices)
+
+        platforms, sites, interfaces = self.nb.get_objects(
+            ("/dcim/platforms/", pids - self.platforms.keys(), "id"),
+            ("/dcim/sites/", sids - self.sites.keys(), "id"),
+            ("/dcim/interfaces/", dids, "device_id"),
+            fields=self.NETBOX_FIELDS,
+        )
+        self.platforms.update({p["id"]: p for p in platforms})
+        self.sites.update({s["id"]: s for s in sites})
+        self.interfaces.update({i["id"]: i for i in interfaces})
+
+        # NetBox orders interfaces by device then name, so each device keeps the
+        # same interface order as a per-device query
+        device_interfaces = defaultdict(list)
+        for i in interfaces:
+            device_interfaces[i["device"]["id"]].append(i)
+
+        for device in interface_devices:
+            device["interfaces"] = device_interfaces[device["id"]]
+        for device in devices:
+            if device["platform"]:
+                device["platform"] = self.platforms[device["platform"]["id"]]
+
+    def latest_change_id(self):
+        changes = self.nb.get_results("/extras/object-changes/?limit=1", cached=False)
+        return changes[0]["id"] if changes else None
+
+    def changed_devices(self, change_id, devices):
+        """Returns the ids and names of the devices affected by the NetBox changes
+        logged after change_id, or None if a full sync is required."""
+        if change_id is None:
+            logger.info(f"No change log watermark, full sync required")
+            return None
+
+        url = f"/extras/object-changes/?limit=1&id={change_id}"
+        if not self.nb.get_results(url, cached=False):
+            logger.info(f"Change log truncated after {change_id}, full sync required")
+            return None
+
+        changes = self.nb.get_results(
+            f"/extras/object-changes/?limit=0&id__gt={change_id}", cached=False
+        )
+        logger.info(f"{len(changes)} NetBox changes since change {change_id} ...")
+
+        device_ids, names, interface_ids = set(), set(), set()
+        for change in changes:
+            object_type = change["changed_object_type"]
+            object_id = change["changed_object_id"]
+            data = [
+                d
+                for d in (change.get("prechange_data"), change.get("postchange_data"))
+                if d
+            ]
+            if object_type == "dcim.device":
+                device_ids.add(object_id)
+                names.update(d["name"] for d in data if d.get("name"))
+            elif object_type == "dcim.interface":
+                device_ids.update(d["device"] for d in data if d.get("device"))
+            elif object_type == "dcim.cable":
+                for d in data:
+                    interface_ids.update(
+                        d.get(k) for k in ("termination_a_id", "termination_b_id")
+                    )
+            elif object_type == "dcim.cabletermination":
+                # NetBox >= 3.3 logs cable ends as separate objects
+                interface_ids.update(
+                    d.get("termination_id")
+                    for d in data
+                    if d.get("termination_type", "dcim.interface") == "dcim.interface"
+                )
+            elif object_type == "dcim.platform":
+                device_ids.update(
+                    d["id"]
+                    for d in devices
+                    if d["platform"] and d["platform"]["id"] == object_id
+                )
+            elif object_type == "dcim.site":
+                device_ids.update(
+                    d["id"]
+                    for d in devices
+                    if d["site"] and d["site"]["id"] == object_id
+                )
+
+        # cable terminations may also be front/rear ports sharing ids with
+        # interfaces, this only widens the set of devices to diff
+        interface_ids.discard(None)
+        if interface_ids:
+            (interfaces,) = self.nb.get_objects(
+                ("/dcim/interfaces/", interface_ids, "id")
+            )
+            device_ids.update(i["device"]["id"] for i in interfaces)
+
+        names.update(d["name"] for d in devices if d["id"] in device_ids)
+        if len(names) > self.MAX_INCREMENTAL_RATIO * max(len(devices), 1):
+            logger.info(f"{len(names)} devices changed, full sync required")
+            return None
+
+        return device_ids, names
+
+    @phase("compute_target")
+    def compute_target(self, query, incremental=False, change_id=None):
+        requests_before = self.nb.request_count
+        devices = self.nb.get_results(
+            query, fields=self.NETBOX_FIELDS["/dcim/devices/"]
+        )
+
+        changed = None
+        if incremental:
+            changed = self.changed_devices(change_id, devices)
+
+        if changed is None:
+            self.scope = None
+            self.load(devices)
+        else:
+            # incremental sync: nodes are built for the changed devices and their
+            # neighbors, the neighbors are only needed as link ends
+            device_ids, self.scope = changed
+            logger.info(f"Incremental sync of {len(self.scope)} devices ...")
+            dids = set(d["id"] for d in devices)
+            changed_devices = [d for d in devices if d["id"] in device_ids]
+            self.load(devices, changed_devices)
+            neighbor_ids = set(
+                i["connected_endpoint"]["device"]["id"]
+                for d in changed_devices
+                for i in d["interfaces"]
+                if i["connected_endpoint_type"] == "dcim.interface"
+            )
+            neighbors = [
+                d for d in devices if d["id"] in (neighbor_ids - device_ids) & dids
+            ]
+            self.load(devices, neighbors)
+            devices = changed_devices + neighbors
+
+        self.build_target(devices)
+
+        requests = self.nb.request_count - requests_before
+        logger.info(f"NetBox requests issued for {len(devices)} devices: {requests}")
+        if self.nb.object_cache:
+            hits, misses = self.nb.object_cache.hits, self.nb.object_cache.misses
+            logger.info(f"NetBox cache: {hits} hits, {misses} misses")
+
+    @phase("build_target")
+    def build_target(self, devices):
+        import gns3_client
 
         # Server
         logger.info(f"Set server {self.gns3_server_url} ...")
-        server = gns3_client.Server(base_url=self.gns3_server_url)
+        server = self.new_server()
         self.server = server
 
         # Templates
-        pids = set(d["platform"]["id"] for d in devices if d["platform"])
-        for pid in pids:
+        for pid, platform in self.platforms.items():
             logger.info(f"Set template for platform id {pid} ...")
-            platform = self.nb.request("GET", "/dcim/platforms/" + str(pid)).json()
             params = self.platform_to_template(platform)
             server.templates.append(gns3_client.Template(server=server, **params))
 
@@ -81,32 +972,24 @@ class Converter:
         server.projects.append(project)
 
         # Drawings
-        sids = set(d["site"]["id"] for d in devices if d["site"])
-        for sid in sids:
+        for sid, site in self.sites.items():
             logger.info(f"Set drawing for site id {sid} ...")
-            site = self.nb.request("GET", "/dcim/sites/" + str(sid)).json()
             params = self.site_to_drawing(site)
             project.drawings.append(gns3_client.Drawing(project=project, **params))
 
         # Nodes
+        index = TopologyIndex(devices)
+        templates = {t.metadata.name: t for t in server.templates}
         for device in devices:
             logger.info(f'Set node for device {device["name"]} ...')
-            device["interfaces"] = self.nb.get(
-                "/dcim/interfaces/?q=&limit=0&device_id=" + str(device["id"])
-            ).json()["results"]
-            device["platform"] = self.nb.request(
-                "GET", "/dcim/platforms/" + str(device["platform"]["id"])
-            ).json()
-            sid = device["site"]["id"]
-            site = self.nb.request("GET", "/dcim/sites/" + str(sid)).json()
-            params = self.device_to_node(device, site)
-            template_name = params.pop("template")
-            template = next(
-                t for t in server.templates if t.metadata.name == template_name
-            )
-            project.nodes.append(
-                gns3_client.Node(project=project, template=template, **params)
+            site = self.sites[device["site"]["id"]]
+            params = self.device_to_node(
+                device, site, index.physical_interfaces[device["id"]]
             )
+            template = templates[params.pop("template")]
+            node = gns3_client.Node(project=project, template=template, **params)
+            project.nodes.append(node)
+            index.nodes[device["name"]] = node
 
         # Links
         logger.info(f"Set links ...")
@@ -120,15 +1003,19 @@ class Converter:
                 if i["connected_endpoint_type"] == "dcim.interface"
                 and i["connected_endpoint"]["device"]["id"] in dids
                 and i["connected_endpoint"]["device"]["id"] >= i["device"]["id"]
+                and (
+                    self.scope is None
+                    or i["device"]["name"] in self.scope
+                    or i["connected_endpoint"]["device"]["name"] in self.scope
+                )
             ]
             connections.update(c)
 
         for c in connections:
-            params = self.connection_to_link(
-                c[0], c[1], devices=devices, project=project
-            )
+            params = self.connection_to_link(c[0], c[1], index)
             project.links.append(gns3_client.Link(project=project, **params))
 
+    @phase("compute_plan")
     def compute_plan(self):
         logger.info(f"Computing plan based on diff ...")
         templates_plan = self.server.templates.diff()
@@ -140,13 +1027,26 @@ class Converter:
         ]
 
         projects_plan = self.server.projects.diff()
+        projects_plan["delete"] = [
+            p
+            for p in projects_plan["delete"]
+            if p.metadata.name not in self.kept_projects
+        ]
         project = next(p for p in self.server.projects if p.metadata.name == self.name)
 
-        drawings_plan, nodes_plan, links_plan = (
-            project.drawings.diff(),
-            project.nodes.diff(),
-            project.links.diff(),
-        )
+        if self.scope is None:
+            nodes_plan, links_plan = project.nodes.diff(), project.links.diff()
+        else:
+            nodes_plan = self.scoped_diff(
+                project.nodes, lambda n: n.metadata.name in self.scope
+            )
+            links_plan = self.scoped_diff(
+                project.links,
+                lambda l: any(
+                    e["node"].metadata.name in self.scope for e in l.metadata.nodes
+                ),
+            )
+        drawings_plan = project.drawings.diff()
 
         self.plan = {
             "delete": templates_plan["delete"]
@@ -166,17 +1066,189 @@ class Converter:
             + links_plan["update"],
         }
 
-    def apply_plan(self):
+    @staticmethod
+    def serialize_object(obj):
+        import gns3_client
+
+        # plain fields only, metadata.dict() would rewrite drawing and link fields
+        metadata = {
+            k: v
+            for k, v in vars(obj.metadata).items()
+            if v is not None and k[0] != "_" and k != "nodes"
+        }
+        entry = {"type": obj.__class__.__name__, "metadata": metadata}
+        if isinstance(obj, gns3_client.Node) and obj.template:
+            entry["template"] = obj.template.metadata.name
+        if isinstance(obj, gns3_client.Link):
+            metadata["nodes"] = [
+                {
+                    "node": {
+                        "name": e["node"].metadata.name,
+                        "node_id": e["node"].metadata.node_id,
+                    },
+                    "adapter_number": e["adapter_number"],
+                    "port_number": e["port_number"],
+                }
+                for e in obj.metadata.nodes or []
+            ]
+        return entry
+
+    def fingerprint(self):
+        # hash of the target model, before it is matched against GNS3 objects
+        project = next(p for p in self.server.projects if p.metadata.name == self.name)
+        target = [
+            sorted(json.dumps(self.serialize_object(o), sort_keys=True) for o in objects)
+            for objects in (
+                self.server.templates,
+                self.server.projects,
+                project.drawings,
+                project.nodes,
+                project.links,
+            )
+        ]
+        data = json.dumps([self.gns3_server_url, self.name, target])
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def save_plan(self, path, **extra):
+        data = {
+            "version": self.PLAN_VERSION,
+            "gns3_server_url": self.gns3_server_url,
+            "project": self.name,
+            **extra,
+            "operations": [
+                {"action": action, **self.serialize_object(obj)}
+                for action in ("delete", "create", "update")
+                for obj in self.plan[action]
+            ],
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        logger.info(f"Plan saved to {path}")
+
+    @classmethod
+    def load_plan(cls, path, metrics=None):
+        import gns3_client
+
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != cls.PLAN_VERSION:
+            raise ValueError(f"{path}: unsupported plan version {data.get('version')}")
+
+        c = cls(None, data["gns3_server_url"], data["project"], metrics)
+        server = c.new_server()
+        c.server = server
+
+        # objects are shared by name, so that dependencies between operations
+        # are found again when the plan is applied
+        objects = dict()
+
+        def get(object_type, name, **kwargs):
+            if (object_type, name) not in objects:
+                if object_type in (gns3_client.Template, gns3_client.Project):
+                    obj = object_type(server=server, name=name, **kwargs)
+                else:
+                    obj = object_type(project=get(gns3_client.Project, c.name), **kwargs)
+                    obj.metadata.name = name
+                objects[(object_type, name)] = obj
+            return objects[(object_type, name)]
+
+        plan = {"delete": list(), "create": list(), "update": list()}
+        for op in data["operations"]:
+            object_type = getattr(gns3_client, op["type"])
+            metadata = op["metadata"]
+            name = metadata.pop("name", None)
+            if object_type is gns3_client.Link:
+                for e in metadata["nodes"]:
+                    node = get(gns3_client.Node, e["node"]["name"])
+                    node.metadata.node_id = node.metadata.node_id or e["node"]["node_id"]
+                    e["node"] = node
+                obj = gns3_client.Link(project=get(gns3_client.Project, c.name), **metadata)
+            else:
+                obj = get(object_type, name)
+                obj.metadata.update(metadata)
+                if object_type is gns3_client.Node and op.get("template"):
+                    obj.template = get(gns3_client.Template, op["template"])
+            plan[op["action"]].append(obj)
+
+        c.plan = plan
+        return c, data
+
+    @staticmethod
+    def scoped_diff(collection, in_scope):
+        # same diff as the collection one, restricted to local and remote objects
+        # in scope, objects out of scope are neither updated nor deleted
+        remote_objects = [o for o in collection._get_remote_objects() if in_scope(o)]
+        view = copy.copy(collection)
+        view.data = [o for o in collection if in_scope(o)]
+        view._get_remote_objects = lambda: remote_objects
+        return view.diff()
+
+    def plan_operations(self):
+        import gns3_client
+
+        ops = [
+            PlanOperation(action, obj)
+            for action in ("delete", "create", "update")
+            for obj in self.plan[action]
+        ]
+
+        def select(action, object_type):
+            return [
+                o
+                for o in ops
+                if o.action == action and isinstance(o.obj, object_type)
+            ]
+
+        created = {id(o.obj): o for o in ops if o.action == "create"}
+        updated = {id(o.obj): o for o in ops if o.action == "update"}
+        link_deletes = select("delete", gns3_client.Link)
+        node_deletes = select("delete", gns3_client.Node)
+        project_creates = select("create", gns3_client.Project)
+
+        def link_node_ids(op):
+            return set(e["node"].metadata.node_id for e in op.obj.metadata.nodes or [])
+
+        for op in ops:
+            deps = op.dependencies
+            if isinstance(op.obj, gns3_client.Node):
+                if op.action == "delete":
+                    # links are deleted before the nodes they are attached to
+                    node_id = op.obj.metadata.node_id
+                    deps.update(o for o in link_deletes if node_id in link_node_ids(o))
+                elif op.action == "create":
+                    deps.update(project_creates)
+                    if id(op.obj.template) in created:
+                        deps.add(created[id(op.obj.template)])
+                elif op.action == "update":
+                    # adapters may be removed by the update
+                    deps.update(link_deletes)
+            elif isinstance(op.obj, gns3_client.Link) and op.action != "delete":
+                # ports may be freed by deleted links, and added by node updates
+                deps.update(link_deletes)
+                for end in op.obj.metadata.nodes or []:
+                    for nodes in (created, updated):
+                        if id(end["node"]) in nodes:
+                            deps.add(nodes[id(end["node"])])
+            elif isinstance(op.obj, gns3_client.Template) and op.action == "delete":
+                deps.update(node_deletes)
+            elif isinstance(op.obj, gns3_client.Drawing) and op.action == "create":
+                deps.update(project_creates)
+        return ops
+
+    @phase("apply_plan")
+    def apply_plan(self, concurrency=1):
         logger.info(f"Applying plan ...")
-        for obj in self.plan["delete"]:
-            obj.delete()
-        for obj in self.plan["create"]:
-            obj.create()
-        for obj in self.plan["update"]:
-            obj.update()
+        executor = PlanExecutor(
+            self.plan_operations(), concurrency, cache=self.server.cache
+        )
+        success = executor.run()
+        self.report = executor.report()
+        return success
 
     @staticmethod
     def platform_to_template(platform):
+        import gns3_client
+
         params = {"name": platform["name"]}
 
         for k in vars(gns3_client.TemplateMetadata()).keys():
@@ -188,6 +1260,8 @@ class Converter:
 
     @staticmethod
     def site_to_drawing(site):
+        import gns3_client
+
         params = {"name": site["name"]}
 
         for k in vars(gns3_client.DrawingMetadata()).keys():
@@ -208,14 +1282,19 @@ class Converter:
         return params
 
     @staticmethod
-    def device_to_node(device, site):
+    def device_to_node(device, site, physical_interfaces=None):
+        import gns3_client
+
         params = {"name": device["name"], "template": device["platform"]["name"]}
 
-        custom_adapters = Converter.device_custom_adapters(device)
+        if physical_interfaces is None:
+            physical_interfaces = Converter.device_get_physical_interfaces(device)
+
+        custom_adapters = Converter.device_custom_adapters(device, physical_interfaces)
         if custom_adapters:
             params["custom_adapters"] = custom_adapters
 
-        properties = Converter.device_properties(device)
+        properties = Converter.device_properties(device, physical_interfaces)
         if properties:
             params["properties"] = properties
 
@@ -243,23 +1322,27 @@ class Converter:
         return mgmt_interfaces + other_interfaces
 
     @staticmethod
-    def device_custom_adapters(device):
+    def device_custom_adapters(device, physical_interfaces=None):
+        if physical_interfaces is None:
+            physical_interfaces = Converter.device_get_physical_interfaces(device)
         template_type = device["platform"]["custom_fields"]["gns3_template_type"]
         if template_type in ["qemu", "docker"]:
             custom_adapters = list()
-            for n, i in enumerate(Converter.device_get_physical_interfaces(device)):
+            for n, i in enumerate(physical_interfaces):
                 custom_adapter = {"port_name": i["name"], "adapter_number": n}
                 custom_adapters.append(custom_adapter)
             return custom_adapters
 
     @staticmethod
-    def device_properties(device):
+    def device_properties(device, physical_interfaces=None):
+        if physical_interfaces is None:
+            physical_interfaces = Converter.device_get_physical_interfaces(device)
         template_type = device["platform"]["custom_fields"]["gns3_template_type"]
         if template_type in ["qemu", "docker"]:
-            return {"adapters": len(Converter.device_get_physical_interfaces(device))}
+            return {"adapters": len(physical_interfaces)}
         if template_type == "ethernet_switch":
             ports_mapping = list()
-            for n, i in enumerate(Converter.device_get_physical_interfaces(device)):
+            for n, i in enumerate(physical_interfaces):
                 mode: str = "access"
                 nb_mode: dict = i["mode"]
                 if isinstance(nb_mode, dict) and "value" in nb_mode:
@@ -283,35 +1366,16 @@ class Converter:
 
     @staticmethod
     def connection_to_link(
-        interface_id_a: dict,
-        interface_id_b: dict,
-        devices: dict,
-        project: gns3_client.Project,
+        interface_id_a: int, interface_id_b: int, index: "TopologyIndex"
     ) -> dict:
-        int_a = next(
-            i for d in devices for i in d["interfaces"] if i["id"] == interface_id_a
-        )
-        int_b = next(
-            i for d in devices for i in d["interfaces"] if i["id"] == interface_id_b
-        )
+        int_a = index.interfaces[interface_id_a]
+        int_b = index.interfaces[interface_id_b]
 
-        node_a = next(
-            n for n in project.nodes if n.metadata.name == int_a["device"]["name"]
-        )
-        node_b = next(
-            n for n in project.nodes if n.metadata.name == int_b["device"]["name"]
-        )
+        node_a = index.nodes[int_a["device"]["name"]]
+        node_b = index.nodes[int_b["device"]["name"]]
 
-        interface_id_to_num = {
-            d["id"]: {
-                i["id"]: n
-                for n, i in enumerate(Converter.device_get_physical_interfaces(d))
-            }
-            for d in devices
-        }
-
-        number_a = interface_id_to_num[int_a["device"]["id"]][int_a["id"]]
-        number_b = interface_id_to_num[int_b["device"]["id"]][int_b["id"]]
+        number_a = index.port_numbers[interface_id_a]
+        number_b = index.port_numbers[interface_id_b]
 
         port_number_a, adapter_number_a = number_a, 0
         if node_a.template.metadata.template_type in ["qemu", "docker"]:
@@ -339,6 +1403,180 @@ class Converter:
         return params
 
 
+class Shard:
+    """A GNS3 project of a sharded sync, and the outcome of its sync."""
+
+    def __init__(self, converter, devices, state=None):
+        self.converter = converter
+        self.devices = devices
+        self.state = state
+        self.fingerprint = converter.fingerprint()
+        self.status = "pending"
+        self.error = None
+        self.seconds = None
+
+
+class ShardedSync:
+    """Syncs the devices to several GNS3 projects and servers, NetBox being read
+    once. Devices are split into one project per site or per tag, and projects are
+    spread over the servers by node count. With "balance", sites are spread over
+    the servers, with one project per server.
+
+    Servers are synced in parallel, the shards of a server one after the other as
+    they share its templates.
+    """
+
+    PARTITIONS = ("site", "tag", "balance")
+
+    def __init__(
+        self, netbox_session, gns3_server_urls, project_name, partition, metrics=None
+    ):
+        self.gns3_server_urls = list(dict.fromkeys(gns3_server_urls))
+        self.name = project_name
+        self.partition = partition
+        self.metrics = metrics or Metrics()
+        # loads NetBox objects for all the shards
+        self.loader = Converter(netbox_session, None, None, self.metrics)
+        self.shards = list()
+        self.cross_links = 0
+
+    def group_key(self, device):
+        if self.partition == "tag":
+            tags = sorted(
+                t["slug"] for t in device.get("tags") or [] if t["slug"] != DEVICE_TAG
+            )
+            return tags[0] if tags else None
+        return self.loader.sites[device["site"]["id"]]["name"]
+
+    def partition_devices(self, devices):
+        """Returns (server URL, project name, devices) of the shards."""
+        groups = defaultdict(list)
+        for device in devices:
+            groups[self.group_key(device)].append(device)
+
+        # largest groups first, each on the server with the fewest nodes so far
+        nodes = {url: 0 for url in self.gns3_server_urls}
+        server_groups = defaultdict(list)
+        for key, group in sorted(groups.items(), key=lambda g: (-len(g[1]), str(g[0]))):
+            url = min(nodes, key=nodes.get)
+            nodes[url] += len(group)
+            server_groups[url].append(key)
+
+        shards = list()
+        for url in self.gns3_server_urls:
+            keys = server_groups[url]
+            if self.partition == "balance":
+                if keys:
+                    shard_devices = [d for key in keys for d in groups[key]]
+                    shards.append((url, self.name, shard_devices))
+            else:
+                for key in keys:
+                    name = f"{self.name}-{key}" if key is not None else self.name
+                    shards.append((url, name, groups[key]))
+        return shards
+
+    @phase("compute_target")
+    def compute_target(self, query):
+        devices = self.loader.nb.get_results(
+            query, fields=Converter.NETBOX_FIELDS["/dcim/devices/"]
+        )
+        self.loader.load(devices)
+
+        partition = self.partition_devices(devices)
+        shard_ids = {d["id"]: n for n, (_, _, ds) in enumerate(partition) for d in ds}
+        self.cross_links = sum(
+            1
+            for d in devices
+            for i in d["interfaces"]
+            if i["connected_endpoint_type"] == "dcim.interface"
+            and i["connected_endpoint"]["device"]["id"] in shard_ids
+            and i["connected_endpoint"]["device"]["id"] > d["id"]
+            and shard_ids[i["connected_endpoint"]["device"]["id"]] != shard_ids[d["id"]]
+        )
+        if self.cross_links:
+            logger.warning(f"{self.cross_links} links between shards are not synced")
+
+        self.shards = list()
+        for url, name, shard_devices in partition:
+            logger.info(f"Shard {name} on {url}: {len(shard_devices)} devices ...")
+            c = Converter(self.loader.nb, url, name, self.metrics)
+            c.platforms = self.loader.platforms
+            c.interfaces = self.loader.interfaces
+            sids = set(d["site"]["id"] for d in shard_devices)
+            c.sites = {sid: self.loader.sites[sid] for sid in sids}
+            c.kept_projects = set(n for u, n, _ in partition if u == url and n != name)
+            c.build_target(shard_devices)
+            self.shards.append(Shard(c, shard_devices))
+
+    def sync_shard(self, shard, sync=True, force=False, concurrency=1, change_id=None):
+        c = shard.converter
+        start = time.perf_counter()
+        try:
+            if (
+                shard.state
+                and shard.fingerprint == shard.state.get("fingerprint")
+                and not force
+            ):
+                c.plan = {"delete": list(), "create": list(), "update": list()}
+                shard.status = "unchanged"
+            else:
+                c.compute_plan()
+                if not any(c.plan.values()):
+                    shard.status = "in sync"
+                elif not sync:
+                    shard.status = "planned"
+                elif c.apply_plan(concurrency=concurrency):
+                    shard.status = "applied"
+                else:
+                    shard.status = "failed"
+            if sync and shard.state and shard.status != "failed":
+                shard.state.save(change_id=change_id, fingerprint=shard.fingerprint)
+        except Exception as e:
+            # e.g. an unreachable server, the other shards are synced anyway
+            logger.error(f"shard {c.name} on {c.gns3_server_url} failed: {e}")
+            shard.status = "failed"
+            shard.error = f"{e.__class__.__name__}: {e}"
+        shard.seconds = time.perf_counter() - start
+
+    def sync(self, sync=True, force=False, concurrency=1, change_id=None):
+        server_shards = defaultdict(list)
+        for shard in self.shards:
+            server_shards[shard.converter.gns3_server_url].append(shard)
+
+        def sync_server(shards):
+            for shard in shards:
+                self.sync_shard(shard, sync, force, concurrency, change_id)
+
+        with ThreadPoolExecutor(max_workers=max(len(server_shards), 1)) as executor:
+            list(executor.map(sync_server, server_shards.values()))
+        return all(s.status != "failed" for s in self.shards)
+
+    def report(self):
+        lines = list()
+        for shard in self.shards:
+            c = shard.converter
+            if c.report:
+                lines += [f"# {c.name} on {c.gns3_server_url}", c.report, ""]
+        lines.append(
+            f"{'server':<32} {'project':<20} {'devices':>7} {'delete':>6} "
+            f"{'create':>6} {'update':>6} {'seconds':>8}  status"
+        )
+        for shard in self.shards:
+            c = shard.converter
+            plan = c.plan or dict()
+            counts = [len(plan.get(a, ())) for a in ("delete", "create", "update")]
+            lines.append(
+                f"{c.gns3_server_url:<32} {c.name:<20} {len(shard.devices):>7} "
+                f"{counts[0]:>6} {counts[1]:>6} {counts[2]:>6} "
+                f"{shard.seconds or 0:>8.3f}  {shard.error or shard.status}"
+            )
+        lines.append(
+            f"{len(self.shards)} shards on {len(self.gns3_server_urls)} servers, "
+            f"{self.cross_links} links between shards not synced"
+        )
+        return "\n".join(lines)
+
+
 # required for click
 os.environ["LANG"] = "C.UTF-8"
 
@@ -364,12 +1602,122 @@ os.environ["LANG"] = "C.UTF-8"
     default="0123456789abcdef0123456789abcdef01234567",
     help="netbox API token",
 )
+@click.option(
+    "--netbox-concurrency",
+    envvar="NETBOX_CONCURRENCY",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="number of parallel NetBox requests",
+)
+@click.option(
+    "--netbox-page-size",
+    envvar="NETBOX_PAGE_SIZE",
+    type=click.IntRange(min=0),
+    help="objects per NetBox page, 0 to read each listing in one response, "
+    "NetBox's default MAX_PAGE_SIZE if not set",
+)
+@click.option(
+    "--netbox-prefetch/--no-netbox-prefetch",
+    default=True,
+    show_default=True,
+    help="fetch the next NetBox page while the current one is processed",
+)
+@click.option(
+    "--from-dump",
+    type=click.Path(exists=True, dir_okay=False),
+    help="read NetBox data from a pg_dump file (plain or gzipped) instead of the API",
+)
+@click.option(
+    "--cache-dir",
+    envvar="NB2GNS3_CACHE_DIR",
+    type=click.Path(file_okay=False),
+    help="persistent NetBox object cache directory (disabled if not set)",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="do not use the persistent NetBox object cache",
+)
+@click.option(
+    "--cache-max-age",
+    default=7 * 24 * 3600,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="seconds after which cached NetBox objects are fetched again",
+)
+@click.option(
+    "--cache-max-entries",
+    default=100000,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="maximum number of cached NetBox objects",
+)
+@click.option(
+    "--incremental/--full",
+    default=False,
+    show_default=True,
+    help="only rebuild devices changed in NetBox since the last sync, or everything",
+)
+@click.option(
+    "--state-dir",
+    envvar="NB2GNS3_STATE_DIR",
+    default=click.get_app_dir("nb2gns3"),
+    show_default="~/.config/nb2gns3",
+    type=click.Path(file_okay=False),
+    help="directory where the sync state is kept between runs",
+)
+@click.option(
+    "--plan-out",
+    type=click.Path(dir_okay=False, writable=True),
+    help="write the computed plan to this file",
+)
+@click.option(
+    "--apply-plan",
+    "plan_in",
+    type=click.Path(exists=True, dir_okay=False),
+    help="apply a plan written by --plan-out, without reading NetBox",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="diff GNS3 even if the target is unchanged since the last sync, e.g. after "
+    "changes in the GNS3 GUI",
+)
+@click.option(
+    "--metrics-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="write phase durations and request metrics to this file",
+)
+@click.option(
+    "--metrics-format",
+    type=click.Choice(["json", "prometheus"]),
+    default="json",
+    show_default=True,
+    help="format of the metrics file",
+)
 @click.option(
     "--gns3-server-url",
+    "gns3_server_urls",
     envvar="GNS3_SERVER_URL",
-    default="http://gns3.example.com:3080/v2",
+    multiple=True,
+    default=("http://gns3.example.com:3080/v2",),
     show_default=True,
-    help="GNS3 server URL",
+    help="GNS3 server URL, repeated to spread the shards over several servers",
+)
+@click.option(
+    "--shard-by",
+    type=click.Choice(ShardedSync.PARTITIONS),
+    help="split the devices into one project per site or per tag, or balance the "
+    "sites over the servers with one project per server",
+)
+@click.option(
+    "--gns3-concurrency",
+    envvar="GNS3_CONCURRENCY",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="number of parallel GNS3 operations when applying the plan",
 )
 @click.option(
     "--gns3-project-name",
@@ -379,7 +1727,29 @@ os.environ["LANG"] = "C.UTF-8"
     help="GNS3 project name",
 )
 def nb2gns3(
-    sync, netbox_url, netbox_token, gns3_server_url, gns3_project_name, verbose
+    sync,
+    netbox_url,
+    netbox_token,
+    netbox_concurrency,
+    netbox_page_size,
+    netbox_prefetch,
+    from_dump,
+    cache_dir,
+    no_cache,
+    cache_max_age,
+    cache_max_entries,
+    incremental,
+    state_dir,
+    plan_out,
+    plan_in,
+    force,
+    metrics_file,
+    metrics_format,
+    gns3_server_urls,
+    shard_by,
+    gns3_concurrency,
+    gns3_project_name,
+    verbose,
 ):
     if verbose == 2:
         logzero.loglevel(logzero.DEBUG)
@@ -389,20 +1759,121 @@ def nb2gns3(
         logzero.loglevel(logzero.ERROR)
 
     if not sync:
-        logger(
+        logger.warning(
             f"DRY-RUN mode, nothing will be commited to GNS3. Use --sync to commit to netbox."
         )
 
-    netbox_session = NetBoxSession(netbox_url, netbox_token)
-    c = Converter(netbox_session, gns3_server_url, gns3_project_name)
-    c.compute_target(query="/dcim/devices/?limit=0&q=&tag=gns3")
-    c.compute_plan()
+    if shard_by and (incremental or plan_out or plan_in):
+        raise click.UsageError(
+            "--shard-by cannot be used with --incremental, --plan-out or --apply-plan"
+        )
+    if not shard_by and len(set(gns3_server_urls)) > 1:
+        raise click.UsageError("several --gns3-server-url require --shard-by")
+    gns3_server_url = gns3_server_urls[0]
+
+    metrics = Metrics()
+    if metrics_file:
+        # written when the command ends, also when it fails
+        click.get_current_context().call_on_close(
+            lambda: metrics.write(metrics_file, metrics_format)
+        )
+
+    if plan_in:
+        c, plan = Converter.load_plan(plan_in, metrics)
+        logger.info(f"Applying {plan_in} to project {c.name} on {c.gns3_server_url} ...")
+        success = c.apply_plan(concurrency=gns3_concurrency)
+        click.echo(c.report)
+        if not success:
+            raise click.ClickException("plan not fully applied, see report above")
+        state = SyncState(state_dir, plan["netbox_url"], c.gns3_server_url, c.name)
+        state.save(change_id=plan["change_id"], fingerprint=plan["fingerprint"])
+        return
+
+    object_cache = None
+    if from_dump:
+        netbox_url = "file://" + os.path.abspath(from_dump)
+        netbox_session = NetBoxDump(from_dump)
+    else:
+        # loads requests, after the arguments are checked
+        from netbox_session import NetBoxSession
+
+        if cache_dir and not no_cache:
+            object_cache = NetBoxObjectCache(
+                cache_dir, cache_max_age, cache_max_entries
+            )
+        if netbox_page_size is None:
+            netbox_page_size = NetBoxSession.PAGE_SIZE
+        netbox_session = NetBoxSession(
+            netbox_url,
+            netbox_token,
+            concurrency=netbox_concurrency,
+            object_cache=object_cache,
+            metrics=metrics,
+            page_size=netbox_page_size,
+            prefetch=netbox_prefetch,
+        )
+
+    if shard_by:
+        s = ShardedSync(
+            netbox_session, gns3_server_urls, gns3_project_name, shard_by, metrics
+        )
+        change_id = s.loader.latest_change_id()
+        s.compute_target(query=DEVICE_QUERY)
+        if object_cache:
+            object_cache.close()
+        for shard in s.shards:
+            c = shard.converter
+            shard.state = SyncState(state_dir, netbox_url, c.gns3_server_url, c.name)
+        success = s.sync(sync, force, gns3_concurrency, change_id)
+        click.echo(s.report())
+        if not success:
+            raise click.ClickException("some shards failed, see report above")
+        return
+
+    state = SyncState(state_dir, netbox_url, gns3_server_url, gns3_project_name)
+    c = Converter(netbox_session, gns3_server_url, gns3_project_name, metrics)
+
+    # the watermark is read before NetBox data, so that changes made during the
+    # run are replayed by the next incremental sync
+    change_id = c.latest_change_id()
+    c.compute_target(
+        query=DEVICE_QUERY,
+        incremental=incremental,
+        change_id=state.get("change_id"),
+    )
+    if object_cache:
+        object_cache.close()
+
+    # a partial target from an incremental sync cannot be compared to a full one
+    fingerprint = c.fingerprint() if c.scope is None else None
+    if fingerprint and fingerprint == state.get("fingerprint") and not force:
+        logger.info(
+            "Target unchanged since the last sync, nothing to do "
+            "(--force to diff GNS3 anyway, e.g. after changes in the GNS3 GUI)"
+        )
+        c.plan = {"delete": list(), "create": list(), "update": list()}
+    else:
+        c.compute_plan()
 
     logger.info(f"This is the plan:")
-    logger.info(pprint(c.plan))
+    logger.info(pformat(c.plan))
+
+    if plan_out:
+        c.save_plan(
+            plan_out,
+            netbox_url=netbox_url,
+            change_id=change_id,
+            fingerprint=fingerprint,
+        )
+
+    if sync and any(c.plan.values()):
+        success = c.apply_plan(concurrency=gns3_concurrency)
+        click.echo(c.report)
+        if not success:
+            raise click.ClickException("plan not fully applied, see report above")
 
-    if sync and len(c.plan) > 0:
-        c.apply_plan()
+    if sync:
+        state.save(change_id=change_id, fingerprint=fingerprint)
 
 
 if __name__ == "__main__":
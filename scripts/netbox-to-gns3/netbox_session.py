@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+
+import requests_cache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from logzero import logger
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from urllib.parse import parse_qsl, quote, urlencode, urlparse
+from urllib3 import disable_warnings
+
+# NetBox is reached without certificate verification
+disable_warnings()
+
+
+class NetBoxSession(requests_cache.CachedSession):
+    # ids per multi-id filtered query, keeps query strings well under URL size limits
+    MAX_IDS_PER_QUERY = 100
+    # NetBox default MAX_PAGE_SIZE
+    PAGE_SIZE = 1000
+    # objects per bulk update request
+    PATCH_BATCH_SIZE = 100
+
+    def __init__(
+        self,
+        base_url=None,
+        netbox_token=None,
+        netbox_private_key=None,
+        concurrency=1,
+        object_cache=None,
+        metrics=None,
+        page_size=PAGE_SIZE,
+        prefetch=True,
+        *args,
+        **kwargs,
+    ):
+        super(NetBoxSession, self).__init__(*args, **kwargs)  # noqa
+        self.headers.update({"Authorization": "Token " + str(netbox_token)})
+        self.verify = False
+        self.base_url = base_url
+        self.concurrency = max(1, concurrency)
+        self.object_cache = object_cache
+        self.metrics = metrics
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.request_count = 0
+        self._request_count_lock = Lock()
+
+        # one keep-alive connection per worker, shared by all the parallel reads
+        adapter = HTTPAdapter(pool_maxsize=max(self.concurrency, 10))
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+        self.cache.clear()
+        if netbox_private_key:
+            r = self.post(
+                "/secrets/get-session-key/", data={"private_key": netbox_private_key}
+            )
+            j = r.json()
+            self.headers.update({"X-Session-Key": j["session_key"]})
+
+    def _get_url(self, url):
+        o = urlparse(self.base_url)
+        path = o.path + "/" + url
+        while "//" in path:
+            path = path.replace("//", "/")
+        o = o._replace(path=path)  # noqa
+        return o.geturl()
+
+    def request(self, method, url, prepend_base_url=True, *args, **kwargs):
+        if prepend_base_url:
+            url = self._get_url(url)
+        logger.debug(f"Request sent: {method} {url}")
+        r = super(NetBoxSession, self).request(method, url, *args, **kwargs)
+        logger.debug(f"Request status: {r.status_code} {r.reason}")
+        if not getattr(r, "from_cache", False):
+            with self._request_count_lock:
+                self.request_count += 1
+            if self.metrics:
+                self.metrics.observe("netbox", r)
+        return r
+
+    def _page_url(self, url):
+        # listings with limit=0 ask for all the results, they are read page by page
+        # instead of in one large response
+        o = urlparse(url)
+        query = parse_qsl(o.query, keep_blank_values=True)
+        if not self.page_size or ("limit", "0") not in query:
+            return url, False
+        query = [(k, v) for k, v in query if k not in ("limit", "offset")]
+        query.append(("limit", str(self.page_size)))
+        return o._replace(query=urlencode(query)).geturl(), True
+
+    def _iter_pages(self, url):
+        # yields (response, results) per page, the next page is fetched while the
+        # current one is processed
+        url, paged = self._page_url(url)
+        endpoint = url.split("?")[0]
+        executor = None
+        if paged and self.prefetch:
+            executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            response = self.request("GET", url)
+            while True:
+                data = response.json()
+                next_url = data.get("next") if paged else None
+                future = None
+                if next_url:
+                    # next links are absolute URLs built by NetBox, which do not
+                    # match base_url behind some reverse proxies
+                    next_url = endpoint + "?" + urlparse(next_url).query
+                    if executor:
+                        future = executor.submit(self.request, "GET", next_url)
+                yield response, data["results"]
+                if not next_url:
+                    return
+                if future:
+                    response = future.result()
+                else:
+                    response = self.request("GET", next_url)
+        finally:
+            if executor:
+                executor.shutdown()
+
+    def iter_results(self, url, fields=None):
+        for _, results in self._iter_pages(url):
+            for o in results:
+                yield self.trim(o, fields)
+
+    @staticmethod
+    def trim(o, fields=None):
+        # keeps only the given fields of a NetBox object, all if not specified
+        if fields is None:
+            return o
+        return {k: o[k] for k in fields if k in o}
+
+    def get_results(self, url, cached=True, fields=None):
+        if cached and self.object_cache:
+            return [self.trim(o, fields) for o in self._get_cached_results(url)]
+        return list(self.iter_results(url, fields))
+
+    def _get_cached_results(self, url):
+        endpoint = url.split("?")[0]
+        sep = "&" if "?" in url else "?"
+
+        # the brief listing is small and tells which objects the query returns
+        fetched_at, briefs = None, list()
+        for r, results in self._iter_pages(url + sep + "brief=1"):
+            fetched_at = fetched_at or self._server_time(r)
+            briefs.extend(results)
+        brief_by_id = {b["id"]: b for b in briefs}
+        cache = self.object_cache
+        cached = cache.lookup(endpoint, briefs)
+
+        # then only the objects updated since the oldest cached copy are transferred
+        changed = dict()
+        if cached:
+            since = min(t for t, _ in cached.values()) - cache.MARGIN
+            changed_url = url + sep + "last_updated__gte=" + quote(since.isoformat())
+            for o in self.iter_results(changed_url):
+                changed[o["id"]] = o
+        hits = cache.get(endpoint, cached, changed)
+
+        missing = [i for i in brief_by_id if i not in changed and i not in hits]
+        fetched = {
+            o["id"]: o
+            for missing_url in self._object_urls(endpoint, missing)
+            for o in self.iter_results(missing_url)
+        }
+
+        cache.put(
+            endpoint,
+            list(changed.values()) + list(fetched.values()),
+            brief_by_id,
+            fetched_at,
+        )
+        cache.count(len(hits), len(briefs) - len(hits))
+        objects = {**hits, **fetched, **changed}
+        return [objects[b["id"]] for b in briefs]
+
+    @staticmethod
+    def _server_time(response):
+        # NetBox server time, so that cache revalidation does not depend on the
+        # local clock
+        try:
+            return parsedate_to_datetime(response.headers["Date"])
+        except (KeyError, TypeError, ValueError):
+            return datetime.now(timezone.utc)
+
+    def _object_urls(self, endpoint, ids, key="id"):
+        ids = sorted(set(ids))
+        urls = list()
+        for n in range(0, len(ids), self.MAX_IDS_PER_QUERY):
+            chunk = ids[n : n + self.MAX_IDS_PER_QUERY]
+            query = "&".join(f"{key}={i}" for i in chunk)
+            urls.append(f"{endpoint}?limit=0&{query}")
+        return urls
+
+    def get_objects(self, *queries, fields=None):
+        # each query is an (endpoint, ids, filter key) tuple, one list of objects is
+        # returned per query; all the underlying requests are independent so they
+        # are sent in parallel when concurrency allows it. fields optionally maps
+        # endpoints to the fields kept in their objects.
+        fields = fields or dict()
+        urls = [self._object_urls(endpoint, ids, key) for endpoint, ids, key in queries]
+
+        def get(url):
+            return self.get_results(url, fields=fields.get(url.split("?")[0]))
+
+        flat_urls = [url for query_urls in urls for url in query_urls]
+        if self.concurrency > 1 and len(flat_urls) > 1:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                flat_results = iter(list(executor.map(get, flat_urls)))
+        else:
+            flat_results = iter([get(url) for url in flat_urls])
+
+        return [
+            [o for _ in query_urls for o in next(flat_results)] for query_urls in urls
+        ]
+
+    def patch_objects(self, endpoint, objects, batch_size=PATCH_BATCH_SIZE):
+        # bulk updates of objects given as dicts of their id and changed fields, one
+        # request per batch; batches are independent so they are sent in parallel
+        # when concurrency allows it. Returns the updated objects.
+        batches = [
+            objects[n : n + batch_size] for n in range(0, len(objects), batch_size)
+        ]
+
+        def patch(batch):
+            r = self.request("PATCH", endpoint, json=batch)
+            r.raise_for_status()
+            return r.json()
+
+        if self.concurrency > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                results = list(executor.map(patch, batches))
+        else:
+            results = [patch(batch) for batch in batches]
+        return [o for result in results for o in result]
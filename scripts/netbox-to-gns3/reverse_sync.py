@@ -0,0 +1,241 @@
+#! /usr/bin/env python
+
+import click
+import logzero
+from logzero import logger
+from xml.etree import ElementTree
+from nb2gns3 import DEVICE_QUERY, Metrics, gns3_server
+
+
+class LayoutSync:
+    """Copies the layout of a GNS3 project back to the NetBox custom fields it is
+    built from: site drawings to gns3_x/y/z/width/height of the sites, and node
+    positions to gns3_x/y/z of the devices, relative to the position of their site.
+
+    Only the custom fields whose value changed are updated, with bulk requests.
+    """
+
+    NODE_FIELDS = ("x", "y", "z")
+    DRAWING_FIELDS = ("x", "y", "z", "width", "height")
+
+    def __init__(self, netbox_session, gns3_server_url, project_name, metrics=None):
+        self.nb = netbox_session
+        self.gns3_server_url = gns3_server_url
+        self.name = project_name
+        self.metrics = metrics or Metrics()
+        self.devices = list()
+        self.sites = dict()
+        self.nodes = dict()
+        self.drawings = dict()
+        # (endpoint, object, field, NetBox value, GNS3 value) of the changes
+        self.changes = list()
+
+    def load(self):
+        with self.metrics.phase("load_netbox"):
+            logger.info(f"Load devices and sites from NetBox ...")
+            self.devices = self.nb.get_results(
+                DEVICE_QUERY, fields=("id", "name", "site", "custom_fields")
+            )
+            sids = set(d["site"]["id"] for d in self.devices if d["site"])
+            (sites,) = self.nb.get_objects(
+                ("/dcim/sites/", sids, "id"),
+                fields={"/dcim/sites/": ("id", "name", "custom_fields")},
+            )
+            self.sites = {s["id"]: s for s in sites}
+
+        with self.metrics.phase("load_gns3"):
+            logger.info(f"Load nodes and drawings of project {self.name} ...")
+            server = gns3_server(self.gns3_server_url, self.metrics)
+            server.projects.pull()
+            project = next(
+                (p for p in server.projects if p.metadata.name == self.name), None
+            )
+            if project is None:
+                raise ValueError(f"project {self.name} not found on GNS3")
+            project.nodes.pull()
+            project.drawings.pull()
+            self.nodes = {n.metadata.name: n.metadata for n in project.nodes}
+            self.drawings = {
+                d.metadata.name: self.drawing_layout(d.metadata)
+                for d in project.drawings
+                if d.metadata.name
+            }
+
+    @staticmethod
+    def drawing_layout(metadata):
+        # position of a drawing, and size of its svg
+        layout = {k: getattr(metadata, k) for k in ("x", "y", "z")}
+        svg = ElementTree.fromstring(metadata.svg)
+        for k in ("width", "height"):
+            if svg.get(k) is not None:
+                layout[k] = int(float(svg.get(k)))
+        return layout
+
+    def compute_changes(self):
+        self.changes = list()
+        updates = {"/dcim/sites/": dict(), "/dcim/devices/": dict()}
+
+        def compare(endpoint, obj, field, value):
+            cf = "gns3_" + field
+            if value is None or cf not in obj["custom_fields"]:
+                return
+            old = obj["custom_fields"][cf]
+            if old != value:
+                self.changes.append((endpoint, obj, cf, old, value))
+                update = updates[endpoint].setdefault(
+                    obj["id"], {"id": obj["id"], "custom_fields": dict()}
+                )
+                update["custom_fields"][cf] = value
+
+        # sites first, as device positions are relative to the new site positions
+        offsets = dict()
+        for sid, site in self.sites.items():
+            drawing = self.drawings.get(site["name"])
+            offsets[sid] = {
+                k: site["custom_fields"].get("gns3_" + k) or 0 for k in self.NODE_FIELDS
+            }
+            if drawing is None:
+                continue
+            for k in self.DRAWING_FIELDS:
+                compare("/dcim/sites/", site, k, drawing.get(k))
+            offsets[sid].update({k: drawing[k] or 0 for k in self.NODE_FIELDS})
+
+        for device in self.devices:
+            node = self.nodes.get(device["name"])
+            if node is None or not device["site"]:
+                continue
+            offset = offsets[device["site"]["id"]]
+            for k in self.NODE_FIELDS:
+                value = getattr(node, k)
+                if value is not None:
+                    value -= offset[k]
+                compare("/dcim/devices/", device, k, value)
+
+        return {endpoint: list(u.values()) for endpoint, u in updates.items()}
+
+    def apply(self, updates, batch_size=None):
+        batch_size = batch_size or self.nb.PATCH_BATCH_SIZE
+        with self.metrics.phase("patch_netbox"):
+            for endpoint, objects in updates.items():
+                if objects:
+                    logger.info(f"Update {len(objects)} objects of {endpoint} ...")
+                    self.nb.patch_objects(endpoint, objects, batch_size)
+
+
+@click.command()
+@click.option("-v", "--verbose", count=True)
+@click.option(
+    "--sync/--no-sync",
+    default=True,
+    show_default=True,
+    help="sync mode (push to NetBox if needed) or dry-run mode (read-only)",
+)
+@click.option(
+    "--netbox-url",
+    envvar="NETBOX_URL",
+    default="http://netbox.example.com:8000/api",
+    show_default=True,
+    help="netbox URL",
+)
+@click.option(
+    "--netbox-token",
+    envvar="NETBOX_TOKEN",
+    default="0123456789abcdef0123456789abcdef01234567",
+    help="netbox API token",
+)
+@click.option(
+    "--netbox-concurrency",
+    envvar="NETBOX_CONCURRENCY",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="number of parallel NetBox requests",
+)
+@click.option(
+    "--netbox-batch-size",
+    type=click.IntRange(min=1),
+    help="objects per NetBox bulk update request, the default of the NetBox "
+    "session if not set",
+)
+@click.option(
+    "--metrics-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="write phase durations and request metrics to this file",
+)
+@click.option(
+    "--gns3-server-url",
+    envvar="GNS3_SERVER_URL",
+    default="http://gns3.example.com:3080/v2",
+    show_default=True,
+    help="GNS3 server URL",
+)
+@click.option(
+    "--gns3-project-name",
+    envvar="GNS3_PROJECT_NAME",
+    default="lab",
+    show_default=True,
+    help="GNS3 project name",
+)
+def reverse_sync(
+    verbose,
+    sync,
+    netbox_url,
+    netbox_token,
+    netbox_concurrency,
+    netbox_batch_size,
+    metrics_file,
+    gns3_server_url,
+    gns3_project_name,
+):
+    """Copies node positions and site drawings of a GNS3 project back to the gns3_*
+    custom fields of the NetBox devices and sites."""
+    if verbose == 2:
+        logzero.loglevel(logzero.DEBUG)
+    elif verbose == 1:
+        logzero.loglevel(logzero.INFO)
+    else:
+        logzero.loglevel(logzero.ERROR)
+
+    metrics = Metrics()
+    if metrics_file:
+        click.get_current_context().call_on_close(lambda: metrics.write(metrics_file))
+
+    # loads requests, after the arguments are checked
+    import requests
+    from netbox_session import NetBoxSession
+
+    session = NetBoxSession(
+        netbox_url, netbox_token, concurrency=netbox_concurrency, metrics=metrics
+    )
+    s = LayoutSync(session, gns3_server_url, gns3_project_name, metrics)
+    try:
+        s.load()
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    updates = s.compute_changes()
+
+    for endpoint, obj, field, old, new in s.changes:
+        click.echo(f"{endpoint:<15} {obj['name']:<24} {field:<12} {old} -> {new}")
+    counts = {endpoint: len(objects) for endpoint, objects in updates.items()}
+    click.echo(
+        f"{counts['/dcim/devices/']} devices and {counts['/dcim/sites/']} sites "
+        f"changed, {len(s.changes)} custom fields",
+        err=True,
+    )
+
+    if not sync:
+        logger.warning(f"DRY-RUN mode, nothing was written to NetBox")
+        return
+    requests_before = session.request_count
+    try:
+        s.apply(updates, netbox_batch_size)
+    except requests.HTTPError as e:
+        raise click.ClickException(f"NetBox update failed, {e}: {e.response.text}")
+    click.echo(
+        f"NetBox updated with {session.request_count - requests_before} requests",
+        err=True,
+    )
+
+
+if __name__ == "__main__":
+    reverse_sync()
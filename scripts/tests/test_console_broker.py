@@ -0,0 +1,74 @@
+import asyncio
+from console_broker import ConsoleBroker
+from expect import Modes
+from fake_vyos_console import serve
+
+HOST = "127.0.0.1"
+
+
+def run(session, count=1, **router_options):
+    # runs session(broker, consoles) against fake VyOS consoles on ephemeral ports
+    async def main():
+        servers = await serve(HOST, 0, count, **router_options)
+        broker = ConsoleBroker(probe_after=0)
+        try:
+            consoles = [f"{HOST}:{s.sockets[0].getsockname()[1]}" for s in servers]
+            return await session(broker, consoles)
+        finally:
+            await broker.close()
+            for server in servers:
+                server.close()
+
+    return asyncio.run(main())
+
+
+def test_one_session_per_console():
+    async def session(broker, consoles):
+        # the same console with another login is logged in again, never used by
+        # two requests at once
+        requests = [
+            {"console": consoles[0]},
+            {"console": consoles[0], "login": "vyos", "password": "vyos"},
+        ]
+        await asyncio.gather(
+            *[broker.call(r, "send_command", ("show version",)) for r in requests]
+        )
+        return list(broker.sessions.values())
+
+    sessions = run(session)
+    assert len(sessions) == 1
+    assert sessions[0].logins == 2
+
+
+def test_probe_discards_configuration():
+    async def session(broker, consoles):
+        request = {"console": consoles[0]}
+        s, _ = await broker.call(request, None)
+        # a client left the console in configuration mode
+        await s.v.send_command("configure")
+        await s.v.send_command("set system domain-name 'lab'")
+        assert s.v.mode is Modes.CONFIGURATION
+        _, commands = await broker.call(request, "get_configuration_commands")
+        return s, commands
+
+    s, commands = run(session)
+    assert s.logins == 1
+    assert "set system domain-name 'lab'" not in commands
+
+
+def test_evicted_while_waiting():
+    async def session(broker, consoles):
+        request = {"console": consoles[0]}
+        first, _ = await broker.call(request, None)
+        evicting = asyncio.ensure_future(broker.evict(-1))
+        await asyncio.sleep(0)
+        assert first.lock.locked()
+        # the request waits for the logout of the evicted session, then gets a new one
+        second, _ = await broker.call(request, "send_command", ("show version",))
+        await evicting
+        return first, second, broker
+
+    first, second, broker = run(session)
+    assert first.evicted and not second.evicted
+    assert broker.evictions == 1
+    assert second.logins == 1
@@ -0,0 +1,33 @@
+import asyncio
+import os
+from console_replay import run_session, serve
+from expect import DRIVERS, load_recording
+
+# session recorded on fake_vyos_console.py: login, show configuration and a bulk
+# configuration
+RECORDING = os.path.join(
+    os.path.dirname(__file__), "recordings", "vyos-login-configure.jsonl"
+)
+
+
+def replay(path, session):
+    # runs session against the replay of the recording at speed 0
+    async def main():
+        servers = await serve("127.0.0.1", 0, [path], speed=0, strict=True)
+        port = servers[0].sockets[0].getsockname()[1]
+        try:
+            driver = DRIVERS[session["driver"]]
+            return await run_session(driver, "127.0.0.1", port, session)
+        finally:
+            servers[0].close()
+
+    return asyncio.run(main())
+
+
+def test_replay_transcript():
+    header, _, transcript = load_recording(RECORDING)
+    v = replay(RECORDING, header["session"])
+    assert v.loglines.text() == transcript
+    assert "vyos@vyos1:~$ show configuration\r\n interfaces {" in transcript
+    assert "vyos@vyos1# set interfaces ethernet eth1 description 'to R2'" in transcript
+    assert "vyos@vyos1# commit\r\n" in transcript
@@ -0,0 +1,94 @@
+from drift_check import DriftCache, check_drift, unified_diff
+from expect import Nxos
+from fake_vyos_console import FakeNxos
+
+INTENDED = """set system host-name 'R1'
+set interfaces ethernet eth1 address '10.0.0.1/24'
+"""
+
+
+def check(tmp_path, running, cache):
+    path = tmp_path / "R1.conf"
+    path.write_text(INTENDED)
+    intended = {"R1": str(path)}
+    return check_drift(intended, [{"node": "R1", "output": running}], cache)["R1"]
+
+
+def test_in_sync_cached(tmp_path):
+    cache = DriftCache(str(tmp_path / "cache.json"))
+    # same commands in another order, with a blank line
+    running = "set interfaces ethernet eth1 address '10.0.0.1/24'\n\n"
+    running += "set system host-name 'R1'\n"
+    assert check(tmp_path, running, cache) == {"status": "in sync", "cached": False}
+    cache.save()
+
+    cache = DriftCache(str(tmp_path / "cache.json"))
+    assert check(tmp_path, running, cache) == {"status": "in sync", "cached": True}
+
+
+def test_drift_always_diffed(tmp_path):
+    cache = DriftCache(str(tmp_path / "cache.json"))
+    running = "set system host-name 'R1'\n"
+    for _ in range(2):
+        r = check(tmp_path, running, cache)
+        assert r["status"] == "drifted"
+        assert "-set interfaces ethernet eth1 address '10.0.0.1/24'" in (
+            unified_diff("R1.conf", "R1", r).splitlines()
+        )
+    assert "R1" not in cache.data
+
+
+def test_failed(tmp_path):
+    cache = DriftCache(str(tmp_path / "cache.json"))
+    report = check_drift({}, [{"node": "R1", "error": "timeout"}], cache)
+    assert report == {"R1": {"status": "failed", "error": "timeout"}}
+
+
+def test_nxos_defaults(tmp_path):
+    # the version, boot and default lines of the switch are not drifts
+    path = tmp_path / "SW1.conf"
+    path.write_text("hostname SW1\n\ninterface Ethernet1/1\n  lacp rate fast\n")
+    intended = {"SW1": str(path)}
+    switch = FakeNxos(hostname="SW1")
+    switch.running.append(["interface Ethernet1/1", ["  lacp rate fast"]])
+    switch.running.append(["interface Ethernet1/2", []])
+    running = switch.render()
+    assert running.startswith("version ")
+    cache = DriftCache(str(tmp_path / "cache.json"))
+    results = [{"node": "SW1", "output": running}]
+    report = check_drift(intended, results, cache, [("SW*", Nxos)])
+    assert report["SW1"]["status"] == "in sync"
+
+    switch.running[-1][1].append("  shutdown")
+    results = [{"node": "SW1", "output": switch.render()}]
+    report = check_drift(intended, results, cache, [("SW*", Nxos)])
+    assert report["SW1"]["status"] == "drifted"
+    assert report["SW1"]["running"][-1] == "  shutdown"
+
+
+def test_nxos_added_configuration(tmp_path):
+    # configuration added on the switch is a drift, even out of the sections of
+    # the intended configuration
+    path = tmp_path / "SW1.conf"
+    path.write_text("hostname SW1\n\ninterface Ethernet1/1\n  lacp rate fast\n")
+    intended = {"SW1": str(path)}
+    switch = FakeNxos(hostname="SW1")
+    switch.running += [
+        ["feature ospf", []],
+        ["interface Ethernet1/1", ["  lacp rate fast"]],
+        ["interface Ethernet1/3", ["  no switchport", "  ip address 10.0.0.1/24"]],
+        ["ip route 0.0.0.0/0 10.0.0.99", []],
+    ]
+    cache = DriftCache(str(tmp_path / "cache.json"))
+    results = [{"node": "SW1", "output": switch.render()}]
+    report = check_drift(intended, results, cache, [("SW*", Nxos)])
+    assert report["SW1"]["status"] == "drifted"
+    added = set(report["SW1"]["running"]) - set(report["SW1"]["intended"])
+    assert added == {
+        "feature ospf",
+        "interface Ethernet1/3",
+        "  no switchport",
+        "  ip address 10.0.0.1/24",
+        "ip route 0.0.0.0/0 10.0.0.99",
+    }
+    assert "SW1" not in cache.data
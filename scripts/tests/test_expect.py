@@ -0,0 +1,208 @@
+import asyncio
+import pytest
+from expect import Transcript, Vyos, VyOSModes
+from fake_vyos_console import serve
+
+HOST = "127.0.0.1"
+
+
+class TracedVyos(Vyos):
+    """Vyos driver keeping the mode reached after each command."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.modes = list()
+
+    async def expect_prompt(self, command, sample=True):
+        output = await super().expect_prompt(command, sample)
+        self.modes.append((command, self.mode))
+        return output
+
+
+def run(session, count=1, **router_options):
+    # runs session(ports) against fake VyOS consoles on ephemeral ports
+    async def main():
+        servers = await serve(HOST, 0, count, **router_options)
+        try:
+            return await session([s.sockets[0].getsockname()[1] for s in servers])
+        finally:
+            for server in servers:
+                server.close()
+
+    return asyncio.run(main())
+
+
+def test_login():
+    async def session(ports):
+        async with Vyos(host=HOST, port=ports[0]) as v:
+            assert v.mode is VyOSModes.UNKNWOWN
+            await v.login()
+            return v.mode
+
+    assert run(session) is VyOSModes.OPERATIONAL
+
+
+def test_bad_password():
+    async def session(ports):
+        async with Vyos(host=HOST, port=ports[0]) as v:
+            await v.login("vyos", "wrong")
+
+    with pytest.raises(Exception, match="Impossible to log in"):
+        run(session)
+
+
+def test_configure_and_exit():
+    command = "set interfaces ethernet eth1 address '10.0.0.1/24'"
+
+    async def session(ports):
+        async with TracedVyos(host=HOST, port=ports[0]) as v:
+            await v.login()
+            del v.modes[:]
+            await v.configure(command)
+            modes = list(v.modes)
+            commands = await v.get_configuration_commands()
+            await v.logout()
+            return modes, commands, v.mode
+
+    modes, commands, mode = run(session)
+    assert modes == [
+        ("configure", VyOSModes.CONFIGURATION),
+        (command, VyOSModes.CONFIGURATION),
+        ("commit", VyOSModes.CONFIGURATION),
+        ("save", VyOSModes.CONFIGURATION),
+        ("exit", VyOSModes.OPERATIONAL),
+    ]
+    assert command in commands
+    assert mode is VyOSModes.LOGGEDOUT
+
+
+def test_configure_without_commit():
+    async def session(ports):
+        async with Vyos(host=HOST, port=ports[0]) as v:
+            await v.login()
+            await v.configure("set system domain-name 'lab'", commit=False)
+            mode = v.mode
+            return mode, await v.get_configuration_commands()
+
+    mode, commands = run(session)
+    assert mode is VyOSModes.OPERATIONAL
+    assert "set system domain-name 'lab'" not in commands
+
+
+def test_send_command():
+    async def session(ports):
+        async with Vyos(host=HOST, port=ports[0]) as v:
+            await v.login()
+            output = await v.send_command("show version")
+            result = await v.run_command("show configuration commands")
+            return output, result
+
+    output, result = run(session)
+    assert output.startswith(b"show version\r\n")
+    assert b"Version:          VyOS 1.4-rolling-fake\r\n" in output
+    assert output.endswith(b"vyos@vyos1:~$ ")
+    assert result.mode is VyOSModes.OPERATIONAL
+    assert "set system host-name 'vyos'" in result.output.splitlines()
+    assert "vyos@vyos1" not in result.output
+
+
+def test_expect():
+    async def session(ports):
+        async with Vyos(host=HOST, port=ports[0]) as v:
+            await v.login()
+            v.write_line("show version")
+            return await v.expect([rb"Invalid", rb"Version: +(\S+)"], timeout=3)
+
+    index, match, text = run(session)
+    assert index == 1
+    assert match.group(1) == b"VyOS"
+    assert text.endswith(b"Version:          VyOS")
+
+
+def test_expect_timeout():
+    async def session(ports):
+        # without recovery characters, a silent console is not prompted again
+        async with Vyos(host=HOST, port=ports[0], recovery=()) as v:
+            await v.login()
+            v.write_line("show version")
+            r = await v.expect([rb"no such output"], timeout=0.2)
+            assert r[0] == -1 and r[1] is None
+            assert b"VyOS 1.4-rolling-fake" in r[2]
+            # no output at all, the console is silent at its prompt
+            await v.expect_prompt("silence")
+
+    with pytest.raises(Exception, match="Impossible to get any prompt"):
+        run(session)
+
+
+def test_expect_closed_connection():
+    async def session(ports):
+        async with Vyos(host=HOST, port=ports[0]) as v:
+            await v.login()
+            v.transport.close()
+            await v.expect([rb"no such output"], timeout=1)
+
+    with pytest.raises(EOFError):
+        run(session)
+
+
+def test_gather():
+    async def configure(port, n):
+        async with Vyos(host=HOST, port=port) as v:
+            await v.login()
+            await v.configure(f"set interfaces dummy dum0 address '10.0.0.{n}/32'")
+            commands = await v.get_configuration_commands()
+            await v.logout()
+        return commands
+
+    async def session(ports):
+        return await asyncio.gather(
+            *[configure(port, n) for n, port in enumerate(ports, 1)]
+        )
+
+    results = run(session, count=8, delay=0.01)
+    assert len(results) == 8
+    for n, commands in enumerate(results, 1):
+        assert f"set interfaces dummy dum0 address '10.0.0.{n}/32'" in commands
+
+
+def transcript(text, **options):
+    t = Transcript(**options)
+    for n in range(0, len(text), 7):
+        t.append(text[n : n + 7].encode())
+    return t
+
+
+def test_transcript_indexes():
+    text = "".join(f"line {n}\r\n" for n in range(50)) + "vyos@vyos1:~$ "
+    t = transcript(text)
+    lines = text.splitlines()
+    assert len(t) == len(lines) == 51
+    assert list(t) == lines
+    for n in (0, 10, 49, 50, -1, -4, -51):
+        assert t[n] == lines[n]
+    for key in (
+        slice(-4, None),
+        slice(10, 20, 3),
+        slice(None, None, -1),
+        slice(2, 0, -1),
+        slice(-1, -10, -2),
+        slice(40, 200),
+    ):
+        assert t[key] == lines[key]
+    with pytest.raises(IndexError):
+        t[51]
+
+
+def test_transcript_dropped_lines():
+    text = "".join(f"line {n}\n" for n in range(50))
+    t = transcript(text, max_lines=10)
+    lines = text.splitlines()
+    assert len(t) == 50
+    assert t[-4] == "line 46"
+    assert t[-10:] == lines[-10:]
+    assert t[:39:-1] == lines[:39:-1]
+    with pytest.raises(IndexError, match="no longer"):
+        t[39]
+    with pytest.raises(IndexError, match="no longer"):
+        t[::-1]